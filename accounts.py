@@ -0,0 +1,178 @@
+"""
+Server Money - 口座レジストリ
+
+このファイルは、口座ごとの残高・取引件数・最初と最後の取引日・クレジットカード設定を
+保持するaccountsテーブルの差分更新と再構築と、複数の口座を合計した残高推移の計算を提供します。
+"""
+
+from collections import defaultdict
+from sqlalchemy import bindparam, text
+from models import db, Account
+from archive import ledger_source, ledger_table_sql
+
+def _signed_amount(tx_type, amount):
+    return amount if tx_type == 'income' else -amount
+
+def apply_account_delta(removed=(), added=()):
+    """取引の追加・削除分を口座レジストリに反映する
+
+    呼び出し元のDBトランザクション内で実行されます。削除された取引が最初または最後の
+    取引だった場合のみ、(account, date, id)インデックスで最初と最後の取引日を
+    （アーカイブ済みの取引を含めて）求め直します。
+
+    Args:
+        removed (iterable): 削除された（または変更前の）取引のsummary_row形式タプル
+        added (iterable): 追加された（または変更後の）取引のsummary_row形式タプル
+    """
+    balance_delta = defaultdict(int)
+    count_delta = defaultdict(int)
+    removed_dates = defaultdict(list)
+    added_dates = defaultdict(list)
+
+    for account, date, tx_type, _item, amount in removed:
+        balance_delta[account] -= _signed_amount(tx_type, amount)
+        count_delta[account] -= 1
+        removed_dates[account].append(date)
+    for account, date, tx_type, _item, amount in added:
+        balance_delta[account] += _signed_amount(tx_type, amount)
+        count_delta[account] += 1
+        added_dates[account].append(date)
+
+    for name in count_delta:
+        account = db.session.get(Account, name)
+        if account is None:
+            account = Account(name=name, balance=0, transaction_count=0, is_credit_card=False)
+            db.session.add(account)
+
+        account.balance += balance_delta[name]
+        account.transaction_count += count_delta[name]
+
+        if account.transaction_count <= 0:
+            account.transaction_count = 0
+            account.balance = 0
+            account.first_date = None
+            account.last_date = None
+            continue
+
+        if any(date in (account.first_date, account.last_date) for date in removed_dates[name]):
+            source = ledger_source()
+            first_date, last_date = db.session.query(
+                db.func.min(source.date), db.func.max(source.date)
+            ).filter(source.account == name).one()
+            account.first_date = first_date
+            account.last_date = last_date
+        elif added_dates[name]:
+            new_first = min(added_dates[name])
+            new_last = max(added_dates[name])
+            if account.first_date is None or new_first < account.first_date:
+                account.first_date = new_first
+            if account.last_date is None or new_last > account.last_date:
+                account.last_date = new_last
+
+def reset_accounts():
+    """全口座の集計値を0件の状態に戻す（クレジットカード設定は保持）"""
+    Account.query.update({
+        Account.balance: 0,
+        Account.transaction_count: 0,
+        Account.first_date: None,
+        Account.last_date: None
+    })
+
+def rebuild_accounts(credit_card_items=()):
+    """取引テーブル（アーカイブ済みの取引を含む）から口座レジストリを作り直す（コミットは呼び出し元で行う）
+
+    Args:
+        credit_card_items (iterable): 新たに作成する口座に設定するクレジットカード項目
+
+    Returns:
+        int: 取引が存在する口座数
+    """
+    reset_accounts()
+    db.session.execute(text(
+        "INSERT INTO accounts (name, balance, transaction_count, first_date, last_date, is_credit_card) "
+        "SELECT a.name, s.balance, s.count, s.first_date, s.last_date, 0 FROM ("
+        "SELECT account_id, SUM(CASE WHEN type = 'income' THEN amount ELSE -amount END) AS balance, "
+        "COUNT(*) AS count, MIN(date) AS first_date, MAX(date) AS last_date "
+        f"FROM {ledger_table_sql()} GROUP BY account_id) AS s "
+        "JOIN account_names AS a ON a.id = s.account_id WHERE true "
+        "ON CONFLICT (name) DO UPDATE SET balance = excluded.balance, "
+        "transaction_count = excluded.transaction_count, "
+        "first_date = excluded.first_date, last_date = excluded.last_date"
+    ))
+    credit_card_items = list(credit_card_items)
+    if credit_card_items:
+        Account.query.filter(Account.name.in_(credit_card_items)).update(
+            {Account.is_credit_card: True}, synchronize_session=False
+        )
+    return Account.query.filter(Account.transaction_count > 0).count()
+
+def set_credit_card_flags(credit_card_items):
+    """クレジットカード設定を口座レジストリに反映する（コミットは呼び出し元で行う）
+
+    Args:
+        credit_card_items (list): クレジットカード項目として設定する口座名
+    """
+    Account.query.update({Account.is_credit_card: Account.name.in_(credit_card_items)},
+                         synchronize_session=False)
+
+def get_account_names():
+    """取引が存在する口座名の一覧を取得
+
+    Returns:
+        list: 名前順の口座名
+    """
+    rows = db.session.query(Account.name).filter(
+        Account.transaction_count > 0
+    ).order_by(Account.name).all()
+    return [row[0] for row in rows]
+
+def get_account_overview():
+    """取引が存在する口座の概要を取得
+
+    Returns:
+        list: 名前順の口座データの辞書
+    """
+    accounts = Account.query.filter(Account.transaction_count > 0).order_by(Account.name).all()
+    return [account.to_dict() for account in accounts]
+
+# 口座ごとの日末残高（その日の最後の取引の残高）の前日からの増減を日ごとに合計し、
+# 累積和で合計残高を求め、合計残高が変わった日だけを返す
+_TOTAL_BALANCE_HISTORY_SQL = (
+    "WITH day_end AS ("
+    "SELECT t.account_id, date(t.date) AS day, t.balance, "
+    "ROW_NUMBER() OVER (PARTITION BY t.account_id, date(t.date) ORDER BY t.date DESC, t.id DESC) AS position "
+    "FROM {ledger} AS t JOIN account_names AS a ON a.id = t.account_id "
+    "WHERE a.name IN :accounts), "
+    "deltas AS ("
+    "SELECT day, balance - COALESCE(LAG(balance) OVER (PARTITION BY account_id ORDER BY day), 0) AS delta "
+    "FROM day_end WHERE position = 1), "
+    "totals AS ("
+    "SELECT day, SUM(SUM(delta)) OVER (ORDER BY day ROWS UNBOUNDED PRECEDING) AS total "
+    "FROM deltas GROUP BY day) "
+    "SELECT day, total FROM ("
+    "SELECT day, total, LAG(total) OVER (ORDER BY day) AS previous FROM totals) "
+    "WHERE previous IS NULL OR total != previous ORDER BY day"
+)
+
+def get_total_balance_history(accounts):
+    """複数の口座の残高を合計した残高推移を取得
+
+    各口座の残高は最初の取引より前を0、取引のない日は前日の残高として合計します
+    （口座ごとの残高推移を日付ごとに足し合わせた値と同じです）。
+
+    Args:
+        accounts (list): 合計する口座名（クレジットカード項目の扱いは呼び出し元で解決済み）
+
+    Returns:
+        dict: dates（合計残高が変わった日、'YYYY-MM-DD'）とbalances（その日の合計残高）
+    """
+    if not accounts:
+        return {'dates': [], 'balances': []}
+    sql = text(_TOTAL_BALANCE_HISTORY_SQL.format(ledger=ledger_table_sql())).bindparams(
+        bindparam('accounts', expanding=True)
+    )
+    rows = db.session.execute(sql, {'accounts': list(accounts)}).all()
+    return {
+        'dates': [day for day, _total in rows],
+        'balances': [total for _day, total in rows]
+    }
@@ -23,47 +23,85 @@ Created: 2025
 License: MIT
 """
 
+import time
+
+# 起動時間の計測はモジュールの読み込みから開始する
+_IMPORT_STARTED = time.perf_counter()
+
 from flask import Flask
 from dotenv import load_dotenv
-from waitress import serve
 
 # .envファイルの読み込み
 load_dotenv()
 
-# 各モジュールのインポート
+# 各モジュールのインポート（サーバー本体はmain()で必要になるまで読み込まない）
 from config import init_config, setup_logging
 from models import db
-from utils import init_db
-from auth import check_auth_setup
+from database import init_engines
+from utils import init_db, StartupTimer
+from changes import compact_change_journal
+from cli import register_commands
+from assets import init_assets
+from write_queue import transaction_writer
+from tenants import init_tenants
+from server_timing import init_server_timing
+from memory_stats import memory_profiler
+from auth import check_auth_setup, init_login_attempt_store
 from routes.auth_routes import auth_bp
 from routes.api_routes import api_bp
 from routes.main_routes import main_bp
 
-def create_app():
+_IMPORT_SECONDS = time.perf_counter() - _IMPORT_STARTED
+
+def create_app(timer=None, instance_path=None):
     """Flaskアプリケーションファクトリ
     
+    Args:
+        timer (StartupTimer): 起動フェーズの計測に使用するタイマー（省略時は計測しない）
+        instance_path (str): データベースなどを置くインスタンスフォルダ（省略時は instance）
+    
     Returns:
         Flask: 設定済みのFlaskアプリケーション
     """
-    app = Flask(__name__)
+    timer = timer or StartupTimer()
     
-    # 設定とログの初期化
-    init_config(app)
-    setup_logging(app)
-    
-    # 認証設定の確認
-    if not check_auth_setup():
-        exit(1)
+    with timer.phase('設定・ログ'):
+        app = Flask(__name__, instance_path=instance_path)
+        
+        # 設定とログの初期化
+        init_config(app)
+        setup_logging(app)
     
-    app.logger.info("認証設定を確認しました")
+    with timer.phase('認証設定'):
+        # 認証設定の確認
+        if not check_auth_setup():
+            exit(1)
+        
+        app.logger.info("認証設定を確認しました")
+        
+        # ログイン試行履歴ストアの初期化
+        init_login_attempt_store(app)
     
-    # データベースの初期化
-    db.init_app(app)
+    with timer.phase('DB・ルート登録'):
+        # データベースの初期化
+        db.init_app(app)
+        init_engines(app)
+        transaction_writer.init_app(app)
+        init_server_timing(app)  # 処理時間の計測は他のbefore_requestより先に始める
+        init_tenants(app)
+        memory_profiler.init_app(app)
+        
+        # Blueprintの登録
+        app.register_blueprint(auth_bp)
+        app.register_blueprint(api_bp)
+        app.register_blueprint(main_bp)
+        
+        # 管理用CLIコマンドの登録
+        register_commands(app)
     
-    # Blueprintの登録
-    app.register_blueprint(auth_bp)
-    app.register_blueprint(api_bp)
-    app.register_blueprint(main_bp)
+    with timer.phase('静的ファイル'):
+        # 静的ファイルのビルド（変更がない場合は省略）とasset_urlの登録
+        init_assets(app)
     
     app.logger.info("アプリケーションの初期化が完了しました")
     
@@ -71,18 +109,35 @@ def create_app():
 
 def main():
     """メイン実行関数"""
+    timer = StartupTimer(started_at=_IMPORT_STARTED)
+    timer.phases.append(('モジュール読み込み', _IMPORT_SECONDS))
+    
     try:
-        app = create_app()
+        app = create_app(timer)
         app.logger.info("アプリケーションを開始しています...")
         
-        # データベースの初期化
-        init_db(app)
+        if app.config['TENANT_MODE']:
+            # ユーザーごとのデータベースは、最初のアクセス時にマイグレーションと整理を行う
+            app.logger.info("テナントのデータベースは最初のアクセス時に準備します")
+        else:
+            # データベースの初期化（スキーマが最新の場合は確認を省略）
+            with timer.phase('データベース'):
+                init_db(app)
+            
+            # 差分同期用の削除の記録が上限を超えていれば古いものから整理
+            with timer.phase('変更履歴の整理'), app.app_context():
+                removed = compact_change_journal(app.config['CHANGE_JOURNAL_MAX_TOMBSTONES'])
+                db.session.commit()
+                if removed:
+                    app.logger.info(f"変更履歴の削除の記録を整理しました: {removed}件")
+        
+        with timer.phase('サーバー読み込み'):
+            from server import run_server
         
-        # ホストIPを設定から取得
-        host_ip = app.config['HOST_IP']
+        app.logger.info(f"起動時間: {timer.report()}")
         
-        app.logger.info(f"サーバーを起動します (host={host_ip}, port=4000)")
-        serve(app, host=host_ip, port=4000)
+        # 設定に応じてサーバーを起動（シングル/マルチプロセス）
+        run_server(app)
         
     except KeyboardInterrupt:
         if 'app' in locals():
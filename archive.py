@@ -0,0 +1,211 @@
+"""
+Server Money - 年単位のアーカイブ
+
+このファイルは、締めた年の取引を取引テーブルからアーカイブテーブル（transaction_archive）へ移し、
+アーカイブした取引の収支を口座ごとの期首残高（opening_balances）に繰り越す機能と、
+読み取り時に要求された期間に応じて取引テーブル・アーカイブテーブル・その両方を選ぶ機能を提供します。
+
+アーカイブ済みの期間（archive_stateの境界より前）の取引は読み取り専用です。
+取引テーブルには境界以降の取引だけが残るため、残高の再計算や整合性チェックは期首残高を起点に
+取引テーブルだけで行えます。月次集計と口座レジストリはアーカイブした取引も含んだまま保持します。
+"""
+
+from datetime import datetime
+from sqlalchemy import bindparam, false, select, text, union_all
+from sqlalchemy.orm import aliased
+from models import db, Transaction, AccountName, OpeningBalance, ArchiveState, transaction_archive
+
+class ArchivedPeriodError(ValueError):
+    """アーカイブ済みの期間の取引を追加・変更・削除しようとした"""
+
+# 取引テーブル・アーカイブテーブル共通の列
+_COLUMNS = 'id, account_id, date, item_id, type, amount, balance'
+
+# 生のSQLのFROM句で全期間の取引を参照する式
+_LEDGER_SQL = f'(SELECT {_COLUMNS} FROM "transaction" UNION ALL SELECT {_COLUMNS} FROM transaction_archive)'
+
+# 移す取引の収支を口座ごとの期首残高に加算する
+_CARRY_FORWARD_SQL = text(
+    "INSERT INTO opening_balances (account_id, balance, transaction_count) "
+    "SELECT account_id, SUM(CASE WHEN type = 'income' THEN amount ELSE -amount END), COUNT(*) "
+    "FROM \"transaction\" WHERE date < :cutoff GROUP BY account_id "
+    "ON CONFLICT (account_id) DO UPDATE SET "
+    "balance = opening_balances.balance + excluded.balance, "
+    "transaction_count = opening_balances.transaction_count + excluded.transaction_count"
+).bindparams(bindparam('cutoff', type_=db.DateTime))
+
+_COPY_SQL = text(
+    f"INSERT INTO transaction_archive ({_COLUMNS}) "
+    f"SELECT {_COLUMNS} FROM \"transaction\" WHERE date < :cutoff ORDER BY id"
+).bindparams(bindparam('cutoff', type_=db.DateTime))
+
+_ARCHIVED_COUNTS_SQL = text(
+    "SELECT a.name, COUNT(*) FROM \"transaction\" AS t JOIN account_names AS a ON a.id = t.account_id "
+    "WHERE t.date < :cutoff GROUP BY t.account_id ORDER BY a.name"
+).bindparams(bindparam('cutoff', type_=db.DateTime))
+
+_DELETE_SQL = text(
+    "DELETE FROM \"transaction\" WHERE date < :cutoff"
+).bindparams(bindparam('cutoff', type_=db.DateTime))
+
+# ORMで取引を読むためのエンティティ（Transactionと同じ属性・to_dictを使える）
+# 口座名・項目名の結合条件は取引テーブルの列から対応付けられるため、アーカイブテーブルだけを読む場合も
+# 取引テーブルを常に偽の条件（SQLiteは走査せずに省く）で除いたUNION ALLにする
+_archive_entity = aliased(Transaction, union_all(
+    select(Transaction.__table__).where(false()), select(transaction_archive)
+).subquery('archive'), name='archive')
+_ledger_entity = aliased(Transaction, union_all(
+    select(Transaction.__table__), select(transaction_archive)
+).subquery('ledger'), name='ledger')
+
+def get_archive_boundary():
+    """アーカイブ済みの期間の境界を取得
+
+    Returns:
+        datetime: この日時より前の取引はアーカイブ済み（アーカイブしていない場合はNone）
+    """
+    return db.session.execute(select(ArchiveState.archived_before).where(ArchiveState.id == 1)).scalar()
+
+def ensure_writable(*dates):
+    """アーカイブ済みの期間の日時が含まれていないことを確認する
+
+    Args:
+        *dates (datetime): 書き込む取引の日時（変更前・変更後の両方）
+
+    Raises:
+        ArchivedPeriodError: アーカイブ済みの期間の日時が含まれている場合
+    """
+    boundary = get_archive_boundary()
+    if boundary is not None and any(date < boundary for date in dates):
+        raise ArchivedPeriodError(f'{boundary.year - 1}年以前の取引はアーカイブ済みのため変更できません')
+
+def ensure_not_archived(transaction_id):
+    """取引がアーカイブ済みでないことを確認する（取引テーブルに見つからなかった取引に使用）
+
+    Args:
+        transaction_id (int): 取引ID
+
+    Raises:
+        ArchivedPeriodError: アーカイブテーブルにある取引の場合
+    """
+    archived = db.session.execute(
+        select(transaction_archive.c.id).where(transaction_archive.c.id == transaction_id)
+    ).first()
+    if archived is not None:
+        raise ArchivedPeriodError('アーカイブ済みの取引は変更できません')
+
+def ledger_source(start=None, end=None):
+    """指定期間の取引を読むためのエンティティを取得
+
+    期間がアーカイブの境界以降だけの場合は取引テーブル、境界より前だけの場合はアーカイブテーブル、
+    両方にまたがる場合は2つのテーブルを合わせたサブクエリを返します。
+    いずれもTransactionと同じ属性（account・itemの名前での比較を含む）で条件を指定できます。
+
+    Args:
+        start (datetime): 期間の開始（含む、Noneの場合は制限なし）
+        end (datetime): 期間の終了（含まない、Noneの場合は制限なし）
+
+    Returns:
+        Transaction、またはTransactionの別名エンティティ
+    """
+    boundary = get_archive_boundary()
+    if boundary is None or (start is not None and start >= boundary):
+        return Transaction
+    if end is not None and end <= boundary:
+        return _archive_entity
+    return _ledger_entity
+
+def ledger_table_sql():
+    """生のSQLのFROM句で全期間の取引を参照する式を取得
+
+    Returns:
+        str: アーカイブがある場合は2つのテーブルを合わせたサブクエリ、ない場合は取引テーブル
+    """
+    return _LEDGER_SQL if get_archive_boundary() is not None else '"transaction"'
+
+def ledger_tables():
+    """全期間の取引を持つテーブル名を古い順に取得（生のSQLで各テーブルを個別に読む場合に使用）
+
+    Returns:
+        list: アーカイブがある場合は['transaction_archive', '"transaction"']、ない場合は['"transaction"']
+    """
+    return ['transaction_archive', '"transaction"'] if get_archive_boundary() is not None else ['"transaction"']
+
+def get_opening_balance(account):
+    """口座の期首残高を取得
+
+    Args:
+        account (str): 口座名
+
+    Returns:
+        int: アーカイブした取引の収支の合計（アーカイブしていない場合は0）
+    """
+    balance = db.session.execute(
+        select(OpeningBalance.balance).join(AccountName, AccountName.id == OpeningBalance.account_id)
+        .where(AccountName.name == account)
+    ).scalar()
+    return balance or 0
+
+def archive_years_before(year):
+    """指定した年より前の取引をアーカイブテーブルへ移し、期首残高に繰り越す（コミットは呼び出し元で行う）
+
+    新しいDBトランザクションの最初に呼び出すこと。BEGIN IMMEDIATEで書き込みロックを先に取得し、
+    繰り越す金額の集計から取引の移動までの間に他のプロセスの書き込みが割り込まないようにします。
+    取引IDは変わらず、移動は変更履歴に記録しないため、クライアントのキャッシュはそのまま使えます。
+
+    Args:
+        year (int): この年の1月1日より前の取引をアーカイブする（今年以前）
+
+    Returns:
+        dict: archived_before（新しい境界）、archived_count（移した取引数）、
+            accounts（口座名 -> 移した取引数）
+
+    Raises:
+        ValueError: 今年より後の年、またはアーカイブ済みの境界以前の年を指定した場合
+    """
+    from ledger import bump_data_version
+    from changes import deletes_not_journaled
+
+    if year > datetime.now().year:
+        raise ValueError(f'{year - 1}年はまだ締まっていないためアーカイブできません')
+    cutoff = datetime(year, 1, 1)
+
+    db.session.execute(text('BEGIN IMMEDIATE'))
+    boundary = get_archive_boundary()
+    if boundary is not None and cutoff <= boundary:
+        raise ValueError(f'{boundary.year - 1}年以前は既にアーカイブ済みです')
+
+    params = {'cutoff': cutoff}
+    accounts = dict(db.session.execute(_ARCHIVED_COUNTS_SQL, params).all())
+    if accounts:
+        db.session.execute(_CARRY_FORWARD_SQL, params)
+        db.session.execute(_COPY_SQL, params)
+        with deletes_not_journaled():
+            db.session.execute(_DELETE_SQL, params)
+        # 内容は変わらないが、取引テーブルを前提にしたプロセス内のキャッシュを読み直させる
+        bump_data_version(accounts=accounts)
+
+    state = db.session.get(ArchiveState, 1)
+    if state is None:
+        db.session.add(ArchiveState(id=1, archived_before=cutoff))
+    else:
+        state.archived_before = cutoff
+
+    return {
+        'archived_before': cutoff,
+        'archived_count': sum(accounts.values()),
+        'accounts': accounts
+    }
+
+def clear_archive():
+    """アーカイブテーブル・期首残高・境界を削除する（全取引の置き換え時に使用、コミットは呼び出し元で行う）
+
+    Returns:
+        bool: アーカイブがあった場合True
+    """
+    if get_archive_boundary() is None:
+        return False
+    db.session.execute(transaction_archive.delete())
+    db.session.query(OpeningBalance).delete()
+    db.session.query(ArchiveState).delete()
+    return True
@@ -0,0 +1,324 @@
+"""
+Server Money - 静的ファイルのビルド
+
+このファイルは、static配下のJavaScript・CSSを軽量化（コメントとインデントの除去）し、
+内容のハッシュを含むファイル名でstatic/distに書き出すビルド処理と、
+テンプレートからマニフェスト経由でURLを解決するasset_url関数を提供します。
+
+ハッシュ付きのファイルは内容が変わるとURLも変わるため、
+Cache-Control: immutable で長期間キャッシュさせます。
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+
+# ビルド対象（staticフォルダからの相対パス）
+ASSET_SOURCES = ['js/main.js', 'css/style.css', 'favicon.svg']
+
+# ビルド結果の出力先（staticフォルダからの相対パス）
+DIST_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+
+# ハッシュ付きファイルのキャッシュ期間（秒）
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+# 正規表現リテラルの直前に来うる予約語
+_REGEX_PRECEDING_WORDS = {
+    'return', 'typeof', 'case', 'do', 'else', 'in', 'of', 'new', 'delete',
+    'void', 'throw', 'instanceof', 'yield', 'await'
+}
+
+def _regex_allowed(output):
+    """出力済みのコードから、次の/が正規表現リテラルの開始かどうかを判定"""
+    index = len(output) - 1
+    while index >= 0 and output[index] in ' \n':
+        index -= 1
+    if index < 0:
+        return True
+    last = output[index]
+    if last in '(,=:[!&|?{};+-*%<>~^':
+        return True
+    if last.isalnum() or last in '_$':
+        end = index + 1
+        while index >= 0 and (output[index].isalnum() or output[index] in '_$'):
+            index -= 1
+        return ''.join(output[index + 1:end]) in _REGEX_PRECEDING_WORDS
+    return False
+
+def minify_js(source):
+    """JavaScriptからコメント・インデント・空行を除去する
+
+    自動セミコロン挿入の挙動を変えないよう、改行は1つにまとめるだけで残します。
+    文字列・テンプレートリテラル・正規表現リテラルの中身は変更しません。
+
+    Args:
+        source (str): JavaScriptのソース
+
+    Returns:
+        str: 軽量化されたソース
+    """
+    output = []
+    pending = None          # 次のトークンの前に出力する空白（' ' または '\n'）
+    template_depth = []     # テンプレートリテラルの${}内にいる場合の波括弧の深さ
+    i = 0
+    length = len(source)
+
+    def flush():
+        nonlocal pending
+        if pending and output and output[-1] != '\n':
+            output.append(pending)
+        pending = None
+
+    def copy_template(start):
+        """テンプレートリテラルを`または${の直後まで出力し、次の位置と${で終わったかを返す"""
+        j = start
+        while j < length:
+            char = source[j]
+            if char == '\\':
+                output.append(source[j:j + 2])
+                j += 2
+                continue
+            if char == '`':
+                output.append(char)
+                return j + 1, False
+            if char == '$' and j + 1 < length and source[j + 1] == '{':
+                output.append('${')
+                return j + 2, True
+            output.append(char)
+            j += 1
+        return j, False
+
+    while i < length:
+        char = source[i]
+        next_char = source[i + 1] if i + 1 < length else ''
+
+        if char in ' \t\r\n':
+            if char == '\n':
+                pending = '\n'
+            elif pending is None:
+                pending = ' '
+            i += 1
+        elif char == '/' and next_char == '/':
+            while i < length and source[i] != '\n':
+                i += 1
+        elif char == '/' and next_char == '*':
+            end = source.find('*/', i + 2)
+            end = length if end < 0 else end + 2
+            if '\n' in source[i:end]:
+                pending = '\n'
+            elif pending is None:
+                pending = ' '
+            i = end
+        elif char in '\'"':
+            flush()
+            j = i + 1
+            while j < length and source[j] != char and source[j] != '\n':
+                j += 2 if source[j] == '\\' else 1
+            output.append(source[i:j + 1])
+            i = j + 1
+        elif char == '`':
+            flush()
+            output.append(char)
+            i, opened = copy_template(i + 1)
+            if opened:
+                template_depth.append(0)
+        elif char == '/' and _regex_allowed(output):
+            flush()
+            j = i + 1
+            in_class = False
+            while j < length and source[j] != '\n':
+                if source[j] == '\\':
+                    j += 2
+                    continue
+                if source[j] == '[':
+                    in_class = True
+                elif source[j] == ']':
+                    in_class = False
+                elif source[j] == '/' and not in_class:
+                    break
+                j += 1
+            j += 1
+            while j < length and (source[j].isalnum() or source[j] == '_'):
+                j += 1
+            output.append(source[i:j])
+            i = j
+        else:
+            flush()
+            if template_depth:
+                if char == '{':
+                    template_depth[-1] += 1
+                elif char == '}':
+                    if template_depth[-1] == 0:
+                        # ${}の終わり: テンプレートリテラルの続きを出力する
+                        template_depth.pop()
+                        output.append(char)
+                        i, opened = copy_template(i + 1)
+                        if opened:
+                            template_depth.append(0)
+                        continue
+                    template_depth[-1] -= 1
+            output.append(char)
+            i += 1
+
+    return ''.join(output).strip() + '\n'
+
+def minify_css(source):
+    """CSSからコメントと不要な空白を除去する
+
+    Args:
+        source (str): CSSのソース
+
+    Returns:
+        str: 軽量化されたソース
+    """
+    output = []
+    pending = False
+    i = 0
+    length = len(source)
+    while i < length:
+        char = source[i]
+        if char in ' \t\r\n':
+            pending = True
+            i += 1
+        elif char == '/' and source.startswith('/*', i):
+            end = source.find('*/', i + 2)
+            i = length if end < 0 else end + 2
+            pending = True
+        elif char in '{};,':
+            if char == '}' and output and output[-1] == ';':
+                output.pop()
+            output.append(char)
+            pending = False
+            i += 1
+        else:
+            if pending and output and output[-1] not in '{};,':
+                output.append(' ')
+            pending = False
+            if char in '\'"':
+                j = i + 1
+                while j < length and source[j] != char:
+                    j += 2 if source[j] == '\\' else 1
+                output.append(source[i:j + 1])
+                i = j + 1
+            else:
+                output.append(char)
+                i += 1
+    return ''.join(output).strip() + '\n'
+
+_MINIFIERS = {'.js': minify_js, '.css': minify_css}
+
+def _hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def _read_manifest(static_folder):
+    try:
+        with open(os.path.join(static_folder, DIST_DIR, MANIFEST_NAME), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def build_assets(static_folder, force=False):
+    """静的ファイルを軽量化し、ハッシュ付きのファイル名でstatic/distに書き出す
+
+    元のファイルの内容がマニフェストに記録されたものと同じ場合は何もしません。
+    古いビルド結果は、直前の世代（キャッシュ済みのページから参照されうる）を残して削除します。
+
+    Args:
+        static_folder (str): staticフォルダのパス
+        force (bool): 変更がなくても作り直す場合True
+
+    Returns:
+        tuple: (manifest, built) マニフェストの辞書と、書き出しを行った場合True
+    """
+    sources = {}
+    for name in ASSET_SOURCES:
+        with open(os.path.join(static_folder, name), 'rb') as f:
+            sources[name] = f.read()
+
+    previous = _read_manifest(static_folder)
+    source_hashes = {name: _hash(data) for name, data in sources.items()}
+    if not force and previous and previous.get('sources') == source_hashes and all(
+        os.path.exists(os.path.join(static_folder, path)) for path in previous.get('assets', {}).values()
+    ):
+        return previous, False
+
+    assets = {}
+    for name, data in sources.items():
+        base, ext = os.path.splitext(name)
+        minify = _MINIFIERS.get(ext)
+        if minify:
+            data = minify(data.decode('utf-8')).encode('utf-8')
+        path = f'{DIST_DIR}/{base}.{_hash(data)[:10]}{ext}'
+        full_path = os.path.join(static_folder, path)
+        if not os.path.exists(full_path):
+            _write_atomic(full_path, data)
+        assets[name] = path
+
+    manifest = {'sources': source_hashes, 'assets': assets}
+    _write_atomic(
+        os.path.join(static_folder, DIST_DIR, MANIFEST_NAME),
+        json.dumps(manifest, ensure_ascii=False, indent=2).encode('utf-8')
+    )
+
+    keep = set(assets.values()) | set((previous or {}).get('assets', {}).values())
+    dist_root = os.path.join(static_folder, DIST_DIR)
+    for directory, _dirs, files in os.walk(dist_root):
+        for filename in files:
+            path = os.path.relpath(os.path.join(directory, filename), static_folder).replace(os.sep, '/')
+            if filename != MANIFEST_NAME and path not in keep:
+                os.remove(os.path.join(directory, filename))
+
+    return manifest, True
+
+def init_assets(app):
+    """静的ファイルをビルドし、テンプレート用のasset_urlとキャッシュヘッダーを設定
+
+    ビルドに失敗した場合（staticフォルダに書き込めないなど）は、元のファイルをそのまま配信します。
+
+    Args:
+        app: Flaskアプリケーションインスタンス
+    """
+    from flask import request, url_for
+
+    manifest_assets = {}
+    if app.config['ASSET_PIPELINE_ENABLED']:
+        try:
+            manifest, built = build_assets(app.static_folder)
+            manifest_assets = manifest['assets']
+            if built:
+                app.logger.info(f"静的ファイルをビルドしました: {', '.join(manifest_assets.values())}")
+        except Exception as e:
+            app.logger.warning(f"静的ファイルのビルドに失敗したため、元のファイルを配信します: {e}")
+
+    def asset_url(filename):
+        """ビルド済みのファイルがあればそのURLを、なければ元のファイルのURLを返す"""
+        return url_for('static', filename=manifest_assets.get(filename, filename))
+
+    app.jinja_env.globals['asset_url'] = asset_url
+
+    dist_prefix = f'{DIST_DIR}/'
+
+    @app.after_request
+    def set_immutable_cache(response):
+        if (request.endpoint == 'static' and response.status_code == 200
+                and (request.view_args or {}).get('filename', '').startswith(dist_prefix)
+                and not request.view_args['filename'].endswith(MANIFEST_NAME)):
+            response.cache_control.public = True
+            response.cache_control.max_age = IMMUTABLE_MAX_AGE
+            response.cache_control.immutable = True
+            response.cache_control.no_cache = None
+        return response
@@ -0,0 +1,86 @@
+"""
+Server Money - 台帳の整合性チェック
+
+このファイルは、取引テーブルに保存された残高（balance）が、口座ごとに(date, id)順で
+積み上げた収支と一致しているかを1つのウィンドウ関数クエリで検査し、
+最初にずれた取引以降だけを再計算して修復する機能を提供します。
+アーカイブ済みの取引は読み取り専用のため検査せず、口座ごとの期首残高を積み上げの起点にします。
+"""
+
+from datetime import datetime
+from sqlalchemy import text
+from models import db
+
+_AUDIT_SQL = text(
+    "WITH running AS ("
+    "SELECT t.account_id, t.id, t.date, t.balance, COALESCE(o.balance, 0) + "
+    "SUM(CASE WHEN t.type = 'income' THEN t.amount ELSE -t.amount END) OVER ("
+    "PARTITION BY t.account_id ORDER BY t.date, t.id ROWS UNBOUNDED PRECEDING) AS expected "
+    "FROM \"transaction\" AS t LEFT JOIN opening_balances AS o ON o.account_id = t.account_id), "
+    "divergent AS ("
+    "SELECT account_id, id, date, balance, expected, "
+    "ROW_NUMBER() OVER (PARTITION BY account_id ORDER BY date, id) AS position, "
+    "COUNT(*) OVER (PARTITION BY account_id) AS divergent_count "
+    "FROM running WHERE balance != expected) "
+    "SELECT a.name, d.id, d.date, d.balance, d.expected, d.divergent_count "
+    "FROM divergent AS d JOIN account_names AS a ON a.id = d.account_id "
+    "WHERE d.position = 1 ORDER BY a.name"
+)
+
+def _parse_date(value):
+    return value if isinstance(value, datetime) else datetime.fromisoformat(str(value))
+
+def find_balance_divergences():
+    """保存された残高が積み上げた収支と一致しない口座を検出
+
+    Returns:
+        list: 口座ごとの最初にずれた取引の情報（account, first_id, first_date,
+            stored_balance, expected_balance, divergent_count）の辞書のリスト
+    """
+    return [
+        {
+            'account': account,
+            'first_id': tx_id,
+            'first_date': _parse_date(tx_date),
+            'stored_balance': balance,
+            'expected_balance': expected,
+            'divergent_count': divergent_count
+        }
+        for account, tx_id, tx_date, balance, expected, divergent_count
+        in db.session.execute(_AUDIT_SQL).all()
+    ]
+
+def repair_balance_divergences(divergences=None):
+    """ずれが見つかった口座の残高を、最初にずれた取引の日時以降だけ再計算する（コミットは呼び出し元で行う）
+
+    Args:
+        divergences (list): find_balance_divergencesの結果（Noneの場合は検査から行う）
+
+    Returns:
+        list: 各口座の検査結果に、更新した取引数（repaired_count）を加えた辞書のリスト
+    """
+    from utils import rebalance_account
+    from ledger import bump_data_version
+
+    if divergences is None:
+        divergences = find_balance_divergences()
+    if not divergences:
+        return []
+
+    for divergence in divergences:
+        divergence['repaired_count'] = rebalance_account(divergence['account'], divergence['first_date'])
+    bump_data_version(accounts=[divergence['account'] for divergence in divergences])
+    return divergences
+
+def format_divergence(divergence):
+    """検査結果をJSON化できる形式に変換
+
+    Args:
+        divergence (dict): find_balance_divergencesの要素
+
+    Returns:
+        dict: 日付を文字列にした辞書
+    """
+    result = dict(divergence)
+    result['first_date'] = divergence['first_date'].strftime('%Y-%m-%d %H:%M:%S')
+    return result
@@ -6,54 +6,378 @@ Server Money - 認証システム
 """
 
 import os
+import time
+import sqlite3
+import threading
 import bcrypt
-from datetime import datetime, timedelta
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import closing
 from functools import wraps
 from flask import session, request, jsonify, redirect, url_for
+from server_timing import timing_phase
 
-# ログイン試行回数制限のためのメモリ辞書
-login_attempts = {}
+# ログイン試行回数制限の設定
 LOGIN_ATTEMPT_LIMIT = 5
-LOCKOUT_DURATION = 30  # 30分
+LOCKOUT_DURATION = 30  # 30分（失敗回数を数えるスライディングウィンドウの幅も兼ねる）
+
+class MemoryLoginAttemptStore:
+    """プロセス内メモリにログイン失敗履歴を保持するストア
+
+    IPアドレスごとに直近の失敗時刻を保持し、スライディングウィンドウで
+    失敗回数を数えます。ウィンドウを過ぎたエントリは破棄され（TTL）、
+    エントリ数が上限を超えた場合は最も古いものから削除されます。
+    全ての操作はロックで保護されるため、waitressの複数スレッドから安全に使用できます。
+    """
+
+    def __init__(self, limit=LOGIN_ATTEMPT_LIMIT, window_seconds=LOCKOUT_DURATION * 60, max_entries=10000):
+        self.limit = limit
+        self.window_seconds = window_seconds
+        self.max_entries = max_entries
+        self._attempts = OrderedDict()  # ip -> deque[失敗時刻(epoch秒)]
+        self._lock = threading.Lock()
+
+    def _prune(self, now):
+        """ウィンドウ外になったエントリを削除する（ロック取得済みで呼び出すこと）"""
+        cutoff = now - self.window_seconds
+        # OrderedDictは最終失敗時刻の古い順に並んでいるため、先頭から削除すればよい
+        while self._attempts:
+            ip_address, failures = next(iter(self._attempts.items()))
+            if failures and failures[-1] > cutoff:
+                break
+            del self._attempts[ip_address]
+
+    def _count(self, ip_address, now):
+        failures = self._attempts.get(ip_address)
+        if not failures:
+            return 0
+        cutoff = now - self.window_seconds
+        return sum(1 for ts in failures if ts > cutoff)
+
+    def failure_count(self, ip_address):
+        """ウィンドウ内の失敗回数を取得
+
+        Args:
+            ip_address (str): IPアドレス
+
+        Returns:
+            int: 失敗回数
+        """
+        now = time.time()
+        with self._lock:
+            self._prune(now)
+            return self._count(ip_address, now)
+
+    def record_failure(self, ip_address):
+        """失敗を記録
+
+        Args:
+            ip_address (str): IPアドレス
+        """
+        now = time.time()
+        with self._lock:
+            self._prune(now)
+            failures = self._attempts.pop(ip_address, None)
+            if failures is None:
+                # 判定に必要なのは直近limit件のみ
+                failures = deque(maxlen=self.limit)
+            failures.append(now)
+            self._attempts[ip_address] = failures
+            while len(self._attempts) > self.max_entries:
+                self._attempts.popitem(last=False)
+
+    def reset(self, ip_address):
+        """失敗履歴をリセット
+
+        Args:
+            ip_address (str): IPアドレス
+        """
+        with self._lock:
+            self._attempts.pop(ip_address, None)
+
+class SQLiteLoginAttemptStore:
+    """SQLiteファイルにログイン失敗履歴を保持するストア
+
+    マルチプロセスモードで全ワーカーが同じ試行制限を共有するために使用します。
+    接続は操作ごとに開くため、スレッド間で共有されません。
+    """
+
+    def __init__(self, path, limit=LOGIN_ATTEMPT_LIMIT, window_seconds=LOCKOUT_DURATION * 60):
+        self.path = path
+        self.limit = limit
+        self.window_seconds = window_seconds
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS login_attempt ("
+                "ip_address TEXT NOT NULL, attempted_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_login_attempt_ip_time "
+                "ON login_attempt (ip_address, attempted_at)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_login_attempt_time ON login_attempt (attempted_at)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5)
+
+    def failure_count(self, ip_address):
+        """ウィンドウ内の失敗回数を取得
+
+        Args:
+            ip_address (str): IPアドレス
+
+        Returns:
+            int: 失敗回数
+        """
+        cutoff = time.time() - self.window_seconds
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT COUNT(*) FROM login_attempt WHERE ip_address = ? AND attempted_at > ?",
+                (ip_address, cutoff)
+            ).fetchone()
+        return row[0]
+
+    def record_failure(self, ip_address):
+        """失敗を記録（ウィンドウ外になった履歴はここで削除する）
+
+        Args:
+            ip_address (str): IPアドレス
+        """
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM login_attempt WHERE attempted_at <= ?", (now - self.window_seconds,))
+            conn.execute(
+                "INSERT INTO login_attempt (ip_address, attempted_at) VALUES (?, ?)",
+                (ip_address, now)
+            )
+
+    def reset(self, ip_address):
+        """失敗履歴をリセット
+
+        Args:
+            ip_address (str): IPアドレス
+        """
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM login_attempt WHERE ip_address = ?", (ip_address,))
+
+# ログイン試行履歴のストア（init_login_attempt_storeで差し替え）
+login_attempt_store = MemoryLoginAttemptStore()
+
+def init_login_attempt_store(app):
+    """設定に応じてログイン試行履歴のストアを初期化
+
+    LOGIN_ATTEMPT_STOREが'auto'の場合、マルチプロセスモードではSQLite、
+    それ以外ではメモリを使用します。
+
+    Args:
+        app: Flaskアプリケーションインスタンス
+    """
+    global login_attempt_store
+
+    store_type = app.config['LOGIN_ATTEMPT_STORE']
+    if store_type == 'auto':
+        store_type = 'sqlite' if app.config['SERVER_WORKERS'] > 1 else 'memory'
+
+    if store_type == 'sqlite':
+        path = app.config['LOGIN_ATTEMPT_DB_PATH'] or os.path.join(app.instance_path, 'login_attempts.db')
+        login_attempt_store = SQLiteLoginAttemptStore(path)
+        app.logger.info(f"ログイン試行履歴ストア: SQLite ({path})")
+    else:
+        if store_type != 'memory':
+            app.logger.warning(f"不明なLOGIN_ATTEMPT_STORE '{store_type}' のため、メモリストアを使用します")
+        login_attempt_store = MemoryLoginAttemptStore(max_entries=app.config['LOGIN_ATTEMPT_MAX_ENTRIES'])
+        app.logger.info("ログイン試行履歴ストア: メモリ")
+
+class PasswordVerificationBusy(Exception):
+    """パスワード検証プールの待ち行列が満杯の場合に送出される例外"""
+
+# bcrypt専用のスレッドプール（初回使用時に生成。fork後の各ワーカーでも個別に生成される）
+_bcrypt_executor = None
+_bcrypt_slots = None
+_bcrypt_pool_lock = threading.Lock()
+_env_update_lock = threading.Lock()
+
+def _get_bcrypt_pool():
+    """bcrypt専用のスレッドプールと受付枠を取得
+
+    Returns:
+        tuple: (ThreadPoolExecutor, BoundedSemaphore)
+    """
+    global _bcrypt_executor, _bcrypt_slots
+    from flask import current_app
+
+    with _bcrypt_pool_lock:
+        if _bcrypt_executor is None:
+            workers = max(1, current_app.config['BCRYPT_POOL_WORKERS'])
+            queue_size = max(0, current_app.config['BCRYPT_QUEUE_SIZE'])
+            _bcrypt_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bcrypt')
+            # 実行中 + 待機中の合計がこの枠を超えたら即座に拒否する
+            _bcrypt_slots = threading.BoundedSemaphore(workers + queue_size)
+        return _bcrypt_executor, _bcrypt_slots
+
+def _run_in_bcrypt_pool(func, *args):
+    """bcrypt処理を専用プールで実行し、結果を待つ
+
+    Args:
+        func: 実行する関数
+        *args: 関数の引数
+
+    Returns:
+        関数の戻り値
+
+    Raises:
+        PasswordVerificationBusy: 受付枠が満杯、またはタイムアウトした場合
+    """
+    from flask import current_app
+
+    executor, slots = _get_bcrypt_pool()
+    if not slots.acquire(blocking=False):
+        raise PasswordVerificationBusy()
+
+    try:
+        future = executor.submit(func, *args)
+    except Exception:
+        slots.release()
+        raise
+    future.add_done_callback(lambda _: slots.release())
+
+    try:
+        return future.result(timeout=current_app.config['BCRYPT_TIMEOUT'])
+    except FutureTimeoutError:
+        raise PasswordVerificationBusy()
+
+def _checkpw(password_bytes, hash_bytes):
+    return bcrypt.checkpw(password_bytes, hash_bytes)
+
+def get_bcrypt_rounds(hash_str):
+    """bcryptハッシュに含まれるコスト（ラウンド数）を取得
+
+    Args:
+        hash_str (str): bcryptハッシュ（例: $2b$12$...）
+
+    Returns:
+        int: コスト。解析できない場合はNone
+    """
+    try:
+        return int(hash_str.split('$')[2])
+    except (IndexError, ValueError):
+        return None
 
 def verify_password(password, hash_str):
     """パスワード検証
     
+    bcryptの計算はwaitressのワーカースレッドではなく専用プールで実行されます。
+    
     Args:
         password (str): 入力されたパスワード
         hash_str (str): bcryptハッシュ化されたパスワード
         
     Returns:
         bool: パスワードが正しい場合True
+        
+    Raises:
+        PasswordVerificationBusy: 検証プールが混雑している場合
     """
     try:
         password_bytes = password.encode('utf-8')
         hash_bytes = hash_str.encode('utf-8')
-        return bcrypt.checkpw(password_bytes, hash_bytes)
+        with timing_phase('auth'):
+            return _run_in_bcrypt_pool(_checkpw, password_bytes, hash_bytes)
+    except PasswordVerificationBusy:
+        raise
     except Exception as e:
         from flask import current_app
         current_app.logger.error(f"パスワード検証エラー: {e}")
         return False
 
+def get_login_password_hash(username):
+    """ユーザー名に対応するパスワードハッシュを取得
+
+    マルチテナントモードではユーザーファイル（tenants.py）、それ以外では
+    LOGIN_USERNAME / LOGIN_PASSWORD_HASH を参照します。
+
+    Args:
+        username (str): 入力されたユーザー名
+
+    Returns:
+        str: bcryptハッシュ（該当するユーザーがいない場合None）
+    """
+    from flask import current_app
+
+    if current_app.config['TENANT_MODE']:
+        from tenants import tenant_users
+        return tenant_users.get_password_hash(username)
+    if username != os.getenv('LOGIN_USERNAME'):
+        return None
+    return os.getenv('LOGIN_PASSWORD_HASH')
+
+def rehash_password_if_needed(password, hash_str, username=None):
+    """ハッシュのコストが現在の設定と異なる場合、パスワードを再ハッシュして保存
+
+    ログイン成功直後（平文パスワードが手元にある時）に呼び出します。
+    再ハッシュは検証と同じ専用プールで実行し、混雑時は次回のログインに見送ります。
+
+    Args:
+        password (str): 検証済みの平文パスワード
+        hash_str (str): 現在のbcryptハッシュ
+        username (str): ユーザー名（マルチテナントモードでユーザーファイルに保存する場合）
+
+    Returns:
+        bool: 再ハッシュした場合True
+    """
+    from flask import current_app
+    from auth_setup import hash_password, update_env_value
+
+    target_rounds = current_app.config['BCRYPT_ROUNDS']
+    current_rounds = get_bcrypt_rounds(hash_str)
+    if current_rounds == target_rounds:
+        return False
+
+    try:
+        new_hash = _run_in_bcrypt_pool(hash_password, password, target_rounds)
+    except PasswordVerificationBusy:
+        current_app.logger.info("パスワード検証プールが混雑しているため、再ハッシュを見送りました")
+        return False
+
+    if current_app.config['TENANT_MODE']:
+        from tenants import tenant_users
+        try:
+            tenant_users.set_password_hash(username, new_hash)
+        except (OSError, ValueError) as e:
+            current_app.logger.error(f"ユーザーファイルへのパスワードハッシュ保存に失敗しました: {e}")
+            return False
+        current_app.logger.info(f"パスワードハッシュのコストを更新しました ({current_rounds} -> {target_rounds})")
+        return True
+
+    with _env_update_lock:
+        os.environ['LOGIN_PASSWORD_HASH'] = new_hash
+        try:
+            update_env_value('LOGIN_PASSWORD_HASH', new_hash)
+        except OSError as e:
+            current_app.logger.error(f".envファイルへのパスワードハッシュ保存に失敗しました: {e}")
+            return False
+
+    current_app.logger.info(f"パスワードハッシュのコストを更新しました ({current_rounds} -> {target_rounds})")
+    return True
+
 def is_ip_locked(ip_address):
     """IPアドレスがロックされているかチェック
     
+    直近LOCKOUT_DURATION分間の失敗回数がLOGIN_ATTEMPT_LIMIT以上の場合にロックされます。
+    
     Args:
         ip_address (str): IPアドレス
         
     Returns:
         bool: ロックされている場合True
     """
-    if ip_address in login_attempts:
-        attempts, last_attempt = login_attempts[ip_address]
-        if attempts >= LOGIN_ATTEMPT_LIMIT:
-            time_since_last = datetime.now() - last_attempt
-            if time_since_last.total_seconds() < LOCKOUT_DURATION * 60:
-                return True
-            else:
-                # ロック期間が過ぎたらリセット
-                del login_attempts[ip_address]
-    return False
+    return login_attempt_store.failure_count(ip_address) >= LOGIN_ATTEMPT_LIMIT
 
 def record_login_attempt(ip_address, success=False):
     """ログイン試行を記録
@@ -64,15 +388,10 @@ def record_login_attempt(ip_address, success=False):
     """
     if success:
         # 成功時はリセット
-        if ip_address in login_attempts:
-            del login_attempts[ip_address]
+        login_attempt_store.reset(ip_address)
     else:
         # 失敗時は回数をカウント
-        if ip_address in login_attempts:
-            attempts, _ = login_attempts[ip_address]
-            login_attempts[ip_address] = (attempts + 1, datetime.now())
-        else:
-            login_attempts[ip_address] = (1, datetime.now())
+        login_attempt_store.record_failure(ip_address)
 
 def login_required(f):
     """ログイン必須デコレータ
@@ -87,7 +406,9 @@ def login_required(f):
     """
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if 'logged_in' not in session or not session['logged_in']:
+        with timing_phase('auth'):
+            logged_in = session.get('logged_in')
+        if not logged_in:
             if request.is_json:
                 return jsonify({'error': '認証が必要です', 'login_required': True}), 401
             return redirect(url_for('auth.login_page'))
@@ -106,7 +427,10 @@ def check_auth_setup():
         print("その後、アプリケーションを開始してください: uv run app.py")
         return False
     
-    required_vars = ['LOGIN_USERNAME', 'LOGIN_PASSWORD_HASH', 'SECRET_KEY']
+    from config import Config
+    
+    # マルチテナントモードのユーザーはユーザーファイルで管理する
+    required_vars = ['SECRET_KEY'] if Config.TENANT_MODE else ['LOGIN_USERNAME', 'LOGIN_PASSWORD_HASH', 'SECRET_KEY']
     missing_vars = []
     
     for var in required_vars:
@@ -140,7 +464,4 @@ def get_remaining_attempts(ip_address):
     Returns:
         int: 残り試行回数
     """
-    if ip_address in login_attempts:
-        attempts, _ = login_attempts[ip_address]
-        return max(0, LOGIN_ATTEMPT_LIMIT - attempts)
-    return LOGIN_ATTEMPT_LIMIT
\ No newline at end of file
+    return max(0, LOGIN_ATTEMPT_LIMIT - login_attempt_store.failure_count(ip_address))
\ No newline at end of file
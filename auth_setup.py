@@ -4,26 +4,85 @@ Server Money - 認証セットアップユーティリティ
 初回起動時の認証設定を自動化するためのスクリプト
 """
 import os
+import sys
+import time
 import secrets
 import bcrypt
 from getpass import getpass
 
+# bcryptコストの計測設定
+BCRYPT_TARGET_MS = 250  # 1回の検証にかける目標時間（ミリ秒）
+BCRYPT_MIN_ROUNDS = 10
+BCRYPT_MAX_ROUNDS = 16
+
 
 def generate_secret_key():
     """セキュアなSECRET_KEYを生成"""
     return secrets.token_hex(32)
 
 
-def hash_password(password):
+def hash_password(password, rounds=None):
     """パスワードをbcryptでハッシュ化"""
     # パスワードをbytes型に変換
     password_bytes = password.encode('utf-8')
     # saltを生成してハッシュ化
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(rounds) if rounds else bcrypt.gensalt()
     hashed = bcrypt.hashpw(password_bytes, salt)
     return hashed.decode('utf-8')
 
 
+def calibrate_bcrypt_rounds(target_ms=BCRYPT_TARGET_MS):
+    """このマシンで1回のハッシュ化が目標時間以内に収まる最大のコストを計測"""
+    rounds = BCRYPT_MIN_ROUNDS
+    while rounds < BCRYPT_MAX_ROUNDS:
+        start = time.perf_counter()
+        bcrypt.hashpw(b'calibration-password', bcrypt.gensalt(rounds))
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        # コストを1上げると計算時間はおよそ2倍になる
+        if elapsed_ms * 2 > target_ms:
+            break
+        rounds += 1
+    return rounds
+
+
+def update_env_value(key, value, env_file_path='.env'):
+    """.envファイル内の指定キーの値を更新（存在しない場合は追記）"""
+    with open(env_file_path, 'r', encoding='utf-8') as f:
+        lines = f.readlines()
+
+    new_line = f"{key}={value}\n"
+    for i, line in enumerate(lines):
+        if line.split('=', 1)[0].strip() == key:
+            lines[i] = new_line
+            break
+    else:
+        if lines and not lines[-1].endswith('\n'):
+            lines[-1] += '\n'
+        lines.append(new_line)
+
+    # 一時ファイルに書き込んでから置き換える（途中で失敗しても.envを壊さない）
+    tmp_path = f"{env_file_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.writelines(lines)
+    if os.name != 'nt':
+        os.chmod(tmp_path, 0o600)
+    os.replace(tmp_path, env_file_path)
+
+
+def recalibrate_env_file():
+    """既存の.envファイルのBCRYPT_ROUNDSを再計測した値で更新"""
+    if not os.path.exists('.env'):
+        print("❌ .envファイルが見つかりません。先に初回設定を実行してください: uv run auth_setup.py")
+        return False
+
+    print("bcryptのコストを計測しています...")
+    rounds = calibrate_bcrypt_rounds()
+    update_env_value('BCRYPT_ROUNDS', rounds)
+    print(f"✅ BCRYPT_ROUNDS={rounds} に設定しました")
+    print("   次回ログイン時にパスワードハッシュが新しいコストで自動的に再生成されます。")
+    return True
+
+
 def create_env_file():
     """初回起動時に.envファイルを作成"""
     env_file_path = '.env'
@@ -56,9 +115,12 @@ def create_env_file():
         
         break
     
-    # パスワードハッシュ化
+    # bcryptコストの計測とパスワードハッシュ化
+    print("このマシンに合わせてbcryptのコストを計測しています...")
+    bcrypt_rounds = calibrate_bcrypt_rounds()
+    print(f"bcryptコスト: {bcrypt_rounds}")
     print("パスワードをハッシュ化しています...")
-    password_hash = hash_password(password)
+    password_hash = hash_password(password, bcrypt_rounds)
     
     # ホストIP設定
     print()
@@ -109,6 +171,7 @@ def create_env_file():
 # ログイン認証情報
 LOGIN_USERNAME={username}
 LOGIN_PASSWORD_HASH={password_hash}
+BCRYPT_ROUNDS={bcrypt_rounds}
 
 # セッション設定
 SECRET_KEY={secret_key}
@@ -152,12 +215,15 @@ def verify_password(password, hash_str):
 
 if __name__ == "__main__":
     try:
-        created = create_env_file()
-        if created:
-            print("Server Moneyアプリケーションを開始してください。")
-            print("コマンド: uv run app.py")
+        if '--calibrate' in sys.argv[1:]:
+            recalibrate_env_file()
         else:
-            print("既存の認証設定を使用します。")
+            created = create_env_file()
+            if created:
+                print("Server Moneyアプリケーションを開始してください。")
+                print("コマンド: uv run app.py")
+            else:
+                print("既存の認証設定を使用します。")
     except KeyboardInterrupt:
         print("\n\n設定がキャンセルされました。")
     except Exception as e:
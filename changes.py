@@ -0,0 +1,175 @@
+"""
+Server Money - 取引の変更履歴（差分同期）
+
+このファイルは、取引テーブルのトリガーで記録される変更履歴（change_journal）から、
+クライアントが持つ変更番号以降に追加・更新・削除された取引を返す機能を提供します。
+
+変更番号は取引テーブルへの書き込み（APIの各操作、一括操作、CSVインポート、残高の再計算、
+整合性チェックの修復）ごとにSQLiteのトリガーで1つずつ増えるため、書き込み処理側での記録は不要です。
+変更履歴は取引ごとに最新の状態だけを持ち、削除の記録は整理（compact）で古いものから削除します。
+整理済みの番号より古い変更番号を持つクライアントには全件の再取得を求めます。
+アーカイブテーブルへの移動（archive.py）は取引IDが変わらないため、変更履歴に記録しません。
+"""
+
+from contextlib import contextmanager
+from sqlalchemy import text
+from models import db
+
+# 変更を記録するトリガー（変更番号を進め、取引ごとの行を最新の番号で書き換える）
+_NEXT_SEQ = "UPDATE change_journal_state SET sequence = sequence + 1 WHERE id = 1;"
+
+_DELETE_TRIGGER = (
+    'CREATE TRIGGER IF NOT EXISTS trg_change_journal_delete AFTER DELETE ON "transaction" BEGIN '
+    + _NEXT_SEQ +
+    " INSERT INTO change_journal (transaction_id, seq, created_seq, deleted) "
+    " SELECT OLD.id, sequence, 0, 1 FROM change_journal_state WHERE id = 1 "
+    " ON CONFLICT (transaction_id) DO UPDATE SET seq = excluded.seq, deleted = 1; "
+    "END"
+)
+
+CHANGE_JOURNAL_TRIGGERS = [
+    'CREATE TRIGGER IF NOT EXISTS trg_change_journal_insert AFTER INSERT ON "transaction" BEGIN '
+    + _NEXT_SEQ +
+    " INSERT INTO change_journal (transaction_id, seq, created_seq, deleted) "
+    " SELECT NEW.id, sequence, sequence, 0 FROM change_journal_state WHERE id = 1 "
+    " ON CONFLICT (transaction_id) DO UPDATE SET "
+    " seq = excluded.seq, created_seq = excluded.created_seq, deleted = 0; "
+    "END",
+
+    'CREATE TRIGGER IF NOT EXISTS trg_change_journal_update AFTER UPDATE ON "transaction" '
+    "WHEN OLD.account_id IS NOT NEW.account_id OR OLD.date IS NOT NEW.date "
+    "OR OLD.item_id IS NOT NEW.item_id OR OLD.type IS NOT NEW.type "
+    "OR OLD.amount IS NOT NEW.amount OR OLD.balance IS NOT NEW.balance BEGIN "
+    + _NEXT_SEQ +
+    " INSERT INTO change_journal (transaction_id, seq, created_seq, deleted) "
+    " SELECT NEW.id, sequence, 0, 0 FROM change_journal_state WHERE id = 1 "
+    " ON CONFLICT (transaction_id) DO UPDATE SET seq = excluded.seq, deleted = 0; "
+    "END",
+
+    _DELETE_TRIGGER,
+]
+
+# 一度に読み込む取引IDの数（SQLiteのバインド変数の上限対策）
+_FETCH_CHUNK_SIZE = 500
+
+def install_change_journal_triggers():
+    """変更履歴の状態行とトリガーを作成する（コミットは呼び出し元で行う）"""
+    db.session.execute(text(
+        "INSERT OR IGNORE INTO change_journal_state (id, sequence, compacted_through) VALUES (1, 0, 0)"
+    ))
+    for statement in CHANGE_JOURNAL_TRIGGERS:
+        db.session.execute(text(statement))
+
+@contextmanager
+def deletes_not_journaled():
+    """この区間で取引テーブルから削除した行を変更履歴に記録しない（コミットは呼び出し元で行う）
+
+    アーカイブテーブルへの移動のように、クライアントから見て取引が消えない削除に使用します。
+    削除のトリガーを同じDBトランザクション内で削除・再作成するため、
+    ロールバックした場合はトリガーも元に戻ります。
+    """
+    db.session.execute(text("DROP TRIGGER IF EXISTS trg_change_journal_delete"))
+    yield
+    db.session.execute(text(_DELETE_TRIGGER))
+
+def get_change_state():
+    """現在の変更番号と整理済みの変更番号を取得
+
+    Returns:
+        tuple: (sequence, compacted_through)
+    """
+    row = db.session.execute(text(
+        "SELECT sequence, compacted_through FROM change_journal_state WHERE id = 1"
+    )).first()
+    return (row[0], row[1]) if row else (0, 0)
+
+def get_changes(since=None):
+    """指定した変更番号より後に追加・更新・削除された取引を取得
+
+    変更番号を先に読み、その後に変更履歴を読むため、返す取引には番号より新しい変更が
+    含まれることがあります。クライアントは取引IDで上書きするため、次回の同期で同じ取引を
+    再び受け取っても結果は変わりません。
+
+    Args:
+        since (int): クライアントが反映済みの変更番号（Noneの場合は全件の再取得を求める）
+
+    Returns:
+        dict: version（現在の変更番号）、full_resync（全件の再取得が必要な場合True）、
+            inserted・updated（取引の辞書のリスト）、deleted（取引IDのリスト）
+    """
+    version, compacted_through = get_change_state()
+    if since is None or since < compacted_through or since > version:
+        # 初回、削除の記録を整理済み、またはデータベースが作り直された場合は差分を返せない
+        return {'version': version, 'full_resync': True, 'inserted': [], 'updated': [], 'deleted': []}
+
+    from archive import ledger_source
+
+    journal = db.session.execute(
+        text("SELECT transaction_id, created_seq, deleted FROM change_journal WHERE seq > :since"),
+        {'since': since}
+    ).all()
+
+    live_ids = [tx_id for tx_id, _created_seq, deleted in journal if not deleted]
+    # 変更後にアーカイブへ移された取引も返すため、アーカイブがある場合は両方から読む
+    source = ledger_source()
+    transactions = {}
+    for start in range(0, len(live_ids), _FETCH_CHUNK_SIZE):
+        chunk = live_ids[start:start + _FETCH_CHUNK_SIZE]
+        for transaction in db.session.query(source).filter(source.id.in_(chunk)):
+            transactions[transaction.id] = transaction
+
+    inserted, updated, deleted_ids = [], [], []
+    for tx_id, created_seq, deleted in journal:
+        transaction = None if deleted else transactions.get(tx_id)
+        if transaction is None:
+            if created_seq <= since:
+                # 同期後に追加されて削除された取引はクライアントに存在しないため返さない
+                deleted_ids.append(tx_id)
+        elif created_seq > since:
+            inserted.append(transaction.to_dict())
+        else:
+            updated.append(transaction.to_dict())
+
+    return {
+        'version': version,
+        'full_resync': False,
+        'inserted': inserted,
+        'updated': updated,
+        'deleted': deleted_ids
+    }
+
+def require_full_resync():
+    """変更番号を1つ進め、それより前の番号を持つ全てのクライアントに全件の再取得を求める（コミットは呼び出し元で行う）
+
+    削除の記録を残さずに取引が消える場合（アーカイブテーブルの削除など）に使用します。
+    """
+    db.session.execute(text(
+        "UPDATE change_journal_state SET sequence = sequence + 1, compacted_through = sequence + 1 WHERE id = 1"
+    ))
+
+def compact_change_journal(max_tombstones):
+    """削除の記録が上限を超えている場合に古いものから削除する（コミットは呼び出し元で行う）
+
+    Args:
+        max_tombstones (int): 残す削除の記録の最大数
+
+    Returns:
+        int: 削除した記録の数
+    """
+    count = db.session.execute(text("SELECT COUNT(*) FROM change_journal WHERE deleted = 1")).scalar()
+    if count <= max_tombstones:
+        return 0
+
+    horizon = db.session.execute(
+        text("SELECT seq FROM change_journal WHERE deleted = 1 ORDER BY seq LIMIT 1 OFFSET :offset"),
+        {'offset': count - max_tombstones - 1}
+    ).scalar()
+    result = db.session.execute(
+        text("DELETE FROM change_journal WHERE deleted = 1 AND seq <= :horizon"),
+        {'horizon': horizon}
+    )
+    db.session.execute(
+        text("UPDATE change_journal_state SET compacted_through = MAX(compacted_through, :horizon) WHERE id = 1"),
+        {'horizon': horizon}
+    )
+    return result.rowcount
@@ -0,0 +1,175 @@
+"""
+Server Money - 管理用CLIコマンド
+
+このファイルは、`flask --app app <コマンド>` で実行する管理用コマンドを定義します。
+"""
+
+import click
+from models import db
+
+def register_commands(app):
+    """管理用CLIコマンドをアプリケーションに登録
+    
+    Args:
+        app: Flaskアプリケーションインスタンス
+    """
+    
+    @app.cli.command('rebuild-rollup')
+    def rebuild_rollup_command():
+        """月次集計テーブルを取引データから再構築する"""
+        from rollup import rebuild_monthly_summary
+        
+        try:
+            rows = rebuild_monthly_summary()
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f"月次集計の再構築に失敗しました: {e}", exc_info=True)
+            raise click.ClickException(f'月次集計の再構築に失敗しました: {e}')
+        
+        app.logger.info(f"月次集計を再構築しました: {rows}行")
+        click.echo(f'月次集計を再構築しました: {rows}行')
+    
+    @app.cli.command('rebuild-accounts')
+    def rebuild_accounts_command():
+        """口座レジストリを取引データから再構築する"""
+        from accounts import rebuild_accounts
+        from utils import load_credit_card_items
+        
+        try:
+            count = rebuild_accounts(load_credit_card_items())
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f"口座レジストリの再構築に失敗しました: {e}", exc_info=True)
+            raise click.ClickException(f'口座レジストリの再構築に失敗しました: {e}')
+        
+        app.logger.info(f"口座レジストリを再構築しました: {count}口座")
+        click.echo(f'口座レジストリを再構築しました: {count}口座')
+    
+    @app.cli.command('audit-balances')
+    @click.option('--repair', is_flag=True, help='ずれが見つかった口座を修復する')
+    def audit_balances_command(repair):
+        """保存された残高が積み上げた収支と一致するか検査する"""
+        from audit import find_balance_divergences, repair_balance_divergences
+        
+        try:
+            divergences = find_balance_divergences()
+            if repair and divergences:
+                divergences = repair_balance_divergences(divergences)
+                db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f"残高の整合性チェックに失敗しました: {e}", exc_info=True)
+            raise click.ClickException(f'残高の整合性チェックに失敗しました: {e}')
+        
+        if not divergences:
+            click.echo('残高のずれはありません')
+            return
+        
+        for d in divergences:
+            line = (f"{d['account']}: {d['first_date']:%Y-%m-%d} (ID {d['first_id']}) 以降 {d['divergent_count']}件 "
+                    f"保存値 {d['stored_balance']}円 / 期待値 {d['expected_balance']}円")
+            if repair:
+                line += f" → {d['repaired_count']}件を修復"
+            click.echo(line)
+        
+        if repair:
+            app.logger.warning(f"残高のずれを修復しました: {len(divergences)}口座")
+        else:
+            click.echo('修復するには --repair を指定してください')
+            raise SystemExit(1)
+    
+    @app.cli.command('compact-changes')
+    @click.option('--keep', type=int, default=None, help='残す削除の記録の数（省略時はCHANGE_JOURNAL_MAX_TOMBSTONES）')
+    def compact_changes_command(keep):
+        """差分同期用の変更履歴から古い削除の記録を整理する"""
+        from changes import compact_change_journal
+        
+        keep = app.config['CHANGE_JOURNAL_MAX_TOMBSTONES'] if keep is None else keep
+        try:
+            removed = compact_change_journal(keep)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f"変更履歴の整理に失敗しました: {e}", exc_info=True)
+            raise click.ClickException(f'変更履歴の整理に失敗しました: {e}')
+        
+        app.logger.info(f"変更履歴の削除の記録を整理しました: {removed}件")
+        click.echo(f'変更履歴の削除の記録を整理しました: {removed}件')
+    
+    @app.cli.command('archive-years')
+    @click.argument('year', type=int)
+    @click.option('--tenant', default=None, help='マルチテナントモードで対象とするユーザー')
+    def archive_years_command(year, tenant):
+        """YEAR年より前の取引をアーカイブテーブルへ移し、口座ごとの期首残高に繰り越す"""
+        from archive import archive_years_before
+        from database import use_tenant_shard
+        from tenants import tenant_users, tenant_registry
+        
+        if app.config['TENANT_MODE']:
+            if not tenant or not tenant_users.exists(tenant):
+                raise click.ClickException('マルチテナントモードでは --tenant に登録済みのユーザーを指定してください')
+            use_tenant_shard(tenant_registry.acquire(tenant))
+        elif tenant:
+            raise click.ClickException('--tenant は TENANT_MODE=true の場合のみ使用できます')
+        
+        try:
+            result = archive_years_before(year)
+            db.session.commit()
+        except ValueError as e:
+            db.session.rollback()
+            raise click.ClickException(str(e))
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f"取引のアーカイブに失敗しました: {e}", exc_info=True)
+            raise click.ClickException(f'取引のアーカイブに失敗しました: {e}')
+        
+        for account, count in result['accounts'].items():
+            click.echo(f'{account}: {count}件')
+        app.logger.info(f"{year - 1}年以前の取引をアーカイブしました: {result['archived_count']}件, {len(result['accounts'])}口座")
+        click.echo(f"{year - 1}年以前の取引をアーカイブしました: {result['archived_count']}件")
+    
+    @app.cli.command('add-tenant-user')
+    @click.argument('username')
+    @click.password_option(help='パスワード（省略時は入力を求める）')
+    def add_tenant_user_command(username, password):
+        """マルチテナントモードのユーザーを追加（またはパスワードを変更）し、データベースを準備する"""
+        from auth_setup import hash_password
+        from tenants import tenant_users, tenant_registry, is_valid_tenant_name
+        
+        if not app.config['TENANT_MODE']:
+            raise click.ClickException('TENANT_MODE=true の場合のみ使用できます')
+        if not is_valid_tenant_name(username):
+            raise click.ClickException('ユーザー名は英数字で始まる64文字以内の英数字・「_」「.」「-」で指定してください')
+        if len(password) < 8:
+            raise click.ClickException('パスワードは8文字以上で指定してください')
+        
+        existed = tenant_users.exists(username)
+        try:
+            tenant_users.set_password_hash(username, hash_password(password, app.config['BCRYPT_ROUNDS']))
+            shard = tenant_registry.acquire(username)
+        except Exception as e:
+            app.logger.error(f"ユーザーの追加に失敗しました: {e}", exc_info=True)
+            raise click.ClickException(f'ユーザーの追加に失敗しました: {e}')
+        
+        action = 'パスワードを変更しました' if existed else 'ユーザーを追加しました'
+        app.logger.info(f"マルチテナントモードの{action}: {username}")
+        click.echo(f'{action}: {username} ({shard.directory})')
+    
+    @app.cli.command('build-assets')
+    @click.option('--force', is_flag=True, help='変更がなくてもビルドし直す')
+    def build_assets_command(force):
+        """JavaScript・CSSを軽量化し、ハッシュ付きのファイル名で書き出す"""
+        from assets import build_assets
+        
+        try:
+            manifest, built = build_assets(app.static_folder, force=force)
+        except Exception as e:
+            app.logger.error(f"静的ファイルのビルドに失敗しました: {e}", exc_info=True)
+            raise click.ClickException(f'静的ファイルのビルドに失敗しました: {e}')
+        
+        if not built:
+            click.echo('静的ファイルに変更はありません')
+        for source, path in manifest['assets'].items():
+            click.echo(f'{source} -> {path}')
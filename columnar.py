@@ -0,0 +1,100 @@
+"""
+Server Money - 列指向（カラムナー）JSON形式
+
+このファイルは、取引一覧をフィールドごとの配列で返す列指向のJSON形式への変換と、
+その形式を要求されているかどうかの判定（Acceptヘッダーまたはformatパラメータ）を提供します。
+
+列指向形式では、口座・項目・種別を辞書のインデックス、日付をエポック日（1970-01-01からの日数）と
+その日の0時からの秒数で表し、行ごとのフィールド名や日付文字列の生成を省きます。
+"""
+
+from datetime import datetime
+from sqlalchemy import select
+from models import db, Transaction, AccountName, ItemName
+
+# Acceptヘッダーで列指向形式を要求する際のメディアタイプ
+COLUMNAR_MEDIA_TYPE = 'application/vnd.server-money.columnar+json'
+
+_EPOCH_ORDINAL = datetime(1970, 1, 1).toordinal()
+
+# 種別の辞書（列指向形式のtype列はこのリストのインデックス）
+TYPE_NAMES = ['income', 'expense']
+_TYPE_CODES = {name: code for code, name in enumerate(TYPE_NAMES)}
+
+def wants_columnar(request):
+    """リクエストが列指向形式を要求しているか判定
+
+    Args:
+        request: Flaskのリクエスト
+
+    Returns:
+        bool: format=columnar、またはAcceptヘッダーで列指向のメディアタイプが
+            JSONより優先されている場合True
+    """
+    requested_format = request.args.get('format', '').strip().lower()
+    if requested_format:
+        return requested_format == 'columnar'
+    best = request.accept_mimetypes.best_match([COLUMNAR_MEDIA_TYPE, 'application/json'])
+    return best == COLUMNAR_MEDIA_TYPE and request.accept_mimetypes[COLUMNAR_MEDIA_TYPE] > 0
+
+def _encode(values, names):
+    """辞書idの列を、出現順に0から振り直したインデックスの列と名前のリストに変換"""
+    codes = {}
+    encoded = []
+    for value in values:
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(codes)
+        encoded.append(code)
+    return encoded, [names[value] for value in codes]
+
+def transactions_to_columnar(query, entity=Transaction):
+    """取引のクエリを列指向形式の辞書に変換
+
+    ORMオブジェクトを生成せず、必要な列だけを読み込んで変換します。
+
+    Args:
+        query: 条件・並び順・ページングを適用済みのTransactionのクエリ
+        entity: クエリのエンティティ（アーカイブを含めて読む場合はarchive.ledger_sourceの戻り値）
+
+    Returns:
+        dict: 列指向形式の取引一覧
+    """
+    rows = query.with_entities(
+        entity.id, entity.account_id, entity.date, entity.item_id,
+        entity.type, entity.amount, entity.balance
+    ).all()
+
+    ids, account_ids, dates, item_ids, types, amounts, balances = (
+        list(column) for column in zip(*rows)
+    ) if rows else ([] for _ in range(7))
+
+    account_names = dict(db.session.execute(
+        select(AccountName.id, AccountName.name).where(AccountName.id.in_(set(account_ids)))
+    ).all()) if account_ids else {}
+    item_names = dict(db.session.execute(
+        select(ItemName.id, ItemName.name).where(ItemName.id.in_(set(item_ids)))
+    ).all()) if item_ids else {}
+
+    account_codes, accounts = _encode(account_ids, account_names)
+    item_codes, items = _encode(item_ids, item_names)
+
+    return {
+        'format': 'columnar',
+        'count': len(rows),
+        'dictionaries': {
+            'account': accounts,
+            'item': items,
+            'type': TYPE_NAMES
+        },
+        'columns': {
+            'id': ids,
+            'account': account_codes,
+            'day': [date.toordinal() - _EPOCH_ORDINAL for date in dates],
+            'seconds': [date.hour * 3600 + date.minute * 60 + date.second for date in dates],
+            'item': item_codes,
+            'type': [_TYPE_CODES.get(tx_type, -1) for tx_type in types],
+            'amount': amounts,
+            'balance': balances
+        }
+    }
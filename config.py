@@ -8,6 +8,7 @@ import os
 import logging
 from logging.handlers import RotatingFileHandler
 from datetime import timedelta
+from database import build_read_bind
 
 class Config:
     """アプリケーション設定クラス"""
@@ -19,10 +20,74 @@ class Config:
     # データベース設定
     SQLALCHEMY_DATABASE_URI = 'sqlite:///money_tracker.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    READ_ENGINE_ENABLED = os.getenv('READ_ENGINE_ENABLED', 'true').lower() in ('1', 'true', 'yes', 'on')  # APIのGETリクエストを読み取り専用エンジンで実行
+    
+    # マルチテナント設定
+    TENANT_MODE = os.getenv('TENANT_MODE', 'false').lower() in ('1', 'true', 'yes', 'on')  # ユーザーごとに別のデータベース（シャード）を使用
+    TENANT_DATA_DIR = os.getenv('TENANT_DATA_DIR', '')  # 未指定時は instance/tenants
+    TENANT_USERS_FILE = os.getenv('TENANT_USERS_FILE', '')  # 未指定時は instance/tenant_users.json
+    TENANT_ENGINE_CACHE_SIZE = max(1, int(os.getenv('TENANT_ENGINE_CACHE_SIZE', '32')))  # 同時に開いておくシャードの最大数
+    TENANT_IDLE_SECONDS = float(os.getenv('TENANT_IDLE_SECONDS', '600'))  # 使われていないシャードを閉じるまでの秒数
     
     # サーバー設定
     HOST_IP = os.getenv('HOST_IP', '127.0.0.1')  # デフォルトはlocalhostのみ
     
+    # ログイン試行制限の設定
+    LOGIN_ATTEMPT_STORE = os.getenv('LOGIN_ATTEMPT_STORE', 'auto').lower()  # 'auto' / 'memory' / 'sqlite'
+    LOGIN_ATTEMPT_DB_PATH = os.getenv('LOGIN_ATTEMPT_DB_PATH', '')  # 未指定時は instance/login_attempts.db
+    LOGIN_ATTEMPT_MAX_ENTRIES = int(os.getenv('LOGIN_ATTEMPT_MAX_ENTRIES', '10000'))  # メモリストアの最大IP数
+    
+    # パスワード検証（bcrypt）設定
+    BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', '12'))  # auth_setup.pyで計測したコスト。異なるハッシュはログイン時に再ハッシュ
+    BCRYPT_POOL_WORKERS = int(os.getenv('BCRYPT_POOL_WORKERS', '2'))  # 検証専用スレッド数
+    BCRYPT_QUEUE_SIZE = int(os.getenv('BCRYPT_QUEUE_SIZE', '8'))  # 待機できる検証数（超えると503）
+    BCRYPT_TIMEOUT = float(os.getenv('BCRYPT_TIMEOUT', '10'))  # 検証結果の待ち時間上限（秒）
+    
+    # サーバーランタイム設定（waitress）
+    SERVER_PORT = int(os.getenv('SERVER_PORT', '4000'))
+    SERVER_THREADS = int(os.getenv('SERVER_THREADS', '8'))  # ワーカープロセスごとのスレッド数
+    SERVER_CONNECTION_LIMIT = int(os.getenv('SERVER_CONNECTION_LIMIT', '100'))
+    SERVER_BACKLOG = int(os.getenv('SERVER_BACKLOG', '1024'))
+    SERVER_CHANNEL_TIMEOUT = int(os.getenv('SERVER_CHANNEL_TIMEOUT', '120'))  # 秒
+    SERVER_UNIX_SOCKET = os.getenv('SERVER_UNIX_SOCKET', '').strip()  # 指定時はTCPの代わりにUnixソケットで待ち受け
+    SERVER_UNIX_SOCKET_PERMS = os.getenv('SERVER_UNIX_SOCKET_PERMS', '600')
+    SERVER_WORKERS = int(os.getenv('SERVER_WORKERS', '1'))  # 2以上でSO_REUSEPORTによるマルチプロセスモード
+    READ_POOL_SIZE = int(os.getenv('READ_POOL_SIZE', '0')) or SERVER_THREADS  # 読み取り専用エンジンの接続数（未指定時はスレッド数）
+    
+    # 分析用スナップショット設定
+    LEDGER_SNAPSHOT_ENABLED = os.getenv('LEDGER_SNAPSHOT_ENABLED', 'true').lower() in ('1', 'true', 'yes', 'on')  # 残高推移・日単位集計を列指向のメモリスナップショットから計算
+    
+    # 変更通知（Server-Sent Events）設定
+    SSE_MAX_CONNECTIONS = int(os.getenv('SSE_MAX_CONNECTIONS', '0')) or max(1, SERVER_THREADS // 2)  # プロセスごとの同時接続数（1接続が1スレッドを占有するため、未指定時はスレッド数の半分）
+    SSE_HEARTBEAT_SECONDS = float(os.getenv('SSE_HEARTBEAT_SECONDS', '15'))  # ハートビートの間隔（切断の検出）
+    SSE_POLL_SECONDS = float(os.getenv('SSE_POLL_SECONDS', '5'))  # 他プロセスの書き込みを確認する間隔
+    SSE_MAX_DURATION = float(os.getenv('SSE_MAX_DURATION', '300'))  # 1接続の最大時間（秒、経過後はクライアントが再接続）
+    SSE_RETRY_MS = int(os.getenv('SSE_RETRY_MS', '3000'))  # クライアントの再接続待ち時間（ミリ秒）
+    
+    # 取引の書き込みキュー設定
+    WRITE_QUEUE_ENABLED = os.getenv('WRITE_QUEUE_ENABLED', 'true').lower() in ('1', 'true', 'yes', 'on')  # 取引の追加・編集・削除を1つの書き込みスレッドでまとめてコミット
+    WRITE_QUEUE_SIZE = int(os.getenv('WRITE_QUEUE_SIZE', '256'))  # 待機できる書き込みの数（超えると503）
+    WRITE_BATCH_MAX = int(os.getenv('WRITE_BATCH_MAX', '64'))  # 1回のコミットにまとめる書き込みの最大数
+    WRITE_BATCH_WINDOW_MS = float(os.getenv('WRITE_BATCH_WINDOW_MS', '2'))  # 後続の書き込みを待つ最大時間（ミリ秒）
+    WRITE_TIMEOUT = float(os.getenv('WRITE_TIMEOUT', '30'))  # 書き込みの待ち時間上限（秒）
+    
+    # 差分同期設定
+    CHANGE_JOURNAL_MAX_TOMBSTONES = int(os.getenv('CHANGE_JOURNAL_MAX_TOMBSTONES', '10000'))  # 残す削除の記録の最大数（超えた分より古い番号のクライアントは全件再取得）
+    
+    # 静的ファイル設定
+    ASSET_PIPELINE_ENABLED = os.getenv('ASSET_PIPELINE_ENABLED', 'true').lower() in ('1', 'true', 'yes', 'on')  # 起動時にJS/CSSを軽量化し、ハッシュ付きファイル名で配信
+    
+    # 処理時間の計測設定
+    SERVER_TIMING_ENABLED = os.getenv('SERVER_TIMING_ENABLED', 'true').lower() in ('1', 'true', 'yes', 'on')  # レスポンスにServer-Timingヘッダー（auth / db / compute / serialize / total）を付ける
+    
+    # メモリ計測設定（tracemalloc）
+    MEMORY_PROFILING_ENABLED = os.getenv('MEMORY_PROFILING_ENABLED', 'false').lower() in ('1', 'true', 'yes', 'on')  # 抽出したリクエストのピークメモリと割り当て元を計測
+    MEMORY_PROFILING_SAMPLE_RATE = min(1.0, max(0.0, float(os.getenv('MEMORY_PROFILING_SAMPLE_RATE', '0.05'))))  # 計測するリクエストの割合（0〜1）
+    MEMORY_PROFILING_FRAMES = max(1, int(os.getenv('MEMORY_PROFILING_FRAMES', '8')))  # 割り当て元をたどる呼び出しの深さ（深いほど計測中の処理が遅くなる）
+    MEMORY_PROFILING_TOP_SITES = int(os.getenv('MEMORY_PROFILING_TOP_SITES', '10'))  # 記録する割り当て元の数
+    MEMORY_STATS_WINDOW = max(1, int(os.getenv('MEMORY_STATS_WINDOW', '100')))  # エンドポイントごとに保持する直近の計測数
+    MEMORY_BUDGET_MB = float(os.getenv('MEMORY_BUDGET_MB', '64'))  # ピークがこれを超えたリクエストを警告（0で無効）
+    
     # ログ設定
     LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
     ENVIRONMENT = os.getenv('ENVIRONMENT', 'development').lower()
@@ -105,6 +170,10 @@ def init_config(app):
     """
     app.config.from_object(Config)
     
+    # 読み取り専用エンジン（SQLiteのmode=ro URI）をbindとして登録
+    if Config.READ_ENGINE_ENABLED:
+        app.config['SQLALCHEMY_BINDS'] = build_read_bind(Config)
+    
     # デバッグ情報をログ出力
     app.logger.info(f"現在の作業ディレクトリ: {os.getcwd()}")
     app.logger.info(f"データベースURI: {app.config['SQLALCHEMY_DATABASE_URI']}")
@@ -0,0 +1,143 @@
+"""
+Server Money - データベース接続の振り分け
+
+このファイルは、分析や一覧取得などの読み取り専用のリクエストを、書き込みとは別の
+読み取り専用エンジン（SQLiteの mode=ro URI と PRAGMA query_only）で実行する仕組みを提供します。
+
+書き込み用のエンジンはWALモードで動作するため、読み取り専用エンジンでの長い集計は
+取引の書き込みを待たせず、書き込みも集計を待ちません。
+APIのGETリクエストは自動的に読み取り専用エンジンを使用します（use_read_engineで明示的にも切り替え可能）。
+
+マルチテナントモードでは、リクエストのユーザーのシャード（tenants.py）のエンジンに振り分けます。
+"""
+
+from flask import g, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+
+# 読み取り専用エンジンのbindキー（SQLALCHEMY_BINDSに登録）
+READ_BIND_KEY = 'readonly'
+
+# このリクエストで読み取り専用エンジンを使用する場合にgへ設定するフラグ
+_READ_FLAG = 'use_read_engine'
+
+# このリクエストが使用するテナントのシャードを保持するgのキー
+_SHARD_KEY = 'tenant_shard'
+
+class RoutingSession(Session):
+    """既定のエンジンの代わりに、テナントのシャードや読み取り専用エンジンを返すセッション"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if bind is None and has_app_context():
+            shard = g.get(_SHARD_KEY)
+            if shard is not None:
+                if g.get(_READ_FLAG) and shard.read_engine is not None:
+                    return shard.read_engine
+                return shard.engine
+            if g.get(_READ_FLAG):
+                engines = self._db.engines
+                if engine is engines.get(None) and READ_BIND_KEY in engines:
+                    return engines[READ_BIND_KEY]
+        return engine
+
+def use_read_engine():
+    """現在のリクエストのデータベース操作を読み取り専用エンジンで実行する"""
+    g.setdefault(_READ_FLAG, True)
+
+def use_tenant_shard(shard):
+    """現在のアプリケーションコンテキストのデータベース操作をテナントのシャードで実行する
+
+    Args:
+        shard: tenants.TenantShard
+    """
+    g.setdefault(_SHARD_KEY, shard)
+
+def get_tenant_shard():
+    """現在のアプリケーションコンテキストで使用しているテナントのシャードを取得
+
+    Returns:
+        tenants.TenantShard: シャード（単一テナント、またはコンテキスト外の場合はNone）
+    """
+    if not has_app_context():
+        return None
+    return g.get(_SHARD_KEY)
+
+def read_only_url(path):
+    """SQLiteファイルを読み取り専用で開くURLを組み立てる
+
+    Args:
+        path (str): データベースファイルのパス
+
+    Returns:
+        str: mode=roのURIを使用するSQLAlchemyのURL
+    """
+    return f'sqlite:///file:{path}?mode=ro&uri=true'
+
+def build_read_bind(config):
+    """読み取り専用エンジンのbind設定を組み立てる
+
+    Args:
+        config: Configクラス（SQLALCHEMY_DATABASE_URIとREAD_POOL_SIZEを参照）
+
+    Returns:
+        dict: SQLALCHEMY_BINDSに登録する設定（SQLite以外のURIの場合は空）
+    """
+    prefix = 'sqlite:///'
+    uri = config.SQLALCHEMY_DATABASE_URI
+    if not uri.startswith(prefix) or uri == prefix + ':memory:':
+        return {}
+    return {
+        READ_BIND_KEY: {
+            'url': read_only_url(uri[len(prefix):]),
+            'pool_size': config.READ_POOL_SIZE,
+            'max_overflow': 0,
+        }
+    }
+
+def init_engines(app):
+    """書き込み用エンジンをWALモードに、読み取り専用エンジンをquery_onlyに設定する（db.init_appの後に呼び出すこと）
+
+    Args:
+        app: Flaskアプリケーションインスタンス
+    """
+    from models import db
+
+    with app.app_context():
+        engines = db.engines
+
+    configure_write_engine(engines[None])
+
+    read_engine = engines.get(READ_BIND_KEY)
+    if read_engine is None:
+        return
+
+    configure_read_engine(read_engine)
+    app.logger.info(f"読み取り専用エンジンを設定しました (pool_size={app.config['READ_POOL_SIZE']})")
+
+def _execute_on_connect(engine, statement):
+    """接続ごとにPRAGMAを実行するリスナーを登録する"""
+
+    @event.listens_for(engine, 'connect')
+    def execute_pragma(dbapi_connection, _record):
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute(statement)
+        finally:
+            cursor.close()
+
+def configure_write_engine(engine):
+    """書き込み用エンジンの接続をWALモードにする
+
+    Args:
+        engine: SQLAlchemyのエンジン
+    """
+    _execute_on_connect(engine, 'PRAGMA journal_mode=WAL')
+
+def configure_read_engine(engine):
+    """読み取り専用エンジンの接続をquery_onlyにする
+
+    Args:
+        engine: SQLAlchemyのエンジン
+    """
+    _execute_on_connect(engine, 'PRAGMA query_only=ON')
@@ -0,0 +1,180 @@
+"""
+Server Money - 台帳の変更通知（Server-Sent Events）
+
+このファイルは、台帳の変更がコミットされたときに、開いているダッシュボードへ
+影響を受けた口座と新しいデータバージョンをServer-Sent Eventsで通知する仕組みを提供します。
+
+waitressでは1つのSSE接続がワーカースレッドを1つ占有するため、同時接続数をプロセス全体の上限で制限し、
+一定時間ごとのハートビートで切断されたクライアントを検出してスレッドを解放します。
+接続は最大接続時間で終了し、ブラウザのEventSourceが自動的に再接続します。
+
+同じプロセスでのコミットは台帳のコミット通知で即座に、他のワーカープロセスやCLIによる
+書き込みはデータバージョンの定期確認で検出します（この場合、影響を受けた口座は不明としてnullを通知）。
+"""
+
+import json
+import threading
+import time
+from collections import deque
+from ledger import register_commit_listener, get_data_version
+from tenants import TenantScoped
+
+# 保持する直近の変更通知の数
+_HISTORY_SIZE = 256
+
+class ConnectionSlots:
+    """プロセス全体のSSE同時接続数を数える（テナントに関係なくワーカースレッドを共有するため）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._connections = 0
+
+    def try_acquire(self, limit):
+        """SSE接続の枠を確保する
+
+        Args:
+            limit (int): 同時接続数の上限
+
+        Returns:
+            bool: 確保できた場合True
+        """
+        with self._lock:
+            if self._connections >= limit:
+                return False
+            self._connections += 1
+            return True
+
+    def release(self):
+        """SSE接続の枠を解放する"""
+        with self._lock:
+            self._connections -= 1
+
+    @property
+    def connection_count(self):
+        """現在のSSE接続数"""
+        return self._connections
+
+class ChangeBroadcaster:
+    """台帳の変更を待機中のSSE接続に配信する"""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._events = deque(maxlen=_HISTORY_SIZE)  # (version, accounts) accountsがNoneの場合は不明
+        self._latest_version = 0
+
+    def publish(self, version, accounts=None):
+        """変更を記録し、待機中の接続を起こす
+
+        Args:
+            version (int): 変更後のデータバージョン
+            accounts (iterable): 影響を受けた口座（Noneの場合は不明）
+        """
+        with self._condition:
+            if version <= self._latest_version:
+                return
+            self._latest_version = version
+            self._events.append((version, None if accounts is None else frozenset(accounts)))
+            self._condition.notify_all()
+
+    def apply_change(self, change):
+        """台帳のコミット通知を受け取る（ledger.register_commit_listenerに登録）"""
+        self.publish(change['version'], change['accounts'])
+
+    def wait(self, after_version, timeout):
+        """指定したバージョンより新しい変更を待つ
+
+        Args:
+            after_version (int): 配信済みのデータバージョン
+            timeout (float): 待機する最大秒数
+
+        Returns:
+            tuple: (version, accounts) まとめた変更。accountsは口座名のリスト（不明な場合None）。
+                変更がなかった場合はNone
+        """
+        with self._condition:
+            if self._latest_version <= after_version:
+                self._condition.wait(timeout)
+            if self._latest_version <= after_version:
+                return None
+            newer = [(version, accounts) for version, accounts in self._events if version > after_version]
+            if not newer or newer[0][0] != after_version + 1 or any(accounts is None for _v, accounts in newer):
+                # 履歴から溢れた変更や他プロセスの変更を含む場合は口座を特定できない
+                return self._latest_version, None
+            return self._latest_version, sorted(set().union(*(accounts for _v, accounts in newer)))
+
+def format_event(event, data, event_id=None):
+    """SSEのメッセージを組み立てる
+
+    Args:
+        event (str): イベント名
+        data (dict): JSON化して送るデータ
+        event_id (int): 再接続時にLast-Event-IDとして返される値
+
+    Returns:
+        str: SSE形式のメッセージ
+    """
+    lines = [f'event: {event}']
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'data: {json.dumps(data, ensure_ascii=False)}')
+    return '\n'.join(lines) + '\n\n'
+
+def stream_changes(app, last_event_id=None):
+    """変更通知を送り続けるジェネレータ（接続の枠の確保と解放は呼び出し元で行う）
+
+    Args:
+        app: Flaskアプリケーションインスタンス
+        last_event_id (int): 再接続時にクライアントが最後に受け取ったデータバージョン
+
+    Yields:
+        str: SSE形式のメッセージ
+    """
+    from models import db
+
+    heartbeat = app.config['SSE_HEARTBEAT_SECONDS']
+    poll_interval = app.config['SSE_POLL_SECONDS']
+    deadline = time.monotonic() + app.config['SSE_MAX_DURATION']
+
+    def current_version():
+        try:
+            version = get_data_version()
+        finally:
+            # 長時間の接続中にDB接続を保持しないよう、確認のたびにプールへ返す
+            db.session.remove()
+        change_broadcaster.publish(version)
+        return version
+
+    sent_version = current_version()
+    # 再接続時の待機時間（ミリ秒）と、接続時点のデータバージョン
+    yield f'retry: {int(app.config["SSE_RETRY_MS"])}\n\n'
+    yield format_event('ready', {'version': sent_version}, sent_version)
+    if last_event_id is not None and last_event_id != sent_version:
+        # 切断中に変更があった場合は、口座を特定せずに通知する
+        yield format_event('ledger', {'version': sent_version, 'accounts': None}, sent_version)
+
+    last_write = last_poll = time.monotonic()
+    while True:
+        now = time.monotonic()
+        if now >= deadline:
+            return
+        timeout = max(0.0, min(last_write + heartbeat, last_poll + poll_interval, deadline) - now)
+        change = change_broadcaster.wait(sent_version, timeout)
+        now = time.monotonic()
+        if change is None and now - last_poll >= poll_interval:
+            last_poll = now
+            current_version()
+            change = change_broadcaster.wait(sent_version, 0)
+        if change is not None:
+            sent_version, accounts = change
+            yield format_event('ledger', {'version': sent_version, 'accounts': accounts}, sent_version)
+            last_write = now
+        elif now - last_write >= heartbeat:
+            # コメント行のハートビート（切断の検出とプロキシのタイムアウト防止）
+            yield ': heartbeat\n\n'
+            last_write = now
+
+sse_connections = ConnectionSlots()
+
+# マルチテナントモードではシャードごとに別の配信先を使用する
+change_broadcaster = TenantScoped(ChangeBroadcaster)
+register_commit_listener(lambda change: change_broadcaster.apply_change(change))
@@ -0,0 +1,161 @@
+"""
+Server Money - 項目名の前方一致インデックス
+
+このファイルは、項目名の入力補完用に、口座別および全体の項目名を
+正規化済みのソート済みリストで保持し、使用回数と最終使用日で順位付けした
+候補を返すプロセス内インデックスを提供します。
+
+インデックスは最初の検索時に構築され、以降は台帳のコミット通知で差分更新されます。
+他のプロセスによる書き込みでデータバージョンが飛んだ場合は、次の検索時に再構築します。
+"""
+
+import bisect
+import heapq
+import threading
+import unicodedata
+from datetime import datetime
+from models import db, AccountName, ItemName
+from archive import ledger_source
+from ledger import register_commit_listener, get_data_version
+from tenants import TenantScoped
+
+# 最終使用日からの経過日数による重みの半減期（日）
+RECENCY_HALF_LIFE_DAYS = 90
+
+def normalize_item_key(name):
+    """検索用に項目名を正規化（全角・半角の統一と大文字小文字の無視）
+
+    Args:
+        name (str): 項目名
+
+    Returns:
+        str: 正規化されたキー
+    """
+    return unicodedata.normalize('NFKC', name).casefold()
+
+class _ScopeIndex:
+    """1つのスコープ（口座または全体）の項目名インデックス"""
+
+    def __init__(self):
+        self.keys = []        # ソート済みの (正規化キー, 項目名)
+        self.counts = {}      # 項目名 -> 使用回数
+        self.last_used = {}   # 項目名 -> 最終使用日時
+
+    def add(self, item, date, count=1):
+        if item not in self.counts:
+            bisect.insort(self.keys, (normalize_item_key(item), item))
+            self.counts[item] = 0
+        self.counts[item] += count
+        if date is not None and (item not in self.last_used or date > self.last_used[item]):
+            self.last_used[item] = date
+
+    def remove(self, item):
+        if item not in self.counts:
+            return
+        # 最終使用日は削除された取引が最新とは限らないため、項目が消えるときのみ破棄する
+        self.counts[item] -= 1
+        if self.counts[item] <= 0:
+            key = (normalize_item_key(item), item)
+            index = bisect.bisect_left(self.keys, key)
+            if index < len(self.keys) and self.keys[index] == key:
+                del self.keys[index]
+            del self.counts[item]
+            self.last_used.pop(item, None)
+
+    def search(self, prefix, limit, now):
+        start = bisect.bisect_left(self.keys, (prefix,))
+        if prefix:
+            end = bisect.bisect_left(self.keys, (prefix + '\U0010ffff',), lo=start)
+        else:
+            end = len(self.keys)
+
+        def score(entry):
+            item = entry[1]
+            last_used = self.last_used.get(item)
+            age_days = max(0, (now - last_used).days) if last_used else 365 * 10
+            return self.counts[item] * 0.5 ** (age_days / RECENCY_HALF_LIFE_DAYS)
+
+        candidates = self.keys[start:end]
+        # 入力と完全一致する項目は常に先頭に含める（新規項目かどうかの判定に使用される）
+        exact = [entry for entry in candidates if entry[0] == prefix] if prefix else []
+        ranked = heapq.nlargest(limit, (entry for entry in candidates if entry not in exact), key=score)
+        return [entry[1] for entry in exact + ranked][:limit]
+
+class ItemIndex:
+    """口座別・全体の項目名インデックス"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._scopes = None   # スコープ（None: 全体、または口座名） -> _ScopeIndex
+        self._version = None  # インデックスが反映しているデータバージョン
+
+    def _build(self):
+        """取引テーブル（アーカイブ済みの取引を含む）からインデックスを構築する（ロック取得済みで呼び出すこと）"""
+        version = get_data_version()
+        source = ledger_source()
+        counts = db.session.query(
+            source.account_id, source.item_id,
+            db.func.count(source.id).label('count'), db.func.max(source.date).label('last_used')
+        ).group_by(source.account_id, source.item_id).subquery()
+        rows = db.session.query(
+            AccountName.name, ItemName.name, counts.c.count, counts.c.last_used
+        ).join(AccountName, AccountName.id == counts.c.account_id).join(
+            ItemName, ItemName.id == counts.c.item_id
+        ).all()
+
+        scopes = {None: _ScopeIndex()}
+        for account, item, count, last_used in rows:
+            if isinstance(last_used, str):
+                last_used = datetime.fromisoformat(last_used)
+            scopes.setdefault(account, _ScopeIndex()).add(item, last_used, count)
+            scopes[None].add(item, last_used, count)
+
+        self._scopes = scopes
+        self._version = version
+
+    def search(self, prefix='', account=None, limit=10):
+        """前方一致で項目名の候補を取得
+
+        Args:
+            prefix (str): 入力中の文字列
+            account (str): 口座名（Noneの場合は全体）
+            limit (int): 最大件数
+
+        Returns:
+            list: 使用回数と最終使用日で順位付けされた項目名のリスト
+        """
+        current_version = get_data_version()
+        with self._lock:
+            if self._scopes is None or self._version != current_version:
+                self._build()
+            scope = self._scopes.get(account)
+            if scope is None:
+                return []
+            return scope.search(normalize_item_key(prefix), limit, datetime.now())
+
+    def apply_change(self, change):
+        """コミットされた台帳の変更をインデックスに反映する
+
+        Args:
+            change (dict): ledger.register_commit_listenerから渡される変更内容
+        """
+        with self._lock:
+            if self._scopes is None or change['version'] <= self._version:
+                # 未構築、または再構築時に既に取り込まれている変更
+                return
+            if self._version != change['version'] - 1:
+                # 他プロセスの書き込みを取りこぼしているため、次回検索時に再構築する
+                self._scopes = None
+                return
+            for account, date, _type, item, _amount in change['removed']:
+                self._scopes[None].remove(item)
+                if account in self._scopes:
+                    self._scopes[account].remove(item)
+            for account, date, _type, item, _amount in change['added']:
+                self._scopes[None].add(item, date)
+                self._scopes.setdefault(account, _ScopeIndex()).add(item, date)
+            self._version = change['version']
+
+# マルチテナントモードではシャードごとに別のインデックスを使用する
+item_index = TenantScoped(ItemIndex)
+register_commit_listener(lambda change: item_index.apply_change(change))
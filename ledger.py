@@ -0,0 +1,140 @@
+"""
+Server Money - 台帳の書き込みフック
+
+このファイルは、取引の追加・更新・削除・インポートに伴って更新が必要な
+派生データ（月次集計、口座レジストリ、データバージョン）を一箇所でまとめて更新する関数を提供します。
+全ての書き込み処理は、コミット前にapply_ledger_changesを呼び出してください。
+
+プロセス内のインデックスなど、コミット後に反映すべき処理は
+register_commit_listenerで登録します。ロールバックされた変更は通知されません。
+"""
+
+from sqlalchemy import event, text
+from models import db, DataVersion
+from rollup import apply_summary_delta
+from accounts import apply_account_delta
+
+# セッションに溜めておく未コミットの変更のキー
+_PENDING_KEY = 'ledger_pending_changes'
+
+# コミット後に呼び出される関数のリスト
+_commit_listeners = []
+
+def register_commit_listener(listener):
+    """台帳の変更がコミットされた後に呼び出される関数を登録
+
+    listenerは変更ごとに、次のキーを持つ辞書を引数として呼び出されます。
+        version: 変更後のデータバージョン
+        removed: 削除された（または変更前の）取引のsummary_row形式タプルのリスト
+        added: 追加された（または変更後の）取引のsummary_row形式タプルのリスト
+        accounts: 変更の影響を受けた口座名のセット（残高の再計算のみの変更も含む）
+
+    Args:
+        listener: 呼び出す関数
+    """
+    _commit_listeners.append(listener)
+
+def get_data_version():
+    """現在のデータバージョンを取得
+
+    Returns:
+        int: データバージョン（未初期化の場合は0）
+    """
+    version = db.session.execute(text("SELECT version FROM data_version WHERE id = 1")).scalar()
+    return version or 0
+
+def bump_data_version(removed=(), added=(), accounts=()):
+    """データバージョンを1つ進める（コミットは呼び出し元で行う）
+
+    Args:
+        removed (list): この変更で削除された取引のsummary_row形式タプル
+        added (list): この変更で追加された取引のsummary_row形式タプル
+        accounts (iterable): 行の追加・削除以外で変更された口座（残高の再計算など）
+
+    Returns:
+        int: 変更後のデータバージョン
+    """
+    result = db.session.execute(text("UPDATE data_version SET version = version + 1 WHERE id = 1"))
+    if result.rowcount == 0:
+        db.session.add(DataVersion(id=1, version=1))
+        db.session.flush()
+    version = get_data_version()
+
+    removed = list(removed)
+    added = list(added)
+    affected_accounts = set(accounts)
+    affected_accounts.update(row[0] for row in removed)
+    affected_accounts.update(row[0] for row in added)
+
+    db.session.info.setdefault(_PENDING_KEY, []).append({
+        'version': version,
+        'removed': removed,
+        'added': added,
+        'accounts': affected_accounts,
+    })
+    return version
+
+def get_pending_change_mark():
+    """未コミットの変更の現在の件数を取得（セーブポイントの開始時に記録する）
+
+    Returns:
+        int: セッションに溜まっている未コミットの変更の件数
+    """
+    return len(db.session.info.get(_PENDING_KEY, ()))
+
+def discard_pending_changes(mark):
+    """セーブポイントのロールバックに合わせて、記録した件数より後の未コミットの変更を破棄する
+
+    Args:
+        mark (int): get_pending_change_markで取得した件数
+    """
+    pending = db.session.info.get(_PENDING_KEY)
+    if pending:
+        del pending[mark:]
+
+def apply_ledger_changes(removed=(), added=()):
+    """取引の書き込みに伴う派生データを、呼び出し元のDBトランザクション内で更新する
+
+    Args:
+        removed (iterable): 削除された（または変更前の）取引のsummary_row形式タプル
+        added (iterable): 追加された（または変更後の）取引のsummary_row形式タプル
+
+    Returns:
+        int: 変更後のデータバージョン
+    """
+    removed = list(removed)
+    added = list(added)
+    apply_summary_delta(removed, sign=-1)
+    apply_summary_delta(added, sign=1)
+    apply_account_delta(removed, added)
+    return bump_data_version(removed, added)
+
+@event.listens_for(db.session, 'after_commit')
+def _notify_commit_listeners(session):
+    """コミットされた台帳の変更を登録済みの関数に通知する
+
+    セーブポイントの解放でも呼ばれるため、外側のトランザクションのコミット時にだけ通知する
+    （最後のCOMMITが失敗した変更を通知しないようにする）。
+    """
+    if session.in_nested_transaction():
+        return
+    changes = session.info.pop(_PENDING_KEY, None)
+    if not changes:
+        return
+    for change in changes:
+        for listener in _commit_listeners:
+            try:
+                listener(change)
+            except Exception:
+                from flask import current_app
+                current_app.logger.error("台帳変更の通知処理でエラーが発生しました", exc_info=True)
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_pending_changes(session):
+    """ロールバックされた変更を破棄する
+
+    セーブポイントのロールバックでは、呼び出し元がdiscard_pending_changesでそのセーブポイント内の変更だけを破棄する。
+    """
+    if session.in_nested_transaction():
+        return
+    session.info.pop(_PENDING_KEY, None)
@@ -0,0 +1,219 @@
+"""
+Server Money - リクエストごとのメモリ計測
+
+このファイルは、抽出したリクエストの処理中にtracemallocでメモリの割り当てを追跡し、
+ピークのメモリ使用量と割り当て元の上位（アプリケーションのコードの行ごとに集計）を
+エンドポイントごとの直近の統計として保持する機能を提供します。
+
+MEMORY_PROFILING_ENABLED=trueの場合のみ有効で、リクエストの一部（MEMORY_PROFILING_SAMPLE_RATE）
+だけを計測します。tracemallocはプロセス全体の割り当てを追跡するため、同時に計測するリクエストは
+1つだけにし（計測中に届いたリクエストは計測しない）、計測が終わるとtracemallocを停止します。
+計測中に他のスレッドが行った割り当ても含まれるため、値は目安です。
+追跡中はプロセス全体の割り当てが数倍以上遅くなるため、抽出率は低く保ってください。
+ピークがMEMORY_BUDGET_MBを超えたリクエストは警告としてログに出力します。
+統計はワーカープロセスごとに保持します。
+"""
+
+import math
+import os
+import random
+import threading
+import time
+import tracemalloc
+from collections import deque
+from datetime import datetime
+from flask import g, request
+
+# 割り当て元をアプリケーションのコードの行に集計するための基準ディレクトリ
+_APP_ROOT = os.path.dirname(os.path.abspath(__file__)) + os.sep
+
+# 計測の内部処理による割り当ては除く
+_TRACE_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, __file__),
+)
+
+_MB = 1024 * 1024
+
+def _is_app_frame(filename):
+    return filename.startswith(_APP_ROOT) and 'site-packages' not in filename
+
+def _allocation_sites(snapshot, limit):
+    """スナップショットの割り当てを、呼び出し元をたどった最初のアプリケーションのコードの行ごとに集計
+
+    アプリケーションのコードを経由しない割り当て（ライブラリ内部のキャッシュなど）は、
+    割り当てが行われた行に集計します。
+    """
+    sites = {}
+    for stat in snapshot.statistics('traceback'):
+        # tracebackは新しい呼び出しが最後になるよう並べ替えて保持されている
+        frame = next((frame for frame in reversed(stat.traceback) if _is_app_frame(frame.filename)),
+                     stat.traceback[-1])
+        site = f'{os.path.relpath(frame.filename, _APP_ROOT) if _is_app_frame(frame.filename) else frame.filename}:{frame.lineno}'
+        size, count = sites.get(site, (0, 0))
+        sites[site] = (size + stat.size, count + stat.count)
+    top = sorted(sites.items(), key=lambda item: item[1][0], reverse=True)[:limit]
+    return [{'site': site, 'size_bytes': size, 'count': count} for site, (size, count) in top]
+
+class _Profile:
+    """計測中のリクエスト"""
+
+    __slots__ = ('endpoint', 'method', 'baseline', 'started_tracing', 'started_at', 'finished')
+
+    def __init__(self, endpoint, method, baseline, started_tracing):
+        self.endpoint = endpoint
+        self.method = method
+        self.baseline = baseline
+        self.started_tracing = started_tracing
+        self.started_at = time.perf_counter()
+        self.finished = False
+
+class MemoryProfiler:
+    """抽出したリクエストのピークメモリと割り当て元を計測し、エンドポイントごとに集計する"""
+
+    def __init__(self):
+        self._app = None
+        self._active = threading.Lock()  # 計測中のリクエストは1つだけ
+        self._lock = threading.Lock()  # 統計の更新
+        self._samples = {}  # エンドポイント -> 直近の計測結果のdeque
+
+    def init_app(self, app):
+        """アプリケーションを登録し、有効な場合はリクエストの前後に計測を組み込む
+
+        Args:
+            app: Flaskアプリケーションインスタンス
+        """
+        self._app = app
+        if not app.config['MEMORY_PROFILING_ENABLED']:
+            return
+        app.before_request(self._start)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        app.logger.info(
+            f"メモリ計測を有効化しました: 抽出率 {app.config['MEMORY_PROFILING_SAMPLE_RATE']}, "
+            f"上限 {app.config['MEMORY_BUDGET_MB']}MB"
+        )
+
+    @property
+    def enabled(self):
+        return self._app is not None and self._app.config['MEMORY_PROFILING_ENABLED']
+
+    def _start(self):
+        if request.endpoint in (None, 'static'):
+            return
+        if random.random() >= self._app.config['MEMORY_PROFILING_SAMPLE_RATE']:
+            return
+        if not self._active.acquire(blocking=False):
+            return
+
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(self._app.config['MEMORY_PROFILING_FRAMES'])
+        else:
+            # 起動オプションなどで追跡済みの場合は、追跡を止めずにピークだけ測り直す
+            tracemalloc.reset_peak()
+        g.memory_profile = _Profile(request.endpoint, request.method,
+                                    tracemalloc.get_traced_memory()[0], started_tracing)
+
+    def _after_request(self, response):
+        profile = g.pop('memory_profile', None)
+        if profile is None:
+            return response
+        if response.mimetype == 'text/event-stream':
+            # 終わりのないイベントストリームは計測しない
+            self._finish(profile, None)
+        elif response.is_streamed:
+            # ストリーミングするレスポンスは送信し終えた時点までを計測する
+            response.call_on_close(lambda: self._finish(profile, response.status_code))
+        else:
+            self._finish(profile, response.status_code)
+        return response
+
+    def _teardown_request(self, exc):
+        # 例外でafter_requestが呼ばれなかった場合
+        profile = g.pop('memory_profile', None)
+        if profile is not None:
+            self._finish(profile, 500)
+
+    def _finish(self, profile, status_code):
+        """計測を終了し、結果を記録する（status_codeがNoneの場合は記録せずに終了する）"""
+        if profile.finished:
+            return
+        profile.finished = True
+        try:
+            peak = max(0, tracemalloc.get_traced_memory()[1] - profile.baseline)
+            if status_code is None:
+                return
+            duration_ms = (time.perf_counter() - profile.started_at) * 1000
+            snapshot = tracemalloc.take_snapshot().filter_traces(_TRACE_FILTERS)
+            sites = _allocation_sites(snapshot, self._app.config['MEMORY_PROFILING_TOP_SITES'])
+        finally:
+            if profile.started_tracing:
+                tracemalloc.stop()
+            self._active.release()
+
+        self._record(profile, status_code, peak, duration_ms, sites)
+
+    def _record(self, profile, status_code, peak, duration_ms, sites):
+        sample = {
+            'method': profile.method,
+            'status': status_code,
+            'peak_bytes': peak,
+            'duration_ms': round(duration_ms, 1),
+            'recorded_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'top_sites': sites
+        }
+        with self._lock:
+            samples = self._samples.get(profile.endpoint)
+            if samples is None:
+                samples = self._samples[profile.endpoint] = deque(maxlen=self._app.config['MEMORY_STATS_WINDOW'])
+            samples.append(sample)
+
+        budget = self._app.config['MEMORY_BUDGET_MB']
+        if budget > 0 and peak > budget * _MB:
+            top = ', '.join(f"{site['site']} {site['size_bytes'] / _MB:.1f}MB" for site in sites[:3])
+            self._app.logger.warning(
+                f"メモリ使用量が上限を超えました: {profile.endpoint} ({profile.method}) "
+                f"ピーク {peak / _MB:.1f}MB / 上限 {budget}MB, {duration_ms:.0f}ms"
+                + (f", 割り当て元: {top}" if top else '')
+            )
+        else:
+            self._app.logger.debug(f"メモリ計測: {profile.endpoint} ピーク {peak / _MB:.1f}MB, {duration_ms:.0f}ms")
+
+    def get_stats(self):
+        """エンドポイントごとの直近の計測結果の統計を取得
+
+        Returns:
+            list: エンドポイントごとの統計（samples, peak_bytes_max, peak_bytes_avg, peak_bytes_p95,
+                last_peak_bytes, over_budget, last_recorded_at, worst）の辞書のリスト。
+                worstはピークが最大だった計測結果（割り当て元の上位を含む）。ピークの最大値の降順
+        """
+        budget_bytes = self._app.config['MEMORY_BUDGET_MB'] * _MB
+        with self._lock:
+            snapshot = {endpoint: list(samples) for endpoint, samples in self._samples.items()}
+
+        stats = []
+        for endpoint, samples in snapshot.items():
+            peaks = sorted(sample['peak_bytes'] for sample in samples)
+            worst = max(samples, key=lambda sample: sample['peak_bytes'])
+            stats.append({
+                'endpoint': endpoint,
+                'samples': len(samples),
+                'peak_bytes_max': peaks[-1],
+                'peak_bytes_avg': round(sum(peaks) / len(peaks)),
+                'peak_bytes_p95': peaks[math.ceil(len(peaks) * 0.95) - 1],
+                'last_peak_bytes': samples[-1]['peak_bytes'],
+                'over_budget': sum(1 for peak in peaks if budget_bytes > 0 and peak > budget_bytes),
+                'last_recorded_at': samples[-1]['recorded_at'],
+                'worst': worst
+            })
+        stats.sort(key=lambda stat: stat['peak_bytes_max'], reverse=True)
+        return stats
+
+    def reset(self):
+        """計測結果を全て削除する"""
+        with self._lock:
+            self._samples.clear()
+
+# アプリケーション全体で共有するメモリ計測（ワーカープロセスごと）
+memory_profiler = MemoryProfiler()
@@ -0,0 +1,189 @@
+"""
+Server Money - データベースマイグレーション
+
+このファイルは、SQLiteのPRAGMA user_versionでスキーマのバージョンを管理し、
+未適用のマイグレーション（テーブル追加、既存データからのバックフィルなど）を順に適用します。
+
+起動時はPRAGMA user_versionがSCHEMA_VERSIONと一致するとテーブル作成（create_all）自体を
+省略するため、モデルにテーブルやインデックスを追加した場合は、それを作成するマイグレーションも追加してください。
+"""
+
+from sqlalchemy import text
+from models import db
+
+def _has_legacy_transaction_layout():
+    """取引テーブルが口座名・項目名を文字列で持つ旧レイアウトか判定
+
+    Returns:
+        bool: accountカラムが存在する場合True（v4で辞書idに変換される）
+    """
+    columns = db.session.execute(text('PRAGMA table_info("transaction")')).all()
+    return any(column[1] == 'account' for column in columns)
+
+def _migrate_monthly_summary(app):
+    """月次集計テーブルを既存の取引から構築"""
+    from rollup import rebuild_monthly_summary
+
+    if _has_legacy_transaction_layout():
+        # 集計は辞書idのレイアウトを前提とするため、v4の変換後に構築する
+        return
+    rows = rebuild_monthly_summary()
+    app.logger.info(f"月次集計を構築しました: {rows}行")
+
+def _migrate_data_version_and_day_index(app):
+    """データバージョンの初期行と、日単位の期間一覧用の式インデックスを作成"""
+    db.session.execute(text("INSERT OR IGNORE INTO data_version (id, version) VALUES (1, 0)"))
+    db.session.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_transaction_account_day ON "transaction" (account, date(date))'
+    ))
+
+def _migrate_accounts(app):
+    """(account, date, id)インデックスを作成し、口座レジストリを既存の取引から構築"""
+    from accounts import rebuild_accounts
+    from utils import load_credit_card_items
+
+    db.session.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_transaction_account_date ON "transaction" (account, date, id)'
+    ))
+    if _has_legacy_transaction_layout():
+        # 口座レジストリは辞書idのレイアウトを前提とするため、v4の変換後に構築する
+        return
+    count = rebuild_accounts(load_credit_card_items())
+    app.logger.info(f"口座レジストリを構築しました: {count}口座")
+
+def _migrate_name_dictionaries(app):
+    """取引テーブルの口座名・項目名を辞書テーブル（account_names / item_names）のidに置き換える
+
+    SQLiteはカラムの型変更ができないため、旧テーブルを退避して新しいレイアウトで作り直し、
+    idを保ったまま行を移します。新規作成されたデータベースは既に新しいレイアウトのため何もしません。
+    """
+    from models import Transaction
+    from rollup import rebuild_monthly_summary
+    from accounts import rebuild_accounts
+    from utils import load_credit_card_items
+
+    if not _has_legacy_transaction_layout():
+        return
+
+    # インデックス名はデータベース全体で一意のため、新しいテーブルを作る前に削除する
+    db.session.execute(text('DROP INDEX IF EXISTS ix_transaction_account_day'))
+    db.session.execute(text('DROP INDEX IF EXISTS ix_transaction_account_date'))
+    db.session.execute(text('ALTER TABLE "transaction" RENAME TO transaction_legacy'))
+    Transaction.__table__.create(db.session.connection())
+
+    db.session.execute(text(
+        "INSERT OR IGNORE INTO account_names (name) "
+        "SELECT DISTINCT account FROM transaction_legacy ORDER BY account"
+    ))
+    db.session.execute(text(
+        "INSERT OR IGNORE INTO item_names (name) "
+        "SELECT DISTINCT item FROM transaction_legacy ORDER BY item"
+    ))
+    result = db.session.execute(text(
+        'INSERT INTO "transaction" (id, account_id, date, item_id, type, amount, balance) '
+        "SELECT t.id, a.id, t.date, i.id, t.type, t.amount, t.balance FROM transaction_legacy AS t "
+        "JOIN account_names AS a ON a.name = t.account "
+        "JOIN item_names AS i ON i.name = t.item ORDER BY t.id"
+    ))
+    db.session.execute(text("DROP TABLE transaction_legacy"))
+    app.logger.info(f"取引テーブルを辞書idのレイアウトに変換しました: {result.rowcount}件")
+
+    # 旧レイアウトでv1・v3の構築を見送っている場合があるため、派生データを作り直す
+    rebuild_monthly_summary()
+    rebuild_accounts(load_credit_card_items())
+
+def _migrate_change_journal(app):
+    """取引の変更履歴を記録するトリガーを作成
+
+    既存の取引は履歴を持たないため、クライアントは最初の同期で全件を取得します。
+    取引テーブルを作り直すマイグレーションを追加する場合は、トリガーも作り直すこと。
+    """
+    from changes import install_change_journal_triggers
+
+    install_change_journal_triggers()
+
+def _migrate_archive(app):
+    """年単位のアーカイブ用のテーブル（transaction_archive / opening_balances / archive_state）を作成"""
+    from models import OpeningBalance, ArchiveState, transaction_archive
+
+    connection = db.session.connection()
+    for table in (transaction_archive, OpeningBalance.__table__, ArchiveState.__table__):
+        table.create(connection, checkfirst=True)
+
+def _migrate_transaction_autoincrement(app):
+    """取引テーブルをAUTOINCREMENTで作り直し、idの採番をアーカイブ済みの取引を含めた最大値から続ける
+
+    AUTOINCREMENTがない場合、SQLiteは取引テーブルに残っている最大のid + 1を採番するため、
+    最大のidを持つ取引をアーカイブすると、アーカイブ済みの取引と同じidが新しい取引に使われてしまいます。
+    idを保ったまま行を移し、変更履歴のトリガーは行を移した後に作り直します（移動は履歴に記録しない）。
+    """
+    from models import Transaction
+    from changes import install_change_journal_triggers
+
+    table_sql = db.session.execute(text(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'transaction'"
+    )).scalar()
+    if 'AUTOINCREMENT' not in (table_sql or '').upper():
+        # トリガーとインデックスは旧テーブルとともに削除されるため、名前の重複を避けて先に削除する
+        db.session.execute(text('DROP INDEX IF EXISTS ix_transaction_account_day'))
+        db.session.execute(text('DROP INDEX IF EXISTS ix_transaction_account_date'))
+        db.session.execute(text('ALTER TABLE "transaction" RENAME TO transaction_rowid'))
+        for trigger in ('insert', 'update', 'delete'):
+            db.session.execute(text(f"DROP TRIGGER IF EXISTS trg_change_journal_{trigger}"))
+        Transaction.__table__.create(db.session.connection())
+        result = db.session.execute(text(
+            'INSERT INTO "transaction" (id, account_id, date, item_id, type, amount, balance) '
+            "SELECT id, account_id, date, item_id, type, amount, balance FROM transaction_rowid ORDER BY id"
+        ))
+        db.session.execute(text("DROP TABLE transaction_rowid"))
+        install_change_journal_triggers()
+        app.logger.info(f"取引テーブルをAUTOINCREMENTで作り直しました: {result.rowcount}件")
+
+    # 既にアーカイブ済みの取引がある場合も、そのidより後から採番する
+    db.session.execute(text("DELETE FROM sqlite_sequence WHERE name = 'transaction'"))
+    db.session.execute(text(
+        "INSERT INTO sqlite_sequence (name, seq) SELECT 'transaction', COALESCE(MAX(id), 0) FROM ("
+        'SELECT MAX(id) AS id FROM "transaction" UNION ALL SELECT MAX(id) FROM transaction_archive)'
+    ))
+
+# (バージョン, 説明, 関数) のリスト。バージョンは昇順で追加していくこと
+MIGRATIONS = [
+    (1, '月次集計テーブルの構築', _migrate_monthly_summary),
+    (2, 'データバージョンと日単位インデックスの作成', _migrate_data_version_and_day_index),
+    (3, '口座レジストリの構築', _migrate_accounts),
+    (4, '口座名・項目名の辞書化', _migrate_name_dictionaries),
+    (5, '取引の変更履歴の作成', _migrate_change_journal),
+    (6, 'アーカイブテーブルの作成', _migrate_archive),
+    (7, '取引IDの再利用の防止（AUTOINCREMENT）', _migrate_transaction_autoincrement),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def get_schema_version():
+    """現在のスキーマバージョンを取得
+
+    Returns:
+        int: PRAGMA user_versionの値
+    """
+    return db.session.execute(text("PRAGMA user_version")).scalar()
+
+def run_migrations(app):
+    """未適用のマイグレーションを順に適用する（アプリケーションコンテキスト内で呼び出すこと）
+
+    Args:
+        app: Flaskアプリケーションインスタンス
+    """
+    current_version = get_schema_version()
+    for version, description, migrate in MIGRATIONS:
+        if version <= current_version:
+            continue
+        app.logger.info(f"マイグレーションを適用します: v{version} {description}")
+        try:
+            migrate(app)
+            # PRAGMAはパラメータバインドできないため整数を直接埋め込む
+            db.session.execute(text(f"PRAGMA user_version = {int(version)}"))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            app.logger.error(f"マイグレーションに失敗しました: v{version} {description}", exc_info=True)
+            raise
@@ -6,30 +6,181 @@ Server Money - データベースモデル定義
 
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+from sqlalchemy import event, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.hybrid import hybrid_property, Comparator
+from sqlalchemy.sql import operators
+from database import RoutingSession
+
+# 読み取り専用のリクエストは、セッションが読み取り専用エンジンに振り分ける
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+# 名前辞書の参照をセッション内でキャッシュするキー
+_NAME_REF_CACHE_KEY = 'name_ref_cache'
+
+class AccountName(db.Model):
+    """口座名の辞書モデル
+    
+    取引テーブルは口座名を直接持たず、この辞書のidを参照します。
+    
+    Attributes:
+        id: 主キー（取引テーブルのaccount_idが参照）
+        name: 口座名
+    """
+    
+    __tablename__ = 'account_names'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False, unique=True)
+    
+    def __repr__(self):
+        """デバッグ用の文字列表現"""
+        return f'<AccountName {self.id}: {self.name}>'
+
+
+class ItemName(db.Model):
+    """取引項目名の辞書モデル
+    
+    取引テーブルは項目名を直接持たず、この辞書のidを参照します。
+    
+    Attributes:
+        id: 主キー（取引テーブルのitem_idが参照）
+        name: 取引項目名
+    """
+    
+    __tablename__ = 'item_names'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(200), nullable=False, unique=True)
+    
+    def __repr__(self):
+        """デバッグ用の文字列表現"""
+        return f'<ItemName {self.id}: {self.name}>'
+
+
+def get_name_ref(model, name):
+    """名前辞書の行を取得し、存在しない場合は作成する
+    
+    他のプロセスと同時に同じ名前を追加しても重複しないよう、
+    INSERT OR IGNOREで追加してから読み直します。
+    
+    Args:
+        model: AccountName または ItemName
+        name (str): 名前
+    
+    Returns:
+        AccountName または ItemName のインスタンス
+    """
+    cache = db.session.info.setdefault(_NAME_REF_CACHE_KEY, {})
+    ref = cache.get((model, name))
+    if ref is not None and ref in db.session:
+        return ref
+    
+    with db.session.no_autoflush:
+        ref = db.session.execute(select(model).filter_by(name=name)).scalar_one_or_none()
+        if ref is None:
+            db.session.execute(sqlite_insert(model).values(name=name).on_conflict_do_nothing())
+            ref = db.session.execute(select(model).filter_by(name=name)).scalar_one()
+    cache[(model, name)] = ref
+    return ref
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _discard_name_ref_cache(session, previous_transaction):
+    """ロールバック（セーブポイントを含む）で取り消された可能性のある名前辞書の参照を破棄する"""
+    session.info.pop(_NAME_REF_CACHE_KEY, None)
+
+
+class _NameComparator(Comparator):
+    """名前での比較を辞書idでの比較に変換するComparator
+    
+    Transaction.account == '現金' のような条件を
+    account_id IN (SELECT id FROM account_names WHERE name = '現金') に変換し、
+    取引テーブル側では整数の比較（インデックス）だけで絞り込めるようにします。
+    """
+    
+    # 辞書側で評価して取引をidで絞り込む演算子
+    _PREDICATES = {
+        operators.eq, operators.ne, operators.in_op, operators.not_in_op,
+        operators.like_op, operators.not_like_op, operators.ilike_op, operators.not_ilike_op,
+        operators.startswith_op, operators.endswith_op, operators.contains_op,
+    }
+    
+    def __init__(self, id_column, model, name_expression):
+        super().__init__(name_expression)
+        self.id_column = id_column
+        self.model = model
+    
+    def operate(self, op, *other, **kwargs):
+        if op in self._PREDICATES:
+            ids = select(self.model.id).where(op(self.model.name, *other, **kwargs))
+            return self.id_column.in_(ids)
+        return op(self.__clause_element__(), *other, **kwargs)
 
-db = SQLAlchemy()
 
 class Transaction(db.Model):
     """取引データモデル
     
+    口座名と取引項目名は辞書テーブル（account_names / item_names）のidで保持し、
+    accountとitemは名前として読み書き・検索できる属性として提供します。
+    
     Attributes:
         id: 主キー
         account: 資金項目（口座名）
+        account_id: 口座名辞書のid
         date: 取引日時
         item: 取引項目名
+        item_id: 取引項目名辞書のid
         type: 取引種別（'income' or 'expense'）
         amount: 金額
         balance: 残高（自動計算）
     """
     
     id = db.Column(db.Integer, primary_key=True)
-    account = db.Column(db.String(100), nullable=False)
+    account_id = db.Column(db.Integer, db.ForeignKey('account_names.id'), nullable=False)
     date = db.Column(db.DateTime, nullable=False)
-    item = db.Column(db.String(200), nullable=False)
+    item_id = db.Column(db.Integer, db.ForeignKey('item_names.id'), nullable=False)
     type = db.Column(db.String(10), nullable=False)  # 'income' or 'expense'
     amount = db.Column(db.Integer, nullable=False)
     balance = db.Column(db.Integer, nullable=False)
     
+    account_ref = db.relationship(AccountName, lazy='joined', innerjoin=True)
+    item_ref = db.relationship(ItemName, lazy='joined', innerjoin=True)
+    
+    # AUTOINCREMENTにより、アーカイブテーブルへ移した取引のidが再利用されないようにする
+    __table_args__ = (
+        db.Index('ix_transaction_account_date', account_id, date, id),
+        db.Index('ix_transaction_account_day', account_id, db.func.date(date)),
+        {'sqlite_autoincrement': True},
+    )
+    
+    @hybrid_property
+    def account(self):
+        return self.account_ref.name if self.account_ref is not None else None
+    
+    @account.inplace.setter
+    def _account_setter(self, name):
+        self.account_ref = get_name_ref(AccountName, name)
+    
+    @account.inplace.comparator
+    @classmethod
+    def _account_comparator(cls):
+        name = select(AccountName.name).where(AccountName.id == cls.account_id).scalar_subquery()
+        return _NameComparator(cls.account_id, AccountName, name)
+    
+    @hybrid_property
+    def item(self):
+        return self.item_ref.name if self.item_ref is not None else None
+    
+    @item.inplace.setter
+    def _item_setter(self, name):
+        self.item_ref = get_name_ref(ItemName, name)
+    
+    @item.inplace.comparator
+    @classmethod
+    def _item_comparator(cls):
+        name = select(ItemName.name).where(ItemName.id == cls.item_id).scalar_subquery()
+        return _NameComparator(cls.item_id, ItemName, name)
+    
     def to_dict(self):
         """辞書形式でデータを返す（JSON化用）
         
@@ -49,4 +200,199 @@ class Transaction(db.Model):
 
     def __repr__(self):
         """デバッグ用の文字列表現"""
-        return f'<Transaction {self.id}: {self.account} - {self.item} - {self.amount}円>'
\ No newline at end of file
+        return f'<Transaction {self.id}: {self.account} - {self.item} - {self.amount}円>'
+
+# 締めた年の取引（archive.pyで取引テーブルから移す。列とidは取引テーブルと同じ）
+transaction_archive = db.Table(
+    'transaction_archive',
+    db.Column('id', db.Integer, primary_key=True),
+    db.Column('account_id', db.Integer, db.ForeignKey('account_names.id'), nullable=False),
+    db.Column('date', db.DateTime, nullable=False),
+    db.Column('item_id', db.Integer, db.ForeignKey('item_names.id'), nullable=False),
+    db.Column('type', db.String(10), nullable=False),
+    db.Column('amount', db.Integer, nullable=False),
+    db.Column('balance', db.Integer, nullable=False),
+    db.Index('ix_transaction_archive_account_date', 'account_id', 'date', 'id'),
+)
+
+
+class OpeningBalance(db.Model):
+    """口座ごとの期首残高モデル
+    
+    アーカイブした取引の収支を口座ごとに合計した値です。取引テーブルに残っている取引の残高は、
+    この値から積み上げた値になります。
+    
+    Attributes:
+        account_id: 口座名辞書のid（主キー）
+        balance: アーカイブした取引の収支の合計（期首残高）
+        transaction_count: アーカイブした取引件数
+    """
+    
+    __tablename__ = 'opening_balances'
+    
+    account_id = db.Column(db.Integer, db.ForeignKey('account_names.id'), primary_key=True)
+    balance = db.Column(db.Integer, nullable=False, default=0)
+    transaction_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        """デバッグ用の文字列表現"""
+        return f'<OpeningBalance {self.account_id}: {self.balance}円/{self.transaction_count}件>'
+
+
+class ArchiveState(db.Model):
+    """アーカイブの状態モデル（単一行）
+    
+    Attributes:
+        id: 主キー（常に1）
+        archived_before: この日時より前の取引はアーカイブ済み（年の初め）
+    """
+    
+    __tablename__ = 'archive_state'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    archived_before = db.Column(db.DateTime, nullable=False)
+    
+    def __repr__(self):
+        """デバッグ用の文字列表現"""
+        return f'<ArchiveState {self.archived_before}>'
+
+
+class MonthlySummary(db.Model):
+    """月次集計（ロールアップ）モデル
+    
+    取引の書き込み時に差分で更新され、年・月単位の集計や
+    利用可能期間の一覧を取引件数に依存せず数百行から返すために使用します。
+    
+    Attributes:
+        account: 資金項目（口座名）
+        year_month: 年月（'YYYY-MM'）
+        type: 取引種別（'income' or 'expense'）
+        item: 取引項目名
+        total: 金額の合計
+        count: 取引件数
+    """
+    
+    __tablename__ = 'monthly_summary'
+    
+    account = db.Column(db.String(100), primary_key=True)
+    year_month = db.Column(db.String(7), primary_key=True)
+    type = db.Column(db.String(10), primary_key=True)
+    item = db.Column(db.String(200), primary_key=True)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        """デバッグ用の文字列表現"""
+        return f'<MonthlySummary {self.account} {self.year_month} {self.type} {self.item}: {self.total}円/{self.count}件>'
+
+
+class DataVersion(db.Model):
+    """データバージョンモデル
+    
+    取引の書き込みごとに1ずつ増える単一行のカウンタです。
+    プロセス内のキャッシュはこの値が変わったときに無効化されます。
+    
+    Attributes:
+        id: 主キー（常に1）
+        version: 現在のデータバージョン
+    """
+    
+    __tablename__ = 'data_version'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        """デバッグ用の文字列表現"""
+        return f'<DataVersion {self.version}>'
+
+
+class ChangeJournal(db.Model):
+    """取引の変更履歴モデル
+
+    取引テーブルのトリガー（changes.py）が、追加・更新・削除のたびに取引ごとの行を
+    最新の変更番号で書き換えます。削除された取引は、整理（compact）されるまで
+    deletedの行として残ります。
+
+    Attributes:
+        transaction_id: 取引ID（主キー）
+        seq: 最後に変更されたときの変更番号
+        created_seq: 追加されたときの変更番号（履歴の記録開始前からある取引は0）
+        deleted: 削除された場合True
+    """
+
+    __tablename__ = 'change_journal'
+
+    transaction_id = db.Column(db.Integer, primary_key=True)
+    seq = db.Column(db.Integer, nullable=False, index=True)
+    created_seq = db.Column(db.Integer, nullable=False, default=0)
+    deleted = db.Column(db.Boolean, nullable=False, default=False)
+
+    def __repr__(self):
+        """デバッグ用の文字列表現"""
+        return f'<ChangeJournal {self.transaction_id} seq={self.seq} deleted={self.deleted}>'
+
+
+class ChangeJournalState(db.Model):
+    """変更履歴の状態モデル（単一行）
+
+    Attributes:
+        id: 主キー（常に1）
+        sequence: 最後に割り当てた変更番号
+        compacted_through: 削除の記録を整理済みの変更番号（これより古い番号からの差分は返せない）
+    """
+
+    __tablename__ = 'change_journal_state'
+
+    id = db.Column(db.Integer, primary_key=True)
+    sequence = db.Column(db.Integer, nullable=False, default=0)
+    compacted_through = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        """デバッグ用の文字列表現"""
+        return f'<ChangeJournalState {self.sequence} compacted={self.compacted_through}>'
+
+
+class Account(db.Model):
+    """口座（資金項目）レジストリモデル
+    
+    取引の書き込み時に差分で更新され、口座一覧や口座ごとの概要を
+    取引テーブルを走査せずに返すために使用します。
+    取引が0件になった口座も、クレジットカード設定を保持するため行は残します。
+    
+    Attributes:
+        name: 口座名（主キー）
+        balance: 現在残高（収入の合計 - 支出の合計）
+        transaction_count: 取引件数
+        first_date: 最初の取引日時
+        last_date: 最後の取引日時
+        is_credit_card: クレジットカード項目として設定されている場合True
+    """
+    
+    __tablename__ = 'accounts'
+    
+    name = db.Column(db.String(100), primary_key=True)
+    balance = db.Column(db.Integer, nullable=False, default=0)
+    transaction_count = db.Column(db.Integer, nullable=False, default=0)
+    first_date = db.Column(db.DateTime, nullable=True)
+    last_date = db.Column(db.DateTime, nullable=True)
+    is_credit_card = db.Column(db.Boolean, nullable=False, default=False)
+    
+    def to_dict(self):
+        """辞書形式でデータを返す（JSON化用）
+        
+        Returns:
+            dict: 口座データの辞書
+        """
+        return {
+            'name': self.name,
+            'balance': self.balance,
+            'transaction_count': self.transaction_count,
+            'first_date': self.first_date.strftime('%Y-%m-%d') if self.first_date else None,
+            'last_date': self.last_date.strftime('%Y-%m-%d') if self.last_date else None,
+            'is_credit_card': self.is_credit_card
+        }
+    
+    def __repr__(self):
+        """デバッグ用の文字列表現"""
+        return f'<Account {self.name}: {self.balance}円/{self.transaction_count}件>'
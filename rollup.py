@@ -0,0 +1,171 @@
+"""
+Server Money - 月次集計（ロールアップ）
+
+このファイルは、(口座, 年月, 種別, 項目) 単位の合計金額と件数を保持する
+monthly_summaryテーブルの差分更新・再構築と、それを使った期間集計を提供します。
+"""
+
+from collections import defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from models import db, MonthlySummary, ItemName
+from archive import ledger_source, ledger_table_sql
+
+_UPSERT_SQL = text(
+    "INSERT INTO monthly_summary (account, year_month, type, item, total, count) "
+    "VALUES (:account, :year_month, :type, :item, :total, :count) "
+    "ON CONFLICT (account, year_month, type, item) DO UPDATE SET "
+    "total = monthly_summary.total + excluded.total, "
+    "count = monthly_summary.count + excluded.count"
+)
+
+def summary_row(transaction):
+    """取引オブジェクト（または同じ属性を持つ辞書）から集計用の値を取り出す
+
+    Args:
+        transaction: Transactionインスタンス、またはaccount/date/type/item/amountを持つ辞書
+
+    Returns:
+        tuple: (account, date, type, item, amount)
+    """
+    if isinstance(transaction, dict):
+        return (transaction['account'], transaction['date'], transaction['type'],
+                transaction['item'], transaction['amount'])
+    return (transaction.account, transaction.date, transaction.type,
+            transaction.item, transaction.amount)
+
+def apply_summary_delta(rows, sign=1):
+    """取引の追加・削除分を月次集計に反映する
+
+    呼び出し元のDBトランザクション内で実行されるため、
+    取引本体の書き込みと同じコミットで確定します。
+
+    Args:
+        rows (iterable): summary_rowと同じ形式のタプルのリスト
+        sign (int): 追加時は1、削除時は-1
+    """
+    deltas = defaultdict(lambda: [0, 0])
+    for account, date, tx_type, item, amount in rows:
+        key = (account, date.strftime('%Y-%m'), tx_type, item)
+        deltas[key][0] += sign * amount
+        deltas[key][1] += sign
+
+    if not deltas:
+        return
+
+    db.session.execute(_UPSERT_SQL, [
+        {'account': account, 'year_month': year_month, 'type': tx_type,
+         'item': item, 'total': total, 'count': count}
+        for (account, year_month, tx_type, item), (total, count) in deltas.items()
+    ])
+
+    if sign < 0:
+        db.session.execute(text("DELETE FROM monthly_summary WHERE count <= 0"))
+
+def rebuild_monthly_summary():
+    """取引テーブル（アーカイブ済みの取引を含む）から月次集計を作り直す（コミットは呼び出し元で行う）
+
+    Returns:
+        int: 作成された集計行数
+    """
+    db.session.execute(text("DELETE FROM monthly_summary"))
+    # 集計は辞書idで行い、名前への変換は集計後の行に対してのみ行う
+    db.session.execute(text(
+        "INSERT INTO monthly_summary (account, year_month, type, item, total, count) "
+        "SELECT a.name, s.year_month, s.type, i.name, s.total, s.count FROM ("
+        "SELECT account_id, strftime('%Y-%m', date) AS year_month, type, item_id, "
+        f"SUM(amount) AS total, COUNT(*) AS count FROM {ledger_table_sql()} "
+        "GROUP BY account_id, strftime('%Y-%m', date), type, item_id) AS s "
+        "JOIN account_names AS a ON a.id = s.account_id "
+        "JOIN item_names AS i ON i.id = s.item_id"
+    ))
+    return db.session.query(MonthlySummary).count()
+
+def _period_filter(query, unit, period):
+    """期間指定をmonthly_summaryのクエリに適用する"""
+    if unit == 'year':
+        return query.filter(MonthlySummary.year_month.between(f'{period}-01', f'{period}-12'))
+    if unit == 'month':
+        return query.filter(MonthlySummary.year_month == period)
+    return query
+
+def get_period_summary(accounts, unit='all', period=None):
+    """月次集計から期間内の収支合計と項目別内訳を取得
+
+    日単位は月次集計では表せないため、その日の取引（アーカイブ済みの年の場合はアーカイブテーブル）を直接集計します。
+
+    Args:
+        accounts (list): 対象口座名のリスト
+        unit (str): 'all' / 'year' / 'month' / 'day'
+        period (str): unitに対応する期間（'YYYY' / 'YYYY-MM' / 'YYYY-MM-DD'）
+
+    Returns:
+        dict: 収入・支出の合計と、金額の降順に並んだ項目別内訳
+
+    Raises:
+        ValueError: 日単位の期間形式が正しくない場合
+    """
+    if unit == 'day':
+        day_start = datetime.strptime(period, '%Y-%m-%d')
+        day_end = day_start + timedelta(days=1)
+        source = ledger_source(day_start, day_end)
+        rows = db.session.query(
+            source.type, ItemName.name,
+            db.func.sum(source.amount), db.func.count(source.id)
+        ).join(ItemName, ItemName.id == source.item_id).filter(
+            source.account.in_(accounts),
+            source.date >= day_start,
+            source.date < day_end
+        ).group_by(source.type, source.item_id).all()
+        return build_summary_result(rows)
+
+    query = db.session.query(
+        MonthlySummary.type, MonthlySummary.item,
+        db.func.sum(MonthlySummary.total), db.func.sum(MonthlySummary.count)
+    ).filter(MonthlySummary.account.in_(accounts))
+    query = _period_filter(query, unit, period)
+    rows = query.group_by(MonthlySummary.type, MonthlySummary.item).all()
+    return build_summary_result(rows)
+
+def build_summary_result(rows):
+    """(type, item, total, count) の行から集計結果の辞書を組み立てる
+
+    Args:
+        rows (list): (type, item, total, count) のタプルのリスト
+
+    Returns:
+        dict: 収入・支出の合計と項目別内訳
+    """
+    result = {
+        'income': 0, 'expense': 0,
+        'income_count': 0, 'expense_count': 0,
+        'income_items': [], 'expense_items': []
+    }
+    for tx_type, item, total, count in rows:
+        if tx_type not in ('income', 'expense'):
+            continue
+        result[tx_type] += total
+        result[f'{tx_type}_count'] += count
+        result[f'{tx_type}_items'].append({'item': item, 'amount': total, 'count': count})
+
+    result['income_items'].sort(key=lambda x: x['amount'], reverse=True)
+    result['expense_items'].sort(key=lambda x: x['amount'], reverse=True)
+    return result
+
+def get_summary_periods(accounts, unit):
+    """月次集計からデータが存在する年または年月の一覧を取得
+
+    Args:
+        accounts (list): 対象口座名のリスト
+        unit (str): 'year' または 'month'
+
+    Returns:
+        list: 昇順の期間キー（'YYYY' または 'YYYY-MM'）
+    """
+    column = MonthlySummary.year_month
+    if unit == 'year':
+        column = db.func.substr(MonthlySummary.year_month, 1, 4)
+    rows = db.session.query(column).filter(
+        MonthlySummary.account.in_(accounts)
+    ).distinct().order_by(column).all()
+    return [row[0] for row in rows]
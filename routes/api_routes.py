@@ -8,51 +8,116 @@ Server Money - API関連ルート
 import csv
 import os
 import glob
-from datetime import datetime
-from flask import Blueprint, jsonify, request, send_file
+from datetime import datetime, timedelta
+from flask import Blueprint, Response, jsonify, request, send_file, stream_with_context
+from sqlalchemy import update, delete
 from auth import login_required
-from models import db, Transaction
+from database import use_read_engine, get_tenant_shard
+from models import db, Transaction, AccountName, ItemName, get_name_ref
+from rollup import summary_row, get_period_summary, get_summary_periods, build_summary_result
+from ledger import apply_ledger_changes, get_data_version
+from write_queue import transaction_writer, rebalance_after_write, apply_pending_rebalances, WriteQueueBusy
+from item_index import item_index
+from snapshot import ledger_snapshot, to_epoch_day
+from transaction_query import parse_transaction_query, get_query_date_range, QuerySyntaxError
+from columnar import wants_columnar, transactions_to_columnar, COLUMNAR_MEDIA_TYPE
+from changes import get_changes
+from events import sse_connections, stream_changes
+from tenants import TenantScoped, tenant_path
+from archive import ledger_source, ensure_writable, ensure_not_archived, ArchivedPeriodError
+from audit import find_balance_divergences, repair_balance_divergences, format_divergence
+from memory_stats import memory_profiler
+from accounts import get_account_names, get_account_overview, set_credit_card_flags, get_total_balance_history
 from utils import (
     ensure_table_exists, cleanup_old_backups, 
     generate_unique_filename, validate_transaction_data, 
-    parse_transaction_date, parse_csv_file, import_csv_transactions
+    parse_transaction_date, parse_csv_file, import_csv_transactions,
+    load_credit_card_items, resolve_analysis_accounts, VersionedCache
 )
 
 # Blueprintの作成
 api_bp = Blueprint('api', __name__)
 
+@api_bp.before_request
+def route_reads_to_read_engine():
+    """GETリクエストは読み取り専用エンジンで実行し、書き込みを待たせない"""
+    if request.method in ('GET', 'HEAD'):
+        use_read_engine()
+
+# 取引一覧のページングの既定件数と上限
+TRANSACTIONS_PER_PAGE = 100
+TRANSACTIONS_PER_PAGE_MAX = 1000
+
+# 一括追加APIで一度に受け付ける取引数の上限
+BATCH_MAX_TRANSACTIONS = 1000
+
+# 利用可能期間のキャッシュ（データバージョンが変わると無効、マルチテナントモードではシャードごと）
+_periods_cache = TenantScoped(lambda: VersionedCache(maxsize=256))
+
+def _snapshot_enabled():
+    """分析に列指向スナップショットを使用するか判定"""
+    from flask import current_app
+    return current_app.config.get('LEDGER_SNAPSHOT_ENABLED', True)
+
 @api_bp.route("/api/accounts")
 @login_required
 def get_accounts():
-    """データベースから口座名（資金項目名）のリストを取得するAPI"""
+    """口座レジストリから口座名（資金項目名）のリストを取得するAPI"""
     from flask import current_app
     
     current_app.logger.debug("口座リストを取得中")
     ensure_table_exists()
     
-    # Get distinct accounts from transactions in the database
-    db_accounts_query = db.session.query(Transaction.account.distinct()).all()
-    # Use a set for efficient addition and uniqueness
-    fund_items_set = {acc[0] for acc in db_accounts_query if acc[0]} 
-    
-    # Convert set to list and sort alphabetically
-    sorted_fund_item_list = sorted(list(fund_items_set))
+    # 取引が存在する口座のみ、名前順で取得
+    sorted_fund_item_list = get_account_names()
     
     current_app.logger.debug(f"口座リスト取得完了: {len(sorted_fund_item_list)}件")
     return jsonify(sorted_fund_item_list)
 
+@api_bp.route("/api/accounts/overview")
+@login_required
+def get_accounts_overview():
+    """口座ごとの残高・取引件数・最初と最後の取引日・クレジットカード設定を取得するAPI"""
+    from flask import current_app
+    
+    current_app.logger.debug("口座概要を取得中")
+    
+    try:
+        overview = get_account_overview()
+        current_app.logger.debug(f"口座概要取得完了: {len(overview)}件")
+        return jsonify(overview)
+    except Exception as e:
+        current_app.logger.error(f"口座概要の取得に失敗しました: {str(e)}", exc_info=True)
+        return jsonify({'error': f'口座概要の取得に失敗しました: {str(e)}'}), 500
+
 @api_bp.route("/api/items")
 @login_required
 def get_items():
     """データベースから項目名（item）のリストを取得するAPI
     
+    prefixまたはlimitを指定すると、プロセス内の前方一致インデックスから
+    使用回数と最終使用日で順位付けした候補のみを返します。
+    
     クエリパラメータ:
         account: 資金項目名を指定すると、その資金項目の項目名のみを返す
+        prefix: 入力中の文字列（前方一致、全角・半角と大文字小文字は区別しない）
+        limit: 候補の最大件数（デフォルト: 10、最大: 100）
     """
     from flask import current_app
     
     account = request.args.get('account', '').strip()
     
+    if 'prefix' in request.args or 'limit' in request.args:
+        prefix = request.args.get('prefix', '')
+        try:
+            limit = min(max(int(request.args.get('limit', 10)), 1), 100)
+        except ValueError:
+            return jsonify({'error': 'limitは数値である必要があります'}), 400
+        
+        item_list = item_index.search(prefix, account or None, limit)
+        current_app.logger.debug(f"項目候補を取得しました（前方一致: '{prefix}', 資金項目: '{account}'）: {len(item_list)}件")
+        return jsonify(item_list)
+    
     if account:
         current_app.logger.debug(f"項目リストを取得中（資金項目: {account}）")
     else:
@@ -60,12 +125,15 @@ def get_items():
     
     ensure_table_exists()
     
+    # 取引（アーカイブ済みを含む）で使われている項目の辞書idを整数のまま重複排除し、名前は辞書から引く
+    source = ledger_source()
+    used_item_ids = db.session.query(source.item_id).distinct()
     if account:
         # 指定された資金項目の項目名のみを取得
-        items = db.session.query(Transaction.item.distinct()).filter_by(account=account).order_by(Transaction.item).all()
-    else:
-        # 全ての項目名を取得
-        items = db.session.query(Transaction.item.distinct()).order_by(Transaction.item).all()
+        used_item_ids = used_item_ids.filter(source.account == account)
+    items = db.session.query(ItemName.name).filter(
+        ItemName.id.in_(used_item_ids)
+    ).order_by(ItemName.name).all()
     
     item_list = [item[0] for item in items]
     
@@ -75,29 +143,106 @@ def get_items():
 @api_bp.route("/api/transactions")
 @login_required
 def get_transactions():
-    """取引履歴をJSON形式で返すAPI"""
+    """取引履歴をJSON形式で返すAPI
+    
+    q（検索クエリ言語）、page、per_pageのいずれかを指定した場合は、
+    条件・並び順をSQLで適用し、指定ページの取引と総件数を返します。
+    アーカイブ済みの取引は、qの日付の条件がアーカイブ済みの期間を含む場合（指定がない場合を含む）のみ読み取ります。
+    """
     from flask import current_app
     
     search_query = request.args.get('search', '').strip()
     account = request.args.get('account', '').strip()
+    paged = any(key in request.args for key in ('q', 'page', 'per_page'))
     
     current_app.logger.debug(f"取引履歴を取得中 - 検索: '{search_query}', 口座: '{account}'")
     
     ensure_table_exists()
     
-    query = Transaction.query
+    try:
+        source = ledger_source(*get_query_date_range(request.args.get('q', '').strip() if paged else ''))
+    except QuerySyntaxError as e:
+        return jsonify({'error': f'検索クエリが正しくありません: {e}'}), 400
+    query = db.session.query(source)
     
     # 検索クエリがある場合、項目名で部分一致検索
     if search_query:
-        query = query.filter(Transaction.item.like(f'%{search_query}%'))
+        query = query.filter(source.item.like(f'%{search_query}%'))
     
     # 口座指定がある場合、口座でフィルタ
     if account:
-        query = query.filter(Transaction.account == account)
+        query = query.filter(source.account == account)
+    
+    columnar = wants_columnar(request)
+    if paged:
+        response = _get_transactions_page(query, source, columnar)
+    elif columnar:
+        result = transactions_to_columnar(query.order_by(source.id), source)
+        current_app.logger.debug(f"取引履歴取得完了（列指向形式）: {result['count']}件")
+        response = _columnar_response(result)
+    else:
+        transactions = query.order_by(source.id).all()
+        current_app.logger.debug(f"取引履歴取得完了: {len(transactions)}件")
+        response = jsonify([t.to_dict() for t in transactions])
+    
+    # 同じURLでもAcceptヘッダーによって形式が変わるため、キャッシュに伝える
+    if not isinstance(response, tuple):
+        response.vary.add('Accept')
+    return response
+
+def _columnar_response(result):
+    """列指向形式の結果をJSONレスポンスにする内部関数"""
+    response = jsonify(result)
+    if 'format' not in request.args:
+        response.mimetype = COLUMNAR_MEDIA_TYPE
+    return response
+
+def _get_transactions_page(query, source, columnar=False):
+    """検索クエリ言語とページングを適用した取引一覧を返す内部関数
+    
+    Args:
+        query: search/accountの条件を適用済みのクエリ
+        source: クエリのエンティティ（archive.ledger_sourceの戻り値）
+        columnar (bool): transactionsを列指向形式で返す場合True
+    
+    Returns:
+        Response: transactions, total, page, per_page, has_next を含むJSON
+    """
+    from flask import current_app
+    
+    q = request.args.get('q', '').strip()
+    try:
+        page = int(request.args.get('page', 1))
+        per_page = int(request.args.get('per_page', TRANSACTIONS_PER_PAGE))
+    except ValueError:
+        return jsonify({'error': 'pageとper_pageは整数である必要があります'}), 400
+    if page < 1 or not 1 <= per_page <= TRANSACTIONS_PER_PAGE_MAX:
+        return jsonify({'error': f'pageは1以上、per_pageは1〜{TRANSACTIONS_PER_PAGE_MAX}である必要があります'}), 400
     
-    transactions = query.all()
-    current_app.logger.debug(f"取引履歴取得完了: {len(transactions)}件")
-    return jsonify([t.to_dict() for t in transactions])
+    try:
+        conditions, order_by = parse_transaction_query(q, source)
+    except QuerySyntaxError as e:
+        return jsonify({'error': f'検索クエリが正しくありません: {e}'}), 400
+    
+    query = query.filter(*conditions)
+    total = query.order_by(None).count()
+    page_query = query.order_by(*order_by).offset((page - 1) * per_page).limit(per_page)
+    if columnar:
+        transactions = transactions_to_columnar(page_query, source)
+        count = transactions['count']
+    else:
+        transactions = [t.to_dict() for t in page_query.all()]
+        count = len(transactions)
+    
+    current_app.logger.debug(f"取引履歴取得完了: {count}/{total}件 (q: '{q}', page: {page})")
+    result = {
+        'transactions': transactions,
+        'total': total,
+        'page': page,
+        'per_page': per_page,
+        'has_next': page * per_page < total
+    }
+    return _columnar_response(result) if columnar else jsonify(result)
 
 @api_bp.route("/api/transactions", methods=['POST'])
 @login_required
@@ -121,44 +266,164 @@ def add_transaction():
         
         # 金額の変換
         amount = int(data['amount'])
-        
-        # 指定された口座の最新残高を取得
         account = data['account']
-        latest_transaction = Transaction.query.filter_by(account=account).order_by(
-            Transaction.date.desc(), Transaction.id.desc()).first()
-        current_balance = latest_transaction.balance if latest_transaction else 0
         
-        # 新しい残高を計算
-        if data['type'] == 'income':
-            new_balance = current_balance + amount
-        else:
-            new_balance = current_balance - amount
-        
-        # 新しいトランザクションを作成
-        transaction = Transaction(
-            account=account,
-            date=date_obj,
-            item=data['item'],
-            type=data['type'],
-            amount=amount,
-            balance=new_balance
+        # 残高の計算と追加は書き込みキューでまとめて行い、コミット後の取引を受け取る
+        transaction = transaction_writer.submit(
+            lambda: _write_new_transaction(account, date_obj, data['item'], data['type'], amount)
         )
         
-        db.session.add(transaction)
-        db.session.commit()
-        
         current_app.logger.info(f"新しい取引を追加しました: {account} - {data['item']} - {amount}円")
         
         return jsonify({
             'message': '取引が正常に追加されました',
-            'transaction': transaction.to_dict()
+            'transaction': transaction
         }), 201
         
+    except ArchivedPeriodError as e:
+        return jsonify({'error': str(e)}), 409
+    except WriteQueueBusy as e:
+        current_app.logger.warning(f"取引の追加を受け付けられませんでした: {str(e)}")
+        return jsonify({'error': f'取引の追加を受け付けられませんでした: {str(e)}'}), 503
     except Exception as e:
-        db.session.rollback()
         current_app.logger.error(f"取引の追加に失敗しました: {str(e)}", exc_info=True)
         return jsonify({'error': f'取引の追加に失敗しました: {str(e)}'}), 500
 
+def _write_new_transaction(account, date_obj, item, tx_type, amount):
+    """取引を追加し、追加した日時以降の残高を計算する（書き込みキューで実行）
+    
+    Returns:
+        function: コミット後に取引の辞書を返す関数
+    
+    Raises:
+        ArchivedPeriodError: アーカイブ済みの期間の日時の場合
+    """
+    ensure_writable(date_obj)
+    transaction = Transaction(
+        account=account,
+        date=date_obj,
+        item=item,
+        type=tx_type,
+        amount=amount,
+        balance=0
+    )
+    db.session.add(transaction)
+    db.session.flush()
+    apply_ledger_changes(added=[summary_row(transaction)])
+    # 過去の日時の取引でも後続の残高がずれないよう、追加した日時以降を再計算する
+    rebalance_after_write(account, date_obj)
+    return transaction.to_dict
+
+@api_bp.route("/api/transactions/batch", methods=['POST'])
+@login_required
+def add_transactions_batch():
+    """複数の取引を一括で追加するAPI
+    
+    全ての取引を検証してから1つのDBトランザクションで追加し、
+    影響を受けた口座ごとに、追加した取引のうち最も古い日時から残高を1回だけ再計算します。
+    1件でも不正な取引があれば何も追加せず、取引ごとの結果を400で返します。
+    
+    リクエストボディ:
+        transactions: POST /api/transactionsと同じ形式の取引のリスト
+    """
+    from flask import current_app
+    
+    try:
+        data = request.get_json(silent=True) or {}
+        items = data.get('transactions') if isinstance(data, dict) else data
+        
+        if not isinstance(items, list) or not items:
+            return jsonify({'error': 'transactionsは1件以上の取引のリストである必要があります'}), 400
+        if len(items) > BATCH_MAX_TRANSACTIONS:
+            return jsonify({'error': f'一度に追加できる取引は{BATCH_MAX_TRANSACTIONS}件までです'}), 400
+        
+        # 全件を先に検証する
+        results = []
+        parsed = []
+        for index, item_data in enumerate(items):
+            if not isinstance(item_data, dict):
+                results.append({'index': index, 'status': 'error', 'error': '取引はオブジェクトである必要があります'})
+                continue
+            is_valid, error_message = validate_transaction_data(item_data)
+            if is_valid:
+                try:
+                    date_obj = parse_transaction_date(item_data['date'], item_data.get('time'))
+                except ValueError as e:
+                    is_valid, error_message = False, str(e)
+            if not is_valid:
+                results.append({'index': index, 'status': 'error', 'error': error_message})
+                continue
+            results.append({'index': index, 'status': 'valid'})
+            parsed.append((index, item_data, date_obj))
+        
+        if len(parsed) != len(items):
+            current_app.logger.warning(f"一括追加の検証に失敗しました: {len(items) - len(parsed)}/{len(items)}件が不正")
+            return jsonify({
+                'error': '不正な取引が含まれているため、取引は追加されませんでした',
+                'results': results
+            }), 400
+        
+        transactions = transaction_writer.submit(lambda: _write_transactions_batch(parsed))
+        accounts = {transaction['account'] for _index, transaction in transactions}
+        
+        current_app.logger.info(f"取引を一括追加しました: {len(transactions)}件, {len(accounts)}口座")
+        
+        return jsonify({
+            'message': f'{len(transactions)}件の取引が追加されました',
+            'created_count': len(transactions),
+            'results': [
+                {'index': index, 'status': 'created', 'transaction': transaction}
+                for index, transaction in transactions
+            ]
+        }), 201
+        
+    except ArchivedPeriodError as e:
+        return jsonify({'error': str(e)}), 409
+    except WriteQueueBusy as e:
+        current_app.logger.warning(f"取引の一括追加を受け付けられませんでした: {str(e)}")
+        return jsonify({'error': f'取引の一括追加を受け付けられませんでした: {str(e)}'}), 503
+    except Exception as e:
+        current_app.logger.error(f"取引の一括追加に失敗しました: {str(e)}", exc_info=True)
+        return jsonify({'error': f'取引の一括追加に失敗しました: {str(e)}'}), 500
+
+def _write_transactions_batch(parsed):
+    """検証済みの取引をまとめて追加し、口座ごとに残高を1回だけ再計算する（書き込みキューで実行）
+    
+    Args:
+        parsed (list): (index, 取引データ, 日時) のリスト
+    
+    Returns:
+        function: コミット後に (index, 取引の辞書) のリストを返す関数
+    
+    Raises:
+        ArchivedPeriodError: アーカイブ済みの期間の日時が含まれている場合（1件も追加しない）
+    """
+    ensure_writable(*(date_obj for _index, _item_data, date_obj in parsed))
+    # 残高は口座ごとにまとめて再計算するため、一時的に0で作成
+    transactions = []
+    for index, item_data, date_obj in parsed:
+        transaction = Transaction(
+            account=item_data['account'],
+            date=date_obj,
+            item=item_data['item'],
+            type=item_data['type'],
+            amount=int(item_data['amount']),
+            balance=0
+        )
+        db.session.add(transaction)
+        transactions.append((index, transaction))
+    
+    earliest_dates = {}
+    for _index, transaction in transactions:
+        account = transaction.account
+        if account not in earliest_dates or transaction.date < earliest_dates[account]:
+            earliest_dates[account] = transaction.date
+    
+    apply_ledger_changes(added=[summary_row(t) for _index, t in transactions])
+    for account, from_date in earliest_dates.items():
+        rebalance_after_write(account, from_date)
+    return lambda: [(index, transaction.to_dict()) for index, transaction in transactions]
+
 @api_bp.route("/api/transactions/<int:transaction_id>", methods=['PUT', 'PATCH'])
 @login_required
 def update_transaction(transaction_id):
@@ -182,34 +447,66 @@ def update_transaction(transaction_id):
         # 金額の変換
         amount = int(data['amount'])
 
-        # 既存トランザクション取得
-        transaction = Transaction.query.get(transaction_id)
-        if not transaction:
-            return jsonify({'error': '該当取引が見つかりません'}), 404
-
-        # 変更前の情報
-        old_account = transaction.account
-
-        # トランザクション内容を更新
-        transaction.account = data['account']
-        transaction.date = date_obj
-        transaction.item = data['item']
-        transaction.type = data['type']
-        transaction.amount = amount
-        db.session.commit()
-
-        # 残高の再計算（同じ口座の全取引、日付昇順）
-        for account in set([old_account, data['account']]):
-            _recalculate_balance_for_account(account)
+        transaction = transaction_writer.submit(
+            lambda: _write_transaction_update(
+                transaction_id, data['account'], date_obj, data['item'], data['type'], amount
+            )
+        )
 
         current_app.logger.info(f"取引を更新しました: ID {transaction_id} - {data['account']} - {data['item']}")
 
-        return jsonify({'message': '取引が更新されました', 'transaction': transaction.to_dict()})
+        return jsonify({'message': '取引が更新されました', 'transaction': transaction})
+    except LookupError:
+        return jsonify({'error': '該当取引が見つかりません'}), 404
+    except ArchivedPeriodError as e:
+        return jsonify({'error': str(e)}), 409
+    except WriteQueueBusy as e:
+        current_app.logger.warning(f"取引の更新を受け付けられませんでした: {str(e)}")
+        return jsonify({'error': f'取引の更新を受け付けられませんでした: {str(e)}'}), 503
     except Exception as e:
-        db.session.rollback()
         current_app.logger.error(f"取引の更新に失敗しました: {str(e)}", exc_info=True)
         return jsonify({'error': f'取引の更新に失敗しました: {str(e)}'}), 500
 
+def _write_transaction_update(transaction_id, account, date_obj, item, tx_type, amount):
+    """取引を更新し、影響を受けた口座の残高を再計算する（書き込みキューで実行）
+    
+    Returns:
+        function: コミット後に取引の辞書を返す関数
+    
+    Raises:
+        LookupError: 取引が見つからない場合
+        ArchivedPeriodError: アーカイブ済みの取引、または変更後の日時がアーカイブ済みの期間の場合
+    """
+    transaction = db.session.get(Transaction, transaction_id)
+    if transaction is None:
+        ensure_not_archived(transaction_id)
+        raise LookupError(transaction_id)
+    ensure_writable(date_obj)
+
+    # 変更前の情報
+    old_account = transaction.account
+    old_date = transaction.date
+    old_row = summary_row(transaction)
+
+    # トランザクション内容を更新
+    transaction.account = account
+    transaction.date = date_obj
+    transaction.item = item
+    transaction.type = tx_type
+    transaction.amount = amount
+    db.session.flush()
+
+    # 月次集計などの派生データに差分を反映（変更前を取り消して変更後を加算）
+    apply_ledger_changes(removed=[old_row], added=[summary_row(transaction)])
+
+    # 残高の再計算（変更前後の日時のうち古い方以降）
+    if old_account == account:
+        rebalance_after_write(account, min(old_date, date_obj))
+    else:
+        rebalance_after_write(old_account, old_date)
+        rebalance_after_write(account, date_obj)
+    return transaction.to_dict
+
 @api_bp.route("/api/transactions/<int:transaction_id>", methods=['DELETE'])
 @login_required
 def delete_transaction(transaction_id):
@@ -217,28 +514,375 @@ def delete_transaction(transaction_id):
     from flask import current_app
     
     try:
-        transaction = Transaction.query.get(transaction_id)
-        if not transaction:
-            return jsonify({'error': '該当取引が見つかりません'}), 404
-        
-        account = transaction.account
-        item = transaction.item
-        amount = transaction.amount
-        
-        db.session.delete(transaction)
-        db.session.commit()
+        account, item, amount = transaction_writer.submit(lambda: _write_transaction_delete(transaction_id))
         
         current_app.logger.info(f"取引を削除しました: ID {transaction_id} - {account} - {item} - {amount}円")
         
-        # 残高の再計算
-        _recalculate_balance_for_account(account)
-        
         return jsonify({'message': '取引が削除されました'})
+    except LookupError:
+        return jsonify({'error': '該当取引が見つかりません'}), 404
+    except ArchivedPeriodError as e:
+        return jsonify({'error': str(e)}), 409
+    except WriteQueueBusy as e:
+        current_app.logger.warning(f"取引の削除を受け付けられませんでした: {str(e)}")
+        return jsonify({'error': f'取引の削除を受け付けられませんでした: {str(e)}'}), 503
     except Exception as e:
-        db.session.rollback()
         current_app.logger.error(f"取引の削除に失敗しました: {str(e)}", exc_info=True)
         return jsonify({'error': f'取引の削除に失敗しました: {str(e)}'}), 500
 
+def _write_transaction_delete(transaction_id):
+    """取引を削除し、削除した日時以降の残高を再計算する（書き込みキューで実行）
+    
+    Returns:
+        function: コミット後に削除した取引の (口座, 取引項目, 金額) を返す関数
+    
+    Raises:
+        LookupError: 取引が見つからない場合
+        ArchivedPeriodError: アーカイブ済みの取引の場合
+    """
+    transaction = db.session.get(Transaction, transaction_id)
+    if transaction is None:
+        ensure_not_archived(transaction_id)
+        raise LookupError(transaction_id)
+    
+    deleted = (transaction.account, transaction.item, transaction.amount)
+    date_obj = transaction.date
+    
+    removed_row = summary_row(transaction)
+    db.session.delete(transaction)
+    db.session.flush()
+    apply_ledger_changes(removed=[removed_row])
+    rebalance_after_write(deleted[0], date_obj)
+    return lambda: deleted
+
+def _build_bulk_filter(filter_data):
+    """一括更新・削除APIのフィルタをSQLの条件に変換する内部関数
+    
+    Args:
+        filter_data (dict): account / item（文字列またはリスト）、type、
+            date_from / date_to（'YYYY-MM-DD'、両端を含む）、ids（取引IDのリスト）
+    
+    Returns:
+        tuple: (conditions, error_message)
+    
+    Raises:
+        ValueError: 日付やIDの形式が正しくない場合
+    """
+    if not isinstance(filter_data, dict):
+        return None, 'filterはオブジェクトである必要があります'
+    
+    def as_list(value):
+        return value if isinstance(value, list) else [value]
+    
+    conditions = []
+    if filter_data.get('account'):
+        conditions.append(Transaction.account.in_(as_list(filter_data['account'])))
+    if filter_data.get('item'):
+        conditions.append(Transaction.item.in_(as_list(filter_data['item'])))
+    if filter_data.get('type'):
+        if filter_data['type'] not in ['income', 'expense']:
+            return None, 'typeは"income"または"expense"である必要があります'
+        conditions.append(Transaction.type == filter_data['type'])
+    if filter_data.get('date_from'):
+        conditions.append(Transaction.date >= datetime.strptime(filter_data['date_from'], '%Y-%m-%d'))
+    if filter_data.get('date_to'):
+        date_to = datetime.strptime(filter_data['date_to'], '%Y-%m-%d') + timedelta(days=1)
+        conditions.append(Transaction.date < date_to)
+    if filter_data.get('ids'):
+        conditions.append(Transaction.id.in_([int(tx_id) for tx_id in as_list(filter_data['ids'])]))
+    
+    # 条件なしで全取引を書き換えることがないよう、空のフィルタは受け付けない
+    if not conditions:
+        return None, 'filterには1つ以上の条件を指定してください'
+    return conditions, None
+
+def _select_bulk_targets(conditions):
+    """フィルタに一致する取引をsummary_row形式で取得する内部関数
+    
+    Args:
+        conditions (list): _build_bulk_filterで作成した条件
+    
+    Returns:
+        list: (account, date, type, item, amount) のタプルのリスト
+    """
+    return [tuple(row) for row in db.session.query(
+        AccountName.name, Transaction.date, Transaction.type, ItemName.name, Transaction.amount
+    ).join(AccountName, AccountName.id == Transaction.account_id).join(
+        ItemName, ItemName.id == Transaction.item_id
+    ).filter(*conditions).all()]
+
+def _earliest_dates_by_account(rows):
+    """summary_row形式の行から口座ごとの最も古い日時を求める内部関数"""
+    earliest_dates = {}
+    for account, date, _type, _item, _amount in rows:
+        if account not in earliest_dates or date < earliest_dates[account]:
+            earliest_dates[account] = date
+    return earliest_dates
+
+def _count_by_account(rows):
+    """summary_row形式の行から口座ごとの件数を求める内部関数"""
+    counts = {}
+    for row in rows:
+        counts[row[0]] = counts.get(row[0], 0) + 1
+    return counts
+
+@api_bp.route("/api/transactions/bulk_update", methods=['POST'])
+@login_required
+def bulk_update_transactions():
+    """フィルタに一致する取引の項目名の変更・口座の移動を一括で行うAPI
+    
+    一致した取引を1つのUPDATE文で書き換え、残高は影響を受けた口座ごとに
+    一致した取引のうち最も古い日時から1回だけ再計算します。
+    アーカイブ済みの取引は対象になりません。
+    
+    リクエストボディ:
+        filter: _build_bulk_filterの条件
+        set: 変更内容（item: 新しい項目名、account: 移動先の口座名）
+        dry_run: Trueの場合は一致件数のみを返し、変更しない
+    """
+    from flask import current_app
+    
+    try:
+        data = request.get_json(silent=True) or {}
+        changes = data.get('set') or {}
+        dry_run = bool(data.get('dry_run', False))
+        
+        if not isinstance(changes, dict):
+            return jsonify({'error': 'setはオブジェクトである必要があります'}), 400
+        new_account = str(changes.get('account') or '').strip()
+        new_item = str(changes.get('item') or '').strip()
+        if not new_account and not new_item:
+            return jsonify({'error': 'setにはitemまたはaccountを指定してください'}), 400
+        
+        try:
+            conditions, error_message = _build_bulk_filter(data.get('filter'))
+        except (ValueError, TypeError):
+            return jsonify({'error': 'filterの日付またはIDの形式が正しくありません'}), 400
+        if error_message:
+            return jsonify({'error': error_message}), 400
+        
+        if dry_run:
+            removed, updated_count, rebalanced = _select_bulk_targets(conditions), 0, None
+        else:
+            # 対象の取得から書き換えまでを書き込みキューで行い、他の書き込みと交錯しないようにする
+            removed, updated_count, rebalanced = transaction_writer.submit(
+                lambda: _write_bulk_update(conditions, new_account, new_item)
+            )
+        response = {
+            'dry_run': dry_run,
+            'matched_count': len(removed),
+            'accounts': _count_by_account(removed),
+            'updated_count': updated_count
+        }
+        if rebalanced is None:
+            return jsonify(response)
+
+        current_app.logger.info(
+            f"取引を一括更新しました: {updated_count}件 (項目: '{new_item}', 口座: '{new_account}')"
+        )
+        response['rebalanced_accounts'] = rebalanced
+        return jsonify(response)
+
+    except WriteQueueBusy as e:
+        current_app.logger.warning(f"取引の一括更新を受け付けられませんでした: {str(e)}")
+        return jsonify({'error': f'取引の一括更新を受け付けられませんでした: {str(e)}'}), 503
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"取引の一括更新に失敗しました: {str(e)}", exc_info=True)
+        return jsonify({'error': f'取引の一括更新に失敗しました: {str(e)}'}), 500
+
+def _write_bulk_update(conditions, new_account, new_item):
+    """フィルタに一致する取引の項目名・口座を1つのUPDATE文で書き換え、残高を再計算する（書き込みキューで実行）
+
+    Returns:
+        function: コミット後に (一致した取引のsummary_row形式のリスト, 更新件数, 再計算した口座のリスト) を返す関数
+            （一致する取引がない場合、再計算した口座はNone）
+    """
+    removed = _select_bulk_targets(conditions)
+    if not removed:
+        return lambda: (removed, 0, None)
+
+    values = {}
+    if new_account:
+        values['account_id'] = get_name_ref(AccountName, new_account).id
+    if new_item:
+        values['item_id'] = get_name_ref(ItemName, new_item).id
+    result = db.session.execute(
+        update(Transaction).where(*conditions).values(**values),
+        execution_options={'synchronize_session': False}
+    )
+
+    added = [
+        (new_account or account, date, tx_type, new_item or item, amount)
+        for account, date, tx_type, item, amount in removed
+    ]
+    apply_ledger_changes(removed=removed, added=added)
+
+    # 口座の移動時のみ残高が変わる（移動元・移動先とも最も古い取引から再計算）
+    rebalanced = []
+    if new_account:
+        earliest_dates = _earliest_dates_by_account(removed)
+        earliest_dates[new_account] = min(earliest_dates.values())
+        for account, from_date in earliest_dates.items():
+            rebalance_after_write(account, from_date)
+        rebalanced = sorted(earliest_dates)
+    updated_count = result.rowcount
+    return lambda: (removed, updated_count, rebalanced)
+
+@api_bp.route("/api/transactions/bulk_delete", methods=['POST'])
+@login_required
+def bulk_delete_transactions():
+    """フィルタに一致する取引を一括で削除するAPI
+    
+    一致した取引を1つのDELETE文で削除し、残高は影響を受けた口座ごとに
+    削除した取引のうち最も古い日時から1回だけ再計算します。
+    アーカイブ済みの取引は対象になりません。
+    
+    リクエストボディ:
+        filter: _build_bulk_filterの条件
+        dry_run: Trueの場合は一致件数のみを返し、削除しない
+    """
+    from flask import current_app
+    
+    try:
+        data = request.get_json(silent=True) or {}
+        dry_run = bool(data.get('dry_run', False))
+        
+        try:
+            conditions, error_message = _build_bulk_filter(data.get('filter'))
+        except (ValueError, TypeError):
+            return jsonify({'error': 'filterの日付またはIDの形式が正しくありません'}), 400
+        if error_message:
+            return jsonify({'error': error_message}), 400
+        
+        if dry_run:
+            removed, deleted_count, rebalanced = _select_bulk_targets(conditions), 0, None
+        else:
+            # 対象の取得から削除までを書き込みキューで行い、他の書き込みと交錯しないようにする
+            removed, deleted_count, rebalanced = transaction_writer.submit(
+                lambda: _write_bulk_delete(conditions)
+            )
+        response = {
+            'dry_run': dry_run,
+            'matched_count': len(removed),
+            'accounts': _count_by_account(removed),
+            'deleted_count': deleted_count
+        }
+        if rebalanced is None:
+            return jsonify(response)
+
+        current_app.logger.info(f"取引を一括削除しました: {deleted_count}件, {len(rebalanced)}口座")
+        response['rebalanced_accounts'] = rebalanced
+        return jsonify(response)
+
+    except WriteQueueBusy as e:
+        current_app.logger.warning(f"取引の一括削除を受け付けられませんでした: {str(e)}")
+        return jsonify({'error': f'取引の一括削除を受け付けられませんでした: {str(e)}'}), 503
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"取引の一括削除に失敗しました: {str(e)}", exc_info=True)
+        return jsonify({'error': f'取引の一括削除に失敗しました: {str(e)}'}), 500
+
+def _write_bulk_delete(conditions):
+    """フィルタに一致する取引を1つのDELETE文で削除し、残高を再計算する（書き込みキューで実行）
+
+    Returns:
+        function: コミット後に (一致した取引のsummary_row形式のリスト, 削除件数, 再計算した口座のリスト) を返す関数
+            （一致する取引がない場合、再計算した口座はNone）
+    """
+    removed = _select_bulk_targets(conditions)
+    if not removed:
+        return lambda: (removed, 0, None)
+
+    result = db.session.execute(
+        delete(Transaction).where(*conditions),
+        execution_options={'synchronize_session': False}
+    )
+    apply_ledger_changes(removed=removed)
+
+    earliest_dates = _earliest_dates_by_account(removed)
+    for account, from_date in earliest_dates.items():
+        rebalance_after_write(account, from_date)
+    deleted_count = result.rowcount
+    return lambda: (removed, deleted_count, sorted(earliest_dates))
+
+@api_bp.route("/api/changes")
+@login_required
+def get_transaction_changes():
+    """取引の差分同期API
+    
+    sinceに前回受け取った変更番号を指定すると、それ以降に追加・更新・削除された取引を返します。
+    sinceの省略時や、削除の記録が整理済みで差分を返せない場合はfull_resyncがtrueになるため、
+    クライアントは返されたversionを保持したうえで/api/transactionsから全件を取得し直します。
+    ledgerには前回受け取った台帳のIDを指定します（マルチテナントモードで別のユーザーの
+    台帳の変更番号を使用しないよう、異なる場合はfull_resyncになります）。
+    """
+    from flask import current_app
+    
+    shard = get_tenant_shard()
+    ledger_id = shard.name if shard is not None else 'default'
+    since = request.args.get('since', '').strip()
+    if since:
+        try:
+            since = int(since)
+        except ValueError:
+            return jsonify({'error': 'sinceは整数で指定してください'}), 400
+        if since < 0:
+            return jsonify({'error': 'sinceは0以上で指定してください'}), 400
+    else:
+        since = None
+    if request.args.get('ledger', ledger_id) != ledger_id:
+        since = None
+    
+    try:
+        ensure_table_exists()
+        changes = get_changes(since)
+        changes['ledger'] = ledger_id
+        if changes['full_resync']:
+            current_app.logger.debug(f"差分同期: 全件の再取得が必要です (since={since}, version={changes['version']})")
+        else:
+            current_app.logger.debug(
+                f"差分同期: since={since} version={changes['version']} "
+                f"追加{len(changes['inserted'])}件 更新{len(changes['updated'])}件 削除{len(changes['deleted'])}件"
+            )
+        return jsonify(changes)
+        
+    except Exception as e:
+        current_app.logger.error(f"変更履歴の取得に失敗しました: {str(e)}", exc_info=True)
+        return jsonify({'error': '変更履歴の取得に失敗しました'}), 500
+
+@api_bp.route("/api/events")
+@login_required
+def ledger_events():
+    """台帳の変更通知API（Server-Sent Events）
+    
+    書き込みやインポートがコミットされるたびに、影響を受けた口座とデータバージョンを
+    ledgerイベントで送ります。1接続がワーカースレッドを1つ占有するため、
+    同時接続数がSSE_MAX_CONNECTIONSに達している場合は503を返します。
+    """
+    from flask import current_app
+    
+    limit = current_app.config['SSE_MAX_CONNECTIONS']
+    if not sse_connections.try_acquire(limit):
+        current_app.logger.warning(f"変更通知の同時接続数が上限に達しました: {limit}")
+        response = jsonify({'error': '変更通知の接続数が上限に達しています'})
+        response.headers['Retry-After'] = str(int(current_app.config['SSE_MAX_DURATION']))
+        return response, 503
+    
+    last_event_id = request.headers.get('Last-Event-ID', '').strip()
+    last_event_id = int(last_event_id) if last_event_id.isdigit() else None
+    
+    response = Response(
+        stream_with_context(stream_changes(current_app._get_current_object(), last_event_id)),
+        mimetype='text/event-stream'
+    )
+    # ジェネレータが開始されずに閉じられた場合も接続の枠を解放する
+    response.call_on_close(sse_connections.release)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    current_app.logger.debug(f"変更通知の接続を開始しました ({sse_connections.connection_count}/{limit})")
+    return response
+
 @api_bp.route("/api/balance_history")
 @login_required
 def get_balance_history():
@@ -248,8 +892,14 @@ def get_balance_history():
     current_app.logger.debug("残高履歴を取得中")
     
     try:
-        # 全ての取引を日付順で取得
-        transactions = Transaction.query.order_by(Transaction.date, Transaction.id).all()
+        if _snapshot_enabled():
+            result = ledger_snapshot.balance_history()
+            current_app.logger.debug(f"残高履歴取得完了: {len(result['accounts'])}口座, {len(result['dates'])}日分")
+            return jsonify(result)
+        
+        # 全ての取引（アーカイブ済みを含む）を日付順で取得
+        source = ledger_source()
+        transactions = db.session.query(source).order_by(source.date, source.id).all()
         
         if not transactions:
             current_app.logger.debug("取引データが存在しません")
@@ -298,11 +948,20 @@ def get_balance_history():
 @api_bp.route("/api/balance_history_filtered")
 @login_required
 def get_balance_history_filtered():
-    """残高推移グラフ専用：クレジットカード項目のフィルタリングを考慮した残高推移データを取得するAPI"""
+    """残高推移グラフ専用：クレジットカード項目のフィルタリングを考慮した残高推移データを取得するAPI
+    
+    クエリパラメータ:
+        fund_items: 選択された資金項目（複数指定可能）
+        aggregate: 'total' を指定すると、口座ごとの残高推移の代わりに、対象口座の残高を合計した
+            1本の推移（合計残高が変わった日のみ）をSQLのウィンドウ関数で計算して返す
+    """
     from flask import current_app
-    import json
     
-    current_app.logger.debug("フィルタリング残高履歴を取得中")
+    aggregate = request.args.get('aggregate', '').strip()
+    if aggregate not in ('', 'total'):
+        return jsonify({'error': 'aggregateは"total"のみ指定できます'}), 400
+    
+    current_app.logger.debug(f"フィルタリング残高履歴を取得中{'（合計）' if aggregate else ''}")
     
     try:
         # 選択された資金項目を取得（クエリパラメータから）
@@ -310,38 +969,31 @@ def get_balance_history_filtered():
         
         if not selected_fund_items:
             current_app.logger.debug("選択された資金項目がありません")
+            if aggregate:
+                return jsonify({'aggregate': aggregate, 'accounts': [], 'dates': [], 'total': []})
             return jsonify({'accounts': [], 'dates': [], 'balances': {}})
         
-        # クレジットカード設定を取得
-        settings_file = os.path.join(current_app.instance_path, 'credit_card_settings.json')
-        credit_card_items = []
-        if os.path.exists(settings_file):
-            with open(settings_file, 'r', encoding='utf-8') as f:
-                settings = json.load(f)
-                credit_card_items = settings.get('credit_card_items', [])
-        
-        # 選択された資金項目が全てクレジットカード項目かチェック
-        all_selected_are_credit = len(selected_fund_items) > 0 and all(item in credit_card_items for item in selected_fund_items)
-        
-        # フィルタリング条件を決定
-        if all_selected_are_credit:
-            # 全てクレジットカード項目の場合：選択された項目のみ取得
-            transactions = Transaction.query.filter(
-                Transaction.account.in_(selected_fund_items)
-            ).order_by(Transaction.date, Transaction.id).all()
-        else:
-            # 混在している場合：クレジットカード項目を除外して取得
-            non_credit_selected = [item for item in selected_fund_items if item not in credit_card_items]
-            if not non_credit_selected:
-                # クレジットカード項目のみが選択されている場合（混在ではない）
-                transactions = Transaction.query.filter(
-                    Transaction.account.in_(selected_fund_items)
-                ).order_by(Transaction.date, Transaction.id).all()
-            else:
-                # 混在している場合：非クレジットカード項目のみを取得
-                transactions = Transaction.query.filter(
-                    Transaction.account.in_(non_credit_selected)
-                ).order_by(Transaction.date, Transaction.id).all()
+        # クレジットカード項目の扱いを考慮して対象口座を決定
+        # （全てクレジットカード項目ならそのまま、混在していればクレジットカード項目を除外）
+        target_accounts = resolve_analysis_accounts(selected_fund_items, load_credit_card_items())
+        if aggregate:
+            history = get_total_balance_history(target_accounts)
+            current_app.logger.debug(f"合計残高履歴取得完了: {len(target_accounts)}口座, {len(history['dates'])}件の変化点")
+            return jsonify({
+                'aggregate': aggregate,
+                'accounts': target_accounts,
+                'dates': history['dates'],
+                'total': history['balances']
+            })
+        if _snapshot_enabled():
+            result = ledger_snapshot.balance_history(target_accounts)
+            current_app.logger.debug(f"フィルタリング残高履歴取得完了: {len(result['accounts'])}口座, {len(result['dates'])}日分")
+            return jsonify(result)
+        
+        source = ledger_source()
+        transactions = db.session.query(source).filter(
+            source.account.in_(target_accounts)
+        ).order_by(source.date, source.id).all()
         
         if not transactions:
             current_app.logger.debug("フィルタリング後の取引データが存在しません")
@@ -387,6 +1039,101 @@ def get_balance_history_filtered():
         current_app.logger.error(f"フィルタリング残高履歴の取得に失敗しました: {str(e)}", exc_info=True)
         return jsonify({'error': f'フィルタリング残高履歴の取得に失敗しました: {str(e)}'}), 500
 
+@api_bp.route("/api/summary")
+@login_required
+def get_summary():
+    """期間内の収支合計と項目別内訳を取得するAPI（収支比率・項目別収支グラフ用）
+    
+    年・月・全期間は月次集計テーブルから、日単位は列指向スナップショット
+    （無効時はその日の取引）から集計します。
+    
+    クエリパラメータ:
+        fund_items: 選択された資金項目（複数指定可能）
+        unit: 'all' / 'year' / 'month' / 'day'（デフォルト: 'all'）
+        period: unitに対応する期間（'YYYY' / 'YYYY-MM' / 'YYYY-MM-DD'）
+    """
+    from flask import current_app
+    
+    selected_fund_items = request.args.getlist('fund_items')
+    unit = request.args.get('unit', 'all')
+    period = request.args.get('period', '').strip()
+    
+    if unit not in ['all', 'year', 'month', 'day']:
+        return jsonify({'error': 'unitは"all"、"year"、"month"、"day"のいずれかである必要があります'}), 400
+    if unit != 'all' and not period:
+        return jsonify({'error': 'periodは必須項目です'}), 400
+    
+    current_app.logger.debug(f"期間集計を取得中 - 単位: {unit}, 期間: '{period}', 資金項目: {len(selected_fund_items)}件")
+    
+    try:
+        target_accounts = resolve_analysis_accounts(selected_fund_items, load_credit_card_items())
+        try:
+            if unit == 'day' and _snapshot_enabled():
+                day = to_epoch_day(datetime.strptime(period, '%Y-%m-%d'))
+                summary = build_summary_result(ledger_snapshot.summary(target_accounts, day, day))
+            else:
+                summary = get_period_summary(target_accounts, unit, period)
+        except ValueError:
+            return jsonify({'error': '期間の形式が正しくありません'}), 400
+        
+        summary['unit'] = unit
+        summary['period'] = period
+        current_app.logger.debug(f"期間集計取得完了: 収入{summary['income']}円, 支出{summary['expense']}円")
+        return jsonify(summary)
+        
+    except Exception as e:
+        current_app.logger.error(f"期間集計の取得に失敗しました: {str(e)}", exc_info=True)
+        return jsonify({'error': f'期間集計の取得に失敗しました: {str(e)}'}), 500
+
+@api_bp.route("/api/periods")
+@login_required
+def get_periods():
+    """選択された資金項目でデータが存在する期間（年・月・日）の一覧を取得するAPI
+    
+    年・月は月次集計テーブルから、日は列指向スナップショット
+    （無効時は(account, date(date))の式インデックス）から求めます。
+    結果はデータバージョンごとにキャッシュされます。
+    
+    クエリパラメータ:
+        fund_items: 選択された資金項目（複数指定可能）
+        unit: 'year' / 'month' / 'day'
+    """
+    from flask import current_app
+    
+    selected_fund_items = request.args.getlist('fund_items')
+    unit = request.args.get('unit', 'month')
+    
+    if unit not in ['year', 'month', 'day']:
+        return jsonify({'error': 'unitは"year"、"month"、"day"のいずれかである必要があります'}), 400
+    
+    try:
+        data_version = get_data_version()
+        cache_key = (unit, tuple(sorted(set(selected_fund_items))))
+        periods = _periods_cache.get(cache_key, data_version)
+        
+        if periods is None:
+            if not selected_fund_items:
+                periods = []
+            elif unit == 'day' and _snapshot_enabled():
+                periods = ledger_snapshot.days(selected_fund_items)
+            elif unit == 'day':
+                source = ledger_source()
+                day_column = db.func.date(source.date)
+                rows = db.session.query(day_column).filter(
+                    source.account.in_(selected_fund_items)
+                ).distinct().order_by(day_column).all()
+                periods = [row[0] for row in rows]
+            else:
+                periods = get_summary_periods(selected_fund_items, unit)
+            _periods_cache.set(cache_key, data_version, periods)
+            current_app.logger.debug(f"利用可能期間を取得しました - 単位: {unit}, {len(periods)}件")
+        
+        return jsonify({'unit': unit, 'periods': periods, 'data_version': data_version})
+        
+    except Exception as e:
+        current_app.logger.error(f"利用可能期間の取得に失敗しました: {str(e)}", exc_info=True)
+        return jsonify({'error': f'利用可能期間の取得に失敗しました: {str(e)}'}), 500
+
 @api_bp.route("/api/backup_csv")
 @login_required
 def backup_to_csv():
@@ -395,10 +1142,12 @@ def backup_to_csv():
     
     current_app.logger.info("CSVバックアップを開始しています")
     
-    transactions = Transaction.query.order_by(Transaction.date).all()
+    # アーカイブ済みの取引も含めて全件を書き出す
+    source = ledger_source()
+    transactions = db.session.query(source).order_by(source.date).all()
     
     # バックアップディレクトリがなければ作成
-    backup_dir = 'backups'
+    backup_dir = tenant_path('backups', os.curdir)
     if not os.path.exists(backup_dir):
         os.makedirs(backup_dir)
         current_app.logger.info(f"バックアップディレクトリを作成しました: {backup_dir}")
@@ -438,6 +1187,10 @@ def download_log():
     """最新のログファイルをダウンロードするAPI"""
     from flask import current_app
     
+    if current_app.config['TENANT_MODE']:
+        # ログには全ユーザーの操作が含まれるため、マルチテナントモードでは提供しない
+        return jsonify({'error': 'マルチテナントモードではログファイルをダウンロードできません'}), 403
+    
     current_app.logger.info("ログファイルダウンロードを開始しています")
     
     try:
@@ -575,7 +1328,7 @@ def import_csv():
         
         current_app.logger.info(f"CSVファイル解析完了: {len(transactions_data)}件のトランザクション")
         
-        # データのインポート
+        # データのインポート（追加する場合は、アーカイブ済みの期間の取引を含められない）
         success, imported_count, error_message = import_csv_transactions(transactions_data, import_mode)
         if not success:
             return jsonify({'error': error_message}), 500
@@ -594,27 +1347,15 @@ def import_csv():
             'mode': import_mode
         }), 200
         
+    except ArchivedPeriodError as e:
+        return jsonify({'error': str(e)}), 409
+    except WriteQueueBusy as e:
+        current_app.logger.warning(f"CSVインポートを受け付けられませんでした: {str(e)}")
+        return jsonify({'error': f'CSVインポートを受け付けられませんでした: {str(e)}'}), 503
     except Exception as e:
         current_app.logger.error(f"CSVインポートでエラーが発生しました: {str(e)}", exc_info=True)
         return jsonify({'error': f'CSVインポートに失敗しました: {str(e)}'}), 500
 
-def _recalculate_balance_for_account(account):
-    """指定口座の残高を再計算する内部関数
-    
-    Args:
-        account (str): 口座名
-    """
-    txs = Transaction.query.filter_by(account=account).order_by(Transaction.date, Transaction.id).all()
-    running_balance = 0
-    for tx in txs:
-        if tx.type == 'income':
-            running_balance += tx.amount
-        else:
-            running_balance -= tx.amount
-        tx.balance = running_balance
-    db.session.commit()
-
-
 @api_bp.route("/api/credit_card_settings", methods=['GET'])
 @login_required
 def get_credit_card_settings():
@@ -622,7 +1363,7 @@ def get_credit_card_settings():
     from flask import current_app
     import json
     
-    settings_file = os.path.join(current_app.instance_path, 'credit_card_settings.json')
+    settings_file = tenant_path('credit_card_settings.json', current_app.instance_path)
     
     try:
         if os.path.exists(settings_file):
@@ -658,7 +1399,7 @@ def save_credit_card_settings():
             return jsonify({'error': 'クレジットカード項目は配列である必要があります'}), 400
             
         # 実際に存在する口座項目のみを保存するための検証
-        valid_accounts = {acc[0] for acc in db.session.query(Transaction.account.distinct()).all() if acc[0]}
+        valid_accounts = set(get_account_names())
         invalid_items = [item for item in credit_card_items if item not in valid_accounts]
         
         if invalid_items:
@@ -666,7 +1407,7 @@ def save_credit_card_settings():
             return jsonify({'error': f'存在しない口座項目が指定されました: {", ".join(invalid_items)}'}), 400
         
         # 設定ファイルに保存
-        settings_file = os.path.join(current_app.instance_path, 'credit_card_settings.json')
+        settings_file = tenant_path('credit_card_settings.json', current_app.instance_path)
         
         # instanceディレクトリが存在しない場合は作成
         os.makedirs(os.path.dirname(settings_file), exist_ok=True)
@@ -675,6 +1416,10 @@ def save_credit_card_settings():
         
         with open(settings_file, 'w', encoding='utf-8') as f:
             json.dump(settings, f, ensure_ascii=False, indent=2)
+        
+        # 口座レジストリのクレジットカードフラグにも反映
+        set_credit_card_flags(credit_card_items)
+        db.session.commit()
             
         current_app.logger.info(f"クレジットカード設定を保存しました: {len(credit_card_items)}件")
         
@@ -686,4 +1431,88 @@ def save_credit_card_settings():
     except Exception as e:
         current_app.logger.error(f"クレジットカード設定の保存でエラー: {str(e)}")
         return jsonify({'error': 'クレジットカード設定の保存に失敗しました'}), 500
-    
\ No newline at end of file
+    
+
+@api_bp.route("/api/audit/balances", methods=['GET', 'POST'])
+@login_required
+def audit_balances():
+    """保存された残高の整合性チェックAPI
+    
+    GETは検査結果のみを返し、POSTはずれが見つかった口座を
+    最初にずれた取引以降だけ再計算して修復します。
+    """
+    from flask import current_app
+    
+    repair = request.method == 'POST'
+    
+    try:
+        if repair:
+            # 検査から修復までを書き込みキューで行い、他の書き込みの残高の更新と交錯しないようにする
+            divergences = transaction_writer.submit(_write_balance_repair)
+        else:
+            divergences = find_balance_divergences()
+        if repair and divergences:
+            current_app.logger.warning(
+                f"残高のずれを修復しました: {len(divergences)}口座, "
+                f"{sum(d['repaired_count'] for d in divergences)}件"
+            )
+        elif divergences:
+            current_app.logger.warning(f"残高のずれが見つかりました: {len(divergences)}口座")
+        
+        return jsonify({
+            'consistent': not divergences,
+            'repaired': repair and bool(divergences),
+            'accounts': [format_divergence(d) for d in divergences]
+        })
+        
+    except WriteQueueBusy as e:
+        current_app.logger.warning(f"残高の修復を受け付けられませんでした: {str(e)}")
+        return jsonify({'error': f'残高の修復を受け付けられませんでした: {str(e)}'}), 503
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"残高の整合性チェックに失敗しました: {str(e)}", exc_info=True)
+        return jsonify({'error': f'残高の整合性チェックに失敗しました: {str(e)}'}), 500
+
+def _write_balance_repair():
+    """残高のずれを検査し、見つかった口座を修復する（書き込みキューで実行）
+
+    同じバッチの先行する書き込みの残高の再計算を先に行い、再計算待ちの取引をずれとして数えないようにする。
+
+    Returns:
+        function: コミット後にrepair_balance_divergencesの結果を返す関数
+    """
+    apply_pending_rebalances()
+    divergences = find_balance_divergences()
+    if divergences:
+        divergences = repair_balance_divergences(divergences)
+    return lambda: divergences
+
+@api_bp.route("/api/memory_stats", methods=['GET', 'DELETE'])
+@login_required
+def memory_stats():
+    """リクエストごとのメモリ計測の統計API
+
+    GETはエンドポイントごとの直近の計測結果の統計（ピークの最大・平均・95パーセンタイル、
+    上限を超えた回数、ピークが最大だったリクエストの割り当て元の上位）を返し、
+    DELETEは計測結果を削除します。統計はこのリクエストを処理したワーカープロセスのものです。
+    """
+    from flask import current_app
+
+    if current_app.config['TENANT_MODE']:
+        # 統計には全ユーザーのリクエストが含まれるため、マルチテナントモードでは提供しない
+        return jsonify({'error': 'マルチテナントモードではメモリ計測の統計を取得できません'}), 403
+
+    if not memory_profiler.enabled:
+        return jsonify({'error': 'メモリ計測が有効ではありません（MEMORY_PROFILING_ENABLED=true で有効化）'}), 404
+
+    if request.method == 'DELETE':
+        memory_profiler.reset()
+        current_app.logger.info("メモリ計測の統計を削除しました")
+        return jsonify({'message': 'メモリ計測の統計を削除しました'})
+
+    return jsonify({
+        'pid': os.getpid(),
+        'sample_rate': current_app.config['MEMORY_PROFILING_SAMPLE_RATE'],
+        'budget_bytes': round(current_app.config['MEMORY_BUDGET_MB'] * 1024 * 1024),
+        'endpoints': memory_profiler.get_stats()
+    })
@@ -11,6 +11,7 @@ from flask import Blueprint, render_template, request, jsonify, session, redirec
 from auth import (
     verify_password, is_ip_locked, record_login_attempt, 
     login_required, get_client_ip, get_remaining_attempts,
+    rehash_password_if_needed, get_login_password_hash, PasswordVerificationBusy,
     LOCKOUT_DURATION
 )
 
@@ -46,16 +47,26 @@ def login():
             }), 429
         
         # 認証情報の検証
-        expected_username = os.getenv('LOGIN_USERNAME')
-        expected_password_hash = os.getenv('LOGIN_PASSWORD_HASH')
-        
-        if not expected_username or not expected_password_hash:
+        if not current_app.config['TENANT_MODE'] and (
+                not os.getenv('LOGIN_USERNAME') or not os.getenv('LOGIN_PASSWORD_HASH')):
             current_app.logger.error("認証設定が不完全です")
             return jsonify({'error': 'サーバー設定エラー'}), 500
+        expected_password_hash = get_login_password_hash(username)
+        
+        # ユーザー名とパスワードの検証（bcryptは専用プールで実行）
+        try:
+            password_ok = expected_password_hash is not None and verify_password(password, expected_password_hash)
+        except PasswordVerificationBusy:
+            current_app.logger.warning(f"パスワード検証プールが混雑しているためログインを拒否しました (IP: {ip_address})")
+            response = jsonify({'error': 'サーバーが混雑しています。しばらくしてから再試行してください。'})
+            response.headers['Retry-After'] = '1'
+            return response, 503
         
-        # ユーザー名とパスワードの検証
-        if username == expected_username and verify_password(password, expected_password_hash):
+        if password_ok:
             # ログイン成功
+            # ハッシュのコストが現在の設定と異なる場合は透過的に再ハッシュ
+            rehash_password_if_needed(password, expected_password_hash, username)
+            
             session['logged_in'] = True
             session['username'] = username
             session['login_time'] = datetime.now().isoformat()
@@ -0,0 +1,240 @@
+"""
+Server Money - 取引の書き込みの負荷テスト
+
+複数のクライアントが同じ口座へ並行して取引を追加し、書き込みキューの有効・無効それぞれで
+スループット（リクエスト/秒）と残高の整合性を確認するスクリプト。
+一時ディレクトリに作成したデータベースに対してwaitressを起動するため、既存の台帳には影響しません。
+
+使い方:
+    uv run scripts/stress_writes.py [--clients 16] [--requests 50] [--queue both|on|off]
+
+全ての書き込みが成功し、find_balance_divergences()が空で、口座の残高が追加した収支の合計と
+一致した場合に終了コード0で終了します。
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import secrets
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STRESS_ACCOUNT = '負荷テスト'
+STRESS_USERNAME = 'stress'
+STRESS_BCRYPT_ROUNDS = 4  # ログインは最初の1回だけのため最小のコストにする
+FIRST_DATE = date(2025, 1, 1)
+DATE_RANGE_DAYS = 365
+
+def build_transactions(client, requests_per_client):
+    """クライアントが追加する取引を作成する
+
+    日付をばらつかせ、ほとんどの書き込みが後続の取引の残高の再計算を伴うようにする。
+
+    Args:
+        client (int): クライアントの番号（乱数のシード）
+        requests_per_client (int): 追加する取引の数
+
+    Returns:
+        list: POST /api/transactionsのリクエストボディのリスト
+    """
+    rng = random.Random(client)
+    transactions = []
+    for index in range(requests_per_client):
+        day = FIRST_DATE + timedelta(days=rng.randrange(DATE_RANGE_DAYS))
+        transactions.append({
+            'account': STRESS_ACCOUNT,
+            'date': day.isoformat(),
+            'time': f'{rng.randrange(24):02d}:{rng.randrange(60):02d}',
+            'item': f'クライアント{client}',
+            'type': 'expense' if index % 3 == 0 else 'income',
+            'amount': 1 + index,
+        })
+    return transactions
+
+def login(port, password):
+    """ログインしてセッションのCookieを取得する"""
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    connection.request(
+        'POST', '/api/login',
+        json.dumps({'username': STRESS_USERNAME, 'password': password}),
+        {'Content-Type': 'application/json'}
+    )
+    response = connection.getresponse()
+    response.read()
+    if response.status != 200:
+        raise RuntimeError(f'ログインに失敗しました: {response.status}')
+    return response.getheader('Set-Cookie').split(';')[0]
+
+def run_clients(port, cookie, workloads):
+    """クライアントごとに1つのスレッドで取引を順番に追加する
+
+    Returns:
+        tuple: (ステータスコードごとの件数, 追加に成功した取引の収支の合計, 経過秒数)
+    """
+    headers = {'Content-Type': 'application/json', 'Cookie': cookie}
+    statuses = {}
+    committed = [0]
+    lock = threading.Lock()
+
+    def client(transactions):
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+        for body in transactions:
+            connection.request('POST', '/api/transactions', json.dumps(body), headers)
+            response = connection.getresponse()
+            response.read()
+            with lock:
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+                if response.status == 201:
+                    committed[0] += body['amount'] if body['type'] == 'income' else -body['amount']
+        connection.close()
+
+    threads = [threading.Thread(target=client, args=(transactions,)) for transactions in workloads]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return statuses, committed[0], time.perf_counter() - started
+
+def run_stress(queue_enabled, clients, requests_per_client):
+    """一時ディレクトリのデータベースでサーバーを起動し、負荷をかけて結果を返す
+
+    設定はモジュールの読み込み時に環境変数から決まり、書き込みスレッドなどの状態はプロセスごとのため、
+    設定ごとに別のプロセスで呼び出すこと。
+
+    Args:
+        queue_enabled (bool): 書き込みキューを有効にする場合True
+        clients (int): 並行するクライアントの数
+        requests_per_client (int): クライアントごとの取引の数
+
+    Returns:
+        dict: 計測結果
+    """
+    workdir = tempfile.mkdtemp(prefix='server-money-stress-')
+    try:
+        sys.path.insert(0, ROOT)
+        from auth_setup import hash_password
+
+        password = secrets.token_urlsafe(16)
+        settings = {
+            'LOGIN_USERNAME': STRESS_USERNAME,
+            'LOGIN_PASSWORD_HASH': hash_password(password, STRESS_BCRYPT_ROUNDS),
+            'SECRET_KEY': secrets.token_hex(32),
+            'BCRYPT_ROUNDS': str(STRESS_BCRYPT_ROUNDS),
+            'TENANT_MODE': 'false',
+            'WRITE_QUEUE_ENABLED': 'true' if queue_enabled else 'false',
+            'ASSET_PIPELINE_ENABLED': 'false',
+            'MEMORY_PROFILING_ENABLED': 'false',
+            'LOG_LEVEL': 'WARNING',
+        }
+        # 環境変数を.envより優先させ、認証設定の確認に必要な.envとログは作業ディレクトリに作る
+        os.environ.update(settings)
+        os.chdir(workdir)
+        with open('.env', 'w') as f:
+            f.writelines(f'{key}={value}\n' for key, value in settings.items())
+
+        from waitress import create_server
+        from app import create_app
+        from utils import init_db
+        from server import get_serve_options
+        from audit import find_balance_divergences
+        from accounts import get_account_overview
+
+        app = create_app(instance_path=os.path.join(workdir, 'instance'))
+        init_db(app)
+        server = create_server(app, host='127.0.0.1', port=0, **get_serve_options(app))
+        threading.Thread(target=server.run, daemon=True).start()
+
+        workloads = [build_transactions(client, requests_per_client) for client in range(clients)]
+        statuses, committed, elapsed = run_clients(server.effective_port, login(server.effective_port, password), workloads)
+        server.close()
+
+        with app.app_context():
+            divergences = find_balance_divergences()
+            balances = {account['name']: account['balance'] for account in get_account_overview()}
+
+        requests = clients * requests_per_client
+        return {
+            'queue_enabled': queue_enabled,
+            'requests': requests,
+            'elapsed': elapsed,
+            'requests_per_second': requests / elapsed,
+            'statuses': {str(status): count for status, count in sorted(statuses.items())},
+            'divergent_accounts': [divergence['account'] for divergence in divergences],
+            'balance': balances.get(STRESS_ACCOUNT),
+            'expected_balance': committed,
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def check_result(result):
+    """計測結果の問題点をリストにする（問題がない場合は空）
+
+    書き込みキューを使わない場合、書き込みロックの待ち時間（SQLiteのbusy_timeout）の上限を
+    超えた書き込みは失敗として数えず、成功した書き込みの残高だけを確認する。
+
+    Returns:
+        tuple: (終了コードを1にする問題のリスト, 報告のみの問題のリスト)
+    """
+    problems = []
+    warnings = []
+    failed = result['requests'] - result['statuses'].get('201', 0)
+    if failed:
+        (problems if result['queue_enabled'] else warnings).append(f"失敗した書き込み {failed}件 {result['statuses']}")
+    if result['divergent_accounts']:
+        problems.append(f"残高のずれ {', '.join(result['divergent_accounts'])}")
+    if result['balance'] != result['expected_balance']:
+        problems.append(f"口座残高 {result['balance']}（期待値 {result['expected_balance']}）")
+    return problems, warnings
+
+def main():
+    parser = argparse.ArgumentParser(description='取引の書き込みの負荷テスト')
+    parser.add_argument('--clients', type=int, default=16, help='並行するクライアントの数')
+    parser.add_argument('--requests', type=int, default=50, help='クライアントごとの取引の数')
+    parser.add_argument('--queue', choices=['both', 'on', 'off'], default='both', help='書き込みキューの設定')
+    parser.add_argument('--run', choices=['on', 'off'], help=argparse.SUPPRESS)  # 設定ごとの子プロセス用
+    args = parser.parse_args()
+
+    if args.run:
+        result = run_stress(args.run == 'on', args.clients, args.requests)
+        print(json.dumps(result))
+        return 0
+
+    modes = ['on', 'off'] if args.queue == 'both' else [args.queue]
+    results = {}
+    exit_code = 0
+    for mode in modes:
+        process = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--run', mode,
+             '--clients', str(args.clients), '--requests', str(args.requests)],
+            capture_output=True, text=True
+        )
+        if process.returncode != 0:
+            print(f"書き込みキュー {mode}: 実行に失敗しました\n{process.stderr}", file=sys.stderr)
+            exit_code = 1
+            continue
+        result = results[mode] = json.loads(process.stdout.strip().splitlines()[-1])
+        problems, warnings = check_result(result)
+        print(
+            f"書き込みキュー {mode:>3}: {result['requests']}件 / {result['elapsed']:.2f}秒 = "
+            f"{result['requests_per_second']:.0f} req/s - {'; '.join(problems + warnings) or '残高OK'}"
+        )
+        if problems:
+            exit_code = 1
+
+    if 'on' in results and 'off' in results:
+        ratio = results['on']['requests_per_second'] / results['off']['requests_per_second']
+        print(f"書き込みキュー有効時のスループット: 無効時の{ratio:.2f}倍")
+    return exit_code
+
+if __name__ == '__main__':
+    sys.exit(main())
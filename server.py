@@ -0,0 +1,221 @@
+"""
+Server Money - サーバーランタイム
+
+このファイルは、waitressによるWSGIサーバーの起動と、
+SO_REUSEPORTを利用したマルチプロセスモード（ワーカー監視付き）を提供します。
+"""
+
+import os
+import time
+import signal
+import socket
+import threading
+import multiprocessing
+from waitress import serve
+
+# ワーカーが異常終了した際の再起動待ち時間（秒）
+WORKER_RESTART_DELAY = 1
+WORKER_RESTART_DELAY_MAX = 30
+# この秒数以上動作したワーカーは正常起動とみなし、再起動待ち時間をリセット
+WORKER_STABLE_SECONDS = 60
+
+def get_serve_options(app):
+    """設定からwaitressのチューニングオプションを組み立てる
+
+    Args:
+        app: Flaskアプリケーションインスタンス
+
+    Returns:
+        dict: waitress.serveに渡すキーワード引数
+    """
+    return {
+        'threads': app.config['SERVER_THREADS'],
+        'connection_limit': app.config['SERVER_CONNECTION_LIMIT'],
+        'backlog': app.config['SERVER_BACKLOG'],
+        'channel_timeout': app.config['SERVER_CHANNEL_TIMEOUT'],
+    }
+
+def supports_multiprocess():
+    """マルチプロセスモードが利用可能か判定
+
+    Returns:
+        bool: SO_REUSEPORTとforkが利用可能な場合True
+    """
+    return hasattr(socket, 'SO_REUSEPORT') and 'fork' in multiprocessing.get_all_start_methods()
+
+def create_reuseport_socket(host, port):
+    """SO_REUSEPORTを設定した待ち受けソケットを作成
+
+    各ワーカーが同じポートに個別のソケットをbindし、
+    カーネルに接続の振り分けを任せます。listen()はwaitress側で実行されます。
+
+    Args:
+        host (str): 待ち受けIPアドレス
+        port (int): 待ち受けポート
+
+    Returns:
+        socket.socket: bind済みのソケット
+    """
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    return sock
+
+def start_prewarm(app):
+    """最初のリクエストを待たずに、テンプレートのコンパイルをバックグラウンドで済ませる
+
+    fork後のプロセスで呼び出すこと（スレッドはforkで引き継がれないため）。
+
+    Args:
+        app: Flaskアプリケーションインスタンス
+
+    Returns:
+        threading.Thread: 事前準備を行うスレッド
+    """
+    def prewarm():
+        started = time.perf_counter()
+        try:
+            for name in app.jinja_env.list_templates():
+                app.jinja_env.get_template(name)
+        except Exception:
+            app.logger.warning("テンプレートの事前コンパイルに失敗しました", exc_info=True)
+            return
+        app.logger.debug(f"テンプレートを事前コンパイルしました ({(time.perf_counter() - started) * 1000:.1f}ms)")
+
+    thread = threading.Thread(target=prewarm, name='server-money-prewarm', daemon=True)
+    thread.start()
+    return thread
+
+def run_server(app):
+    """設定に応じてシングルプロセスまたはマルチプロセスでサーバーを起動
+
+    Args:
+        app: Flaskアプリケーションインスタンス
+    """
+    workers = max(1, app.config['SERVER_WORKERS'])
+    unix_socket = app.config['SERVER_UNIX_SOCKET']
+
+    if workers > 1 and unix_socket:
+        app.logger.warning("Unixソケット使用時はマルチプロセスモードに対応していないため、シングルプロセスで起動します")
+        workers = 1
+    elif workers > 1 and not supports_multiprocess():
+        app.logger.warning("この環境はSO_REUSEPORTまたはforkに対応していないため、シングルプロセスで起動します")
+        workers = 1
+
+    if workers == 1:
+        _serve_single(app)
+    else:
+        _supervise_workers(app, workers)
+
+def _serve_single(app):
+    """シングルプロセスでwaitressを起動する内部関数
+
+    Args:
+        app: Flaskアプリケーションインスタンス
+    """
+    options = get_serve_options(app)
+    unix_socket = app.config['SERVER_UNIX_SOCKET']
+    start_prewarm(app)
+
+    if unix_socket:
+        app.logger.info(f"サーバーを起動します (unix_socket={unix_socket}, threads={options['threads']})")
+        serve(app, unix_socket=unix_socket,
+              unix_socket_perms=app.config['SERVER_UNIX_SOCKET_PERMS'], **options)
+    else:
+        host_ip = app.config['HOST_IP']
+        port = app.config['SERVER_PORT']
+        app.logger.info(f"サーバーを起動します (host={host_ip}, port={port}, threads={options['threads']})")
+        serve(app, host=host_ip, port=port, **options)
+
+def _worker_main(app, worker_index):
+    """ワーカープロセスのエントリポイント
+
+    Args:
+        app: Flaskアプリケーションインスタンス（fork元から継承）
+        worker_index (int): ワーカー番号
+    """
+    from models import db
+
+    # 親プロセスから継承したDB接続は使い回さない
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+    # 終了シグナルは親プロセスが管理するため、デフォルト動作に戻す
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    sock = create_reuseport_socket(app.config['HOST_IP'], app.config['SERVER_PORT'])
+    start_prewarm(app)
+    app.logger.info(f"ワーカー{worker_index}を起動しました (pid={os.getpid()})")
+    serve(app, sockets=[sock], **get_serve_options(app))
+
+def _supervise_workers(app, workers):
+    """ワーカープロセス群を起動し、異常終了したワーカーを再起動する
+
+    Args:
+        app: Flaskアプリケーションインスタンス
+        workers (int): ワーカー数
+    """
+    ctx = multiprocessing.get_context('fork')
+    processes = {}
+    started_at = {}
+    restart_delay = {}
+    stopping = False
+
+    def spawn(index):
+        process = ctx.Process(target=_worker_main, args=(app, index), name=f'server-money-worker-{index}')
+        process.daemon = False
+        process.start()
+        processes[index] = process
+        started_at[index] = time.monotonic()
+
+    def handle_stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    previous_handlers = {
+        signal.SIGTERM: signal.signal(signal.SIGTERM, handle_stop),
+        signal.SIGINT: signal.signal(signal.SIGINT, handle_stop),
+    }
+
+    app.logger.info(
+        f"マルチプロセスモードでサーバーを起動します (host={app.config['HOST_IP']}, "
+        f"port={app.config['SERVER_PORT']}, workers={workers}, threads={app.config['SERVER_THREADS']})"
+    )
+
+    try:
+        for index in range(workers):
+            spawn(index)
+            restart_delay[index] = WORKER_RESTART_DELAY
+
+        while not stopping:
+            time.sleep(0.5)
+            for index, process in list(processes.items()):
+                if process.is_alive() or stopping:
+                    continue
+
+                uptime = time.monotonic() - started_at[index]
+                if uptime >= WORKER_STABLE_SECONDS:
+                    restart_delay[index] = WORKER_RESTART_DELAY
+
+                app.logger.error(
+                    f"ワーカー{index}が終了しました (pid={process.pid}, exitcode={process.exitcode})。"
+                    f"{restart_delay[index]}秒後に再起動します"
+                )
+                time.sleep(restart_delay[index])
+                restart_delay[index] = min(restart_delay[index] * 2, WORKER_RESTART_DELAY_MAX)
+                if not stopping:
+                    spawn(index)
+    finally:
+        app.logger.info("ワーカープロセスを停止しています...")
+        for process in processes.values():
+            if process.is_alive():
+                process.terminate()
+        for process in processes.values():
+            process.join(timeout=10)
+            if process.is_alive():
+                process.kill()
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
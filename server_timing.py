@@ -0,0 +1,143 @@
+"""
+Server Money - Server-Timingヘッダー
+
+このファイルは、Blueprintのルートへのリクエストごとに処理時間をフェーズに分けて計測し、
+レスポンスの`Server-Timing`ヘッダーとデバッグログに出力する機能を提供します。
+ブラウザの開発者ツール（ネットワーク → タイミング）で内訳をそのまま確認できます。
+
+フェーズ:
+    auth       ログイン状態の確認（マルチテナントモードではユーザーのシャードの準備を含む）
+    db         SQLの実行（SQLAlchemyのカーソル実行イベントで計測、書き込みキューの待ち時間と適用を含む）
+    serialize  JSONへの変換
+    compute    上記以外のPythonの処理（total - auth - db - serialize）
+    total      最初のbefore_requestからレスポンスを返すまで
+
+SQLiteでは、SELECTの結果の2行目以降の読み出しはカーソル実行の後に行われるためcomputeに含まれます。
+ストリーミングするレスポンスの本体の生成はヘッダーの送信後に行われるため含まれません。
+"""
+
+import logging
+import time
+from contextlib import contextmanager
+from flask import g, has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+class RequestTiming:
+    """1リクエストのフェーズごとの所要時間"""
+
+    __slots__ = ('started_at', 'phases', 'query_count', '_query_started', '_depth')
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.phases = {'auth': 0.0, 'db': 0.0, 'serialize': 0.0}  # フェーズ名 -> 秒
+        self.query_count = 0
+        self._query_started = None
+        self._depth = 0  # timing_phaseの入れ子の深さ（フェーズ内のSQLは二重に数えない）
+
+    def report(self):
+        """計測結果を (フェーズ名, ミリ秒) のリストにする（computeとtotalを含む）"""
+        total = time.perf_counter() - self.started_at
+        measured = sum(self.phases.values())
+        phases = [(name, seconds * 1000) for name, seconds in self.phases.items()]
+        phases.insert(2, ('compute', max(0.0, total - measured) * 1000))
+        phases.append(('total', total * 1000))
+        return phases
+
+def current_timing():
+    """処理中のリクエストの計測を取得（リクエスト外・計測していない場合はNone）"""
+    if not has_request_context():
+        return None
+    return g.get('server_timing')
+
+@contextmanager
+def timing_phase(name):
+    """with文で囲んだ処理の所要時間を、処理中のリクエストのフェーズに加算する
+
+    Args:
+        name (str): フェーズ名（auth / db / serialize）
+    """
+    timing = current_timing()
+    if timing is None:
+        yield
+        return
+    started = time.perf_counter()
+    timing._depth += 1
+    try:
+        yield
+    finally:
+        timing._depth -= 1
+        timing.phases[name] += time.perf_counter() - started
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timing = current_timing()
+    if timing is not None and not timing._depth:
+        timing._query_started = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timing = current_timing()
+    if timing is not None and timing._query_started is not None:
+        timing.phases['db'] += time.perf_counter() - timing._query_started
+        timing.query_count += 1
+        timing._query_started = None
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """JSONへの変換時間をserializeフェーズとして計測するJSONプロバイダー"""
+
+    def dumps(self, obj, **kwargs):
+        with timing_phase('serialize'):
+            return super().dumps(obj, **kwargs)
+
+def format_server_timing(phases, query_count):
+    """計測結果をServer-Timingヘッダーの値にする
+
+    Args:
+        phases (list): RequestTiming.reportの結果
+        query_count (int): 実行したSQLの数
+
+    Returns:
+        str: 'auth;dur=0.1, db;dur=2.3;desc="4 queries", ...' 形式の文字列
+    """
+    metrics = []
+    for name, ms in phases:
+        metric = f'{name};dur={ms:.1f}'
+        if name == 'db':
+            metric += f';desc="{query_count} queries"'
+        metrics.append(metric)
+    return ', '.join(metrics)
+
+def init_server_timing(app):
+    """Server-Timingヘッダーの計測を組み込む（SERVER_TIMING_ENABLEDが無効な場合は何もしない）
+
+    最初に実行されるbefore_requestで計測を始めるため、他のbefore_requestより先に呼び出すこと。
+
+    Args:
+        app: Flaskアプリケーションインスタンス
+    """
+    if not app.config['SERVER_TIMING_ENABLED']:
+        return
+
+    app.json = TimedJSONProvider(app)
+
+    @app.before_request
+    def start_server_timing():
+        if request.blueprint is not None:
+            g.server_timing = RequestTiming()
+
+    @app.after_request
+    def add_server_timing(response):
+        timing = g.pop('server_timing', None)
+        if timing is None:
+            return response
+        phases = timing.report()
+        response.headers['Server-Timing'] = format_server_timing(phases, timing.query_count)
+        if app.logger.isEnabledFor(logging.DEBUG):
+            app.logger.debug(
+                f"処理時間: {request.method} {request.path} {response.status_code} - "
+                f"{', '.join(f'{name} {ms:.1f}ms' for name, ms in phases)} "
+                f"(SQL {timing.query_count}件)"
+            )
+        return response
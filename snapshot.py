@@ -0,0 +1,282 @@
+"""
+Server Money - 列指向の台帳スナップショット
+
+このファイルは、分析用に取引テーブルを口座ごとの列（array）として
+メモリ上に保持するスナップショットを提供します。
+ORMオブジェクトの代わりに、項目は辞書テーブル（item_names）のid、日付はエポック日
+（1970-01-01からの日数）、金額と残高は64bit整数の配列、種別はビットマスクのbytearrayで保持します。
+
+スナップショットは最初の使用時に構築され、台帳のコミット通知で変更された口座の列だけを
+読み直します。他のプロセスによる書き込みでデータバージョンが飛んだ場合は全体を再構築します。
+"""
+
+import threading
+from array import array
+from datetime import date, timedelta
+from itertools import compress
+from sqlalchemy import text
+from models import db
+from ledger import register_commit_listener, get_data_version
+from archive import ledger_tables
+from tenants import TenantScoped
+
+EPOCH = date(1970, 1, 1)
+_EPOCH_ORDINAL = EPOCH.toordinal()
+
+# 種別のビットマスク
+TYPE_INCOME = 1
+TYPE_EXPENSE = 2
+TYPE_CODES = {'income': TYPE_INCOME, 'expense': TYPE_EXPENSE}
+
+def to_epoch_day(value):
+    """日付（datetime/date/ISO形式文字列）をエポック日に変換
+
+    Args:
+        value: 日付
+
+    Returns:
+        int: 1970-01-01からの日数
+    """
+    if isinstance(value, str):
+        value = date.fromisoformat(value[:10])
+    return value.toordinal() - _EPOCH_ORDINAL
+
+def from_epoch_day(day):
+    """エポック日を'YYYY-MM-DD'形式の文字列に変換
+
+    Args:
+        day (int): 1970-01-01からの日数
+
+    Returns:
+        str: 日付文字列
+    """
+    return (EPOCH + timedelta(days=day)).isoformat()
+
+class AccountColumns:
+    """1口座分の取引を(date, id)順に保持する列の集合"""
+
+    __slots__ = ('ids', 'days', 'items', 'amounts', 'balances', 'types', 'first_key')
+
+    def __init__(self):
+        self.first_key = None  # 最初の取引の (日時, id)。口座の並び順に使用
+        self.ids = array('q')
+        self.days = array('l')
+        self.items = array('l')
+        self.amounts = array('q')
+        self.balances = array('q')
+        self.types = bytearray()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def day_end_balances(self):
+        """日ごとの最終残高を取得
+
+        Returns:
+            dict: エポック日 -> その日の最後の取引後の残高
+        """
+        # (date, id)順なので、同じ日の後の行で上書きすれば日末残高になる
+        return dict(zip(self.days, self.balances))
+
+    def day_range_mask(self, start_day=None, end_day=None):
+        """指定期間（両端を含む）に含まれる行のマスクを取得
+
+        Args:
+            start_day (int): 開始エポック日（Noneの場合は制限なし）
+            end_day (int): 終了エポック日（Noneの場合は制限なし）
+
+        Returns:
+            list: 行ごとの真偽値
+        """
+        if start_day is None and end_day is None:
+            return [True] * len(self.days)
+        lo = start_day if start_day is not None else -(1 << 62)
+        hi = end_day if end_day is not None else (1 << 62)
+        return [lo <= day <= hi for day in self.days]
+
+class LedgerSnapshot:
+    """口座ごとの列で構成された台帳のスナップショット"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._partitions = None   # 口座名 -> AccountColumns
+        self._item_names = {}     # 項目名辞書のid -> 項目名
+        self._seen_version = None # スナップショットが反映している（または通知で受け取った）データバージョン
+        self._dirty = set()       # 読み直しが必要な口座
+        self._stale = False       # 全体の再構築が必要な場合True
+
+    def _load(self, accounts=None):
+        """取引テーブル（アーカイブ済みの取引を含む）から列を読み込む（ロック取得済みで呼び出すこと）
+
+        Args:
+            accounts (iterable): 読み込む口座（Noneの場合は全口座）
+
+        Returns:
+            dict: 口座名 -> AccountColumns
+        """
+        select_sql = ('SELECT t.account_id, a.name, t.id, t.date, t.item_id, t.type, t.amount, t.balance '
+                      'FROM {table} AS t JOIN account_names AS a ON a.id = t.account_id')
+        params = {}
+        if accounts is not None:
+            accounts = list(accounts)
+            if not accounts:
+                return {}
+            placeholders = ', '.join(f':a{i}' for i in range(len(accounts)))
+            select_sql += f' WHERE a.name IN ({placeholders})'
+            params = {f'a{i}': account for i, account in enumerate(accounts)}
+        # アーカイブがある場合は、テーブルごとにインデックス順で読んだ結果を(account_id, date, id)順に併合する
+        sql = ' UNION ALL '.join(select_sql.format(table=table) for table in ledger_tables())
+        sql += ' ORDER BY 1, 4, 3'
+
+        partitions = {}
+        day_cache = {}
+        current_account = None
+        columns = None
+        for _account_id, account, tx_id, tx_date, item_id, tx_type, amount, balance in db.session.execute(text(sql), params):
+            if account != current_account:
+                current_account = account
+                columns = partitions.setdefault(account, AccountColumns())
+                columns.first_key = (str(tx_date), tx_id)
+            day_key = str(tx_date)[:10]
+            day = day_cache.get(day_key)
+            if day is None:
+                day = day_cache[day_key] = to_epoch_day(day_key)
+            columns.ids.append(tx_id)
+            columns.days.append(day)
+            columns.items.append(item_id)
+            columns.amounts.append(amount)
+            columns.balances.append(balance)
+            columns.types.append(TYPE_CODES.get(tx_type, 0))
+        return partitions
+
+    def _load_item_names(self):
+        """項目名辞書を読み込む（ロック取得済みで呼び出すこと）"""
+        self._item_names = dict(db.session.execute(text("SELECT id, name FROM item_names")).all())
+
+    def _refresh(self):
+        """必要に応じてスナップショットを更新する（ロック取得済みで呼び出すこと）"""
+        current_version = get_data_version()
+        if (self._partitions is None or self._stale
+                or current_version != self._seen_version):
+            # 未構築、または他プロセスの書き込みを取りこぼしている場合は全体を再構築
+            self._partitions = self._load()
+            self._dirty.clear()
+            self._stale = False
+            self._load_item_names()
+        elif self._dirty:
+            reloaded = self._load(self._dirty)
+            for account in self._dirty:
+                if account in reloaded:
+                    self._partitions[account] = reloaded[account]
+                else:
+                    self._partitions.pop(account, None)
+            self._dirty.clear()
+            self._load_item_names()
+        self._seen_version = current_version
+
+    def apply_change(self, change):
+        """コミットされた台帳の変更を記録する（列の読み直しは次回使用時）
+
+        Args:
+            change (dict): ledger.register_commit_listenerから渡される変更内容
+        """
+        with self._lock:
+            if self._partitions is None or change['version'] <= self._seen_version:
+                return
+            if change['version'] != self._seen_version + 1:
+                self._stale = True
+            self._dirty.update(change['accounts'])
+            self._seen_version = change['version']
+
+    def balance_history(self, accounts=None):
+        """口座ごとの日末残高を、全口座の取引日に合わせて前方補完した系列を取得
+
+        Args:
+            accounts (list): 対象口座（Noneの場合は全口座）
+
+        Returns:
+            dict: /api/balance_historyと同じ形式（accounts, dates, balances）
+        """
+        with self._lock:
+            self._refresh()
+            names = self._partitions if accounts is None else [
+                name for name in dict.fromkeys(accounts) if name in self._partitions
+            ]
+            # 口座は最初の取引が古い順（取引を日付順に走査した場合と同じ順序）に並べる
+            names = sorted(names, key=lambda name: self._partitions[name].first_key)
+            day_end = {name: self._partitions[name].day_end_balances() for name in names}
+
+        all_days = sorted(set().union(*day_end.values())) if day_end else []
+        balances = {}
+        for name in names:
+            account_days = day_end[name]
+            series = []
+            last_balance = 0
+            for day in all_days:
+                last_balance = account_days.get(day, last_balance)
+                series.append(last_balance)
+            balances[name] = series
+
+        return {
+            'accounts': names,
+            'dates': [from_epoch_day(day) for day in all_days],
+            'balances': balances
+        }
+
+    def summary(self, accounts, start_day=None, end_day=None):
+        """期間内の種別・項目ごとの合計金額と件数を取得
+
+        Args:
+            accounts (list): 対象口座
+            start_day (int): 開始エポック日（両端を含む、Noneの場合は制限なし）
+            end_day (int): 終了エポック日（Noneの場合は制限なし）
+
+        Returns:
+            list: (type, item, total, count) のタプルのリスト（rollup.build_summary_resultに渡せる形式）
+        """
+        totals = {}
+        with self._lock:
+            self._refresh()
+            for name in dict.fromkeys(accounts):
+                columns = self._partitions.get(name)
+                if not columns:
+                    continue
+                mask = columns.day_range_mask(start_day, end_day)
+                for type_code, item_code, amount in compress(
+                        zip(columns.types, columns.items, columns.amounts), mask):
+                    key = (type_code, item_code)
+                    entry = totals.get(key)
+                    if entry is None:
+                        totals[key] = [amount, 1]
+                    else:
+                        entry[0] += amount
+                        entry[1] += 1
+            item_names = self._item_names
+
+        type_names = {TYPE_INCOME: 'income', TYPE_EXPENSE: 'expense'}
+        return [
+            (type_names.get(type_code), item_names[item_code], total, count)
+            for (type_code, item_code), (total, count) in totals.items()
+        ]
+
+    def days(self, accounts):
+        """データが存在する日の一覧を取得
+
+        Args:
+            accounts (list): 対象口座
+
+        Returns:
+            list: 昇順の'YYYY-MM-DD'形式の日付
+        """
+        with self._lock:
+            self._refresh()
+            days = set()
+            for name in dict.fromkeys(accounts):
+                columns = self._partitions.get(name)
+                if columns:
+                    days.update(columns.days)
+        return [from_epoch_day(day) for day in sorted(days)]
+
+# マルチテナントモードではシャードごとに別のスナップショットを使用する
+ledger_snapshot = TenantScoped(LedgerSnapshot)
+register_commit_listener(lambda change: ledger_snapshot.apply_change(change))
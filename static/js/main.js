@@ -2,13 +2,127 @@
 
 const { createApp } = Vue;
 
+// 取引データのローカルキャッシュ（メモリ + IndexedDB）
+// サーバーの変更番号（version）と取引を保持し、/api/changes の差分だけを反映する
+// ledgerは台帳のID（マルチテナントモードのユーザー）で、別の台帳の変更番号で差分を取得しないために使用する
+const ledgerCache = {
+    dbName: 'server-money-ledger',
+    db: null,
+    byId: new Map(),
+    version: null,
+    ledger: null,
+
+    // IndexedDBを開く（利用できない環境ではnullを返し、メモリのみで動作する）
+    async open() {
+        if (this.db !== null || !window.indexedDB) {
+            return this.db;
+        }
+        try {
+            this.db = await new Promise((resolve, reject) => {
+                const request = indexedDB.open(this.dbName, 1);
+                request.onupgradeneeded = () => {
+                    request.result.createObjectStore('transactions', { keyPath: 'id' });
+                    request.result.createObjectStore('meta');
+                };
+                request.onsuccess = () => resolve(request.result);
+                request.onerror = () => reject(request.error);
+            });
+        } catch (error) {
+            this.db = null;
+        }
+        return this.db;
+    },
+
+    // IndexedDBの書き込みトランザクションを実行する
+    async write(callback) {
+        const db = await this.open();
+        if (!db) {
+            return;
+        }
+        await new Promise((resolve, reject) => {
+            const tx = db.transaction(['transactions', 'meta'], 'readwrite');
+            callback(tx.objectStore('transactions'), tx.objectStore('meta'));
+            tx.oncomplete = () => resolve();
+            tx.onerror = () => reject(tx.error);
+            tx.onabort = () => reject(tx.error);
+        });
+    },
+
+    // IndexedDBに保存された取引と変更番号をメモリに読み込む
+    async restore() {
+        const db = await this.open();
+        if (!db) {
+            return false;
+        }
+        const [version, ledger, transactions] = await new Promise((resolve, reject) => {
+            const tx = db.transaction(['transactions', 'meta'], 'readonly');
+            const versionRequest = tx.objectStore('meta').get('version');
+            const ledgerRequest = tx.objectStore('meta').get('ledger');
+            const transactionsRequest = tx.objectStore('transactions').getAll();
+            tx.oncomplete = () => resolve([versionRequest.result, ledgerRequest.result, transactionsRequest.result]);
+            tx.onerror = () => reject(tx.error);
+        });
+        if (typeof version !== 'number' || typeof ledger !== 'string') {
+            return false;
+        }
+        this.byId = new Map(transactions.map(tx => [tx.id, tx]));
+        this.version = version;
+        this.ledger = ledger;
+        return true;
+    },
+
+    // 全件を置き換える（初回や差分を返せない場合）
+    async replaceAll(transactions, version, ledger) {
+        this.byId = new Map(transactions.map(tx => [tx.id, tx]));
+        this.version = version;
+        this.ledger = ledger;
+        await this.write((store, meta) => {
+            store.clear();
+            transactions.forEach(tx => store.put(tx));
+            meta.put(version, 'version');
+            meta.put(ledger, 'ledger');
+        });
+    },
+
+    // /api/changes の差分を反映する
+    async applyChanges(changes) {
+        const upserts = [...changes.inserted, ...changes.updated];
+        upserts.forEach(tx => this.byId.set(tx.id, tx));
+        changes.deleted.forEach(id => this.byId.delete(id));
+        this.version = changes.version;
+        await this.write((store, meta) => {
+            upserts.forEach(tx => store.put(tx));
+            changes.deleted.forEach(id => store.delete(id));
+            meta.put(changes.version, 'version');
+        });
+    },
+
+    // ログアウト時などにキャッシュを破棄する
+    async clear() {
+        this.byId = new Map();
+        this.version = null;
+        this.ledger = null;
+        await this.write((store, meta) => {
+            store.clear();
+            meta.clear();
+        });
+    },
+
+    // ID順の取引一覧（/api/transactions と同じ並び）
+    list() {
+        return Array.from(this.byId.values()).sort((a, b) => a.id - b.id);
+    }
+};
+
 createApp({
     data() {
         return {
             transactions: [],
             fundItemNames: [],
-            itemNames: // 項目名リスト
+            itemNames: // 項目名リスト（入力候補）
             [],
+            itemSuggestionLimit: 20, // 項目名の入力候補の最大件数
+            itemSuggestTimeout: null, // 項目名候補取得のデバウンス用タイマー
             selectedFundItems: [], // 統一された資金項目選択（全画面で共有）
             dateSortOrder: 'desc',
             showAccountDropdown: false,
@@ -62,7 +176,11 @@ createApp({
             selectedCreditCardItems: [],
             showCreditCardDropdown: false,
             creditCardSettingsMessage: null,
-            showCreditCardModal: false
+            showCreditCardModal: false,
+            // 変更通知（Server-Sent Events）関連
+            ledgerEventSource: null,
+            ledgerRefreshTimeout: null, // 連続した変更通知をまとめるためのタイマー
+            pendingLedgerAccounts: [] // まとめて反映する変更の口座（nullは口座不明）
         }
     },
     computed: {
@@ -393,38 +511,23 @@ createApp({
         isFundItemSelected(fundItem) {
             return this.selectedFundItems.includes(fundItem);
         },
-        // 全取引データから利用可能な期間リストを生成
+        // 選択中の資金項目で利用可能な期間リストをサーバーから取得
         async generateAvailablePeriods(displayUnit) {
+            if (this.selectedFundItems.length === 0) {
+                return [];
+            }
             try {
-                const response = await fetch('/api/transactions');
-                const allTransactions = await response.json();
-                
-                // 資金項目でフィルタリング
-                let filteredTxs;
-                if (this.selectedFundItems.length === 0) {
-                    filteredTxs = [];
-                } else if (this.selectedFundItems.length < this.actualFundItems.length) {
-                    filteredTxs = allTransactions.filter(t => this.selectedFundItems.includes(t.fundItem || t.account));
-                } else {
-                    filteredTxs = allTransactions;
+                const params = new URLSearchParams();
+                this.selectedFundItems.forEach(item => params.append('fund_items', item));
+                params.append('unit', displayUnit);
+                const response = await fetch(`/api/periods?${params}`);
+                if (!response.ok) {
+                    throw new Error('利用可能期間の取得に失敗しました');
                 }
-                
-                const periodsSet = new Set();
-                filteredTxs.forEach(tx => {
-                    const date = new Date(tx.date);
-                    let periodKey;
-                    if (displayUnit === 'year') {
-                        periodKey = `${date.getFullYear()}`;
-                    } else if (displayUnit === 'month') {
-                        periodKey = `${date.getFullYear()}-${String(date.getMonth() + 1).padStart(2, '0')}`;
-                    } else if (displayUnit === 'day') {
-                        periodKey = `${date.getFullYear()}-${String(date.getMonth() + 1).padStart(2, '0')}-${String(date.getDate()).padStart(2, '0')}`;
-                    }
-                    if (periodKey) periodsSet.add(periodKey);
-                });
-                
-                return Array.from(periodsSet).sort();
+                const result = await response.json();
+                return result.periods;
             } catch (error) {
+                this.logMessage('error', '利用可能期間取得エラー: ' + error.toString(), 'periods');
                 return [];
             }
         },
@@ -624,29 +727,121 @@ createApp({
                 this.showCreditCardDropdown = false;
             }
         },
-        async loadTransactions() {
+        async loadTransactions(silent = false) {
             try {
-                this.loading = true;
-                // 検索パラメータを構築
-                const params = new URLSearchParams();
-                // 検索とフィルタリングはフロントエンドで行うため、全データを取得
-                // 複数選択対応のため、常に全データを取得してフロントエンドでフィルタ
-                const url = `/api/transactions${params.toString() ? '?' + params.toString() : ''}`;
-                const response = await fetch(url);
-                if (!response.ok) {
+                // 変更通知による再読み込み（silent）では読み込み中表示とエラーダイアログを出さない
+                this.loading = !silent;
+                // 初回はIndexedDBに保存された取引を復元し、サーバーからは差分だけを取得する
+                if (ledgerCache.version === null) {
+                    try {
+                        if (await ledgerCache.restore()) {
+                            this.transactions = ledgerCache.list();
+                        }
+                    } catch (error) {
+                        this.logMessage('warning', 'ローカルキャッシュの復元に失敗しました: ' + error.toString(), 'transactions');
+                    }
+                }
+                const since = ledgerCache.version === null ? ''
+                    : `?since=${ledgerCache.version}&ledger=${encodeURIComponent(ledgerCache.ledger)}`;
+                const changesResponse = await fetch(`/api/changes${since}`);
+                if (!changesResponse.ok) {
                     throw new Error('データの取得に失敗しました');
                 }
-                this.transactions = await response.json();
+                const changes = await changesResponse.json();
+                if (changes.full_resync) {
+                    // 差分を返せない場合は全データを取得（検索とフィルタリングはフロントエンドで行う）
+                    // 変更番号は全件の取得前に受け取っているため、取得中の変更は次回の差分で再び反映される
+                    const response = await fetch('/api/transactions');
+                    if (!response.ok) {
+                        throw new Error('データの取得に失敗しました');
+                    }
+                    const transactions = await response.json();
+                    await this.saveLedgerCache(() => ledgerCache.replaceAll(transactions, changes.version, changes.ledger));
+                    this.logMessage('info', `取引データを読み込みました: ${ledgerCache.byId.size}件`, 'transactions');
+                } else if (changes.inserted.length || changes.updated.length || changes.deleted.length) {
+                    await this.saveLedgerCache(() => ledgerCache.applyChanges(changes));
+                    this.logMessage('info', `取引データの差分を反映しました: 追加${changes.inserted.length}件 更新${changes.updated.length}件 削除${changes.deleted.length}件`, 'transactions');
+                } else {
+                    ledgerCache.version = changes.version;
+                }
+                this.transactions = ledgerCache.list();
                 // 取引データ読み込み後に最新日付を更新
                 this.updateLatestDataDates();
-                this.logMessage('info', `取引データを読み込みました: ${this.transactions.length}件`, 'transactions');
             } catch (error) {
                 this.logMessage('error', '取引データの読み込みエラー: ' + error.toString(), 'transactions');
-                alert('データの読み込みに失敗しました。');
+                if (!silent) {
+                    alert('データの読み込みに失敗しました。');
+                }
             } finally {
                 this.loading = false;
             }
         },
+        // 変更通知（Server-Sent Events）の受信を開始する
+        connectLedgerEvents() {
+            if (!window.EventSource || this.ledgerEventSource) {
+                return;
+            }
+            const source = new EventSource('/api/events');
+            source.addEventListener('ledger', event => {
+                try {
+                    this.onLedgerChanged(JSON.parse(event.data));
+                } catch (error) {
+                    this.logMessage('warning', '変更通知の処理に失敗しました: ' + error.toString(), 'events');
+                }
+            });
+            source.onerror = () => {
+                // 接続数の上限や認証切れで閉じられた場合は、時間をおいて接続し直す
+                if (source.readyState === EventSource.CLOSED) {
+                    this.ledgerEventSource = null;
+                    setTimeout(() => this.connectLedgerEvents(), 30000);
+                }
+            };
+            this.ledgerEventSource = source;
+        },
+        // 変更通知を受け取り、影響を受けた表示だけを更新する
+        onLedgerChanged(change) {
+            if (change.accounts === null || this.pendingLedgerAccounts === null) {
+                this.pendingLedgerAccounts = null;
+            } else {
+                this.pendingLedgerAccounts.push(...change.accounts);
+            }
+            // 一括操作などで続けて届いた通知は1回の更新にまとめる
+            clearTimeout(this.ledgerRefreshTimeout);
+            this.ledgerRefreshTimeout = setTimeout(() => this.refreshAfterLedgerChange(), 300);
+        },
+        async refreshAfterLedgerChange() {
+            const accounts = this.pendingLedgerAccounts;
+            this.pendingLedgerAccounts = [];
+            // 取引一覧は差分だけを取得する
+            await this.loadTransactions(true);
+            // 新しい口座が追加された可能性がある場合は口座一覧も更新
+            if (accounts === null || accounts.some(account => !this.actualFundItems.includes(account))) {
+                await this.loadFundItems();
+            }
+            // 表示中のグラフは、選択中の口座が影響を受けた場合だけ再描画
+            const affected = accounts === null || accounts.some(account => this.selectedFundItems.includes(account));
+            if (!affected) {
+                return;
+            }
+            this.logMessage('debug', `変更通知によりグラフを更新します: ${accounts === null ? '全口座' : accounts.join(', ')}`, 'events');
+            if (this.showGraph) {
+                this.renderBalanceChart();
+            }
+            if (this.showRatioModal) {
+                this.renderRatioChart();
+            }
+            if (this.showItemizedModal) {
+                this.renderItemizedCharts();
+            }
+        },
+        // ローカルキャッシュを更新（IndexedDBへの保存に失敗してもメモリ上の取引は更新済み）
+        async saveLedgerCache(update) {
+            try {
+                await update();
+            } catch (error) {
+                this.logMessage('warning', 'ローカルキャッシュの保存に失敗しました: ' + error.toString(), 'transactions');
+            }
+        },
         async loadFundItems() {
             try {
                 const response = await fetch('/api/accounts');
@@ -668,20 +863,23 @@ createApp({
                 this.fundItemNames = ['すべて'];
             }
         },
-        async loadItemNames(account = null) {
+        // 項目名の入力候補を取得（使用回数と最終使用日で順位付けされた前方一致の上位のみ）
+        async loadItemNames(account = null, prefix = '') {
             try {
-                let url = '/api/items';
+                const params = new URLSearchParams();
                 if (account) {
-                    url += `?account=${encodeURIComponent(account)}`;
+                    params.append('account', account);
                 }
-                const response = await fetch(url);
+                params.append('prefix', prefix);
+                params.append('limit', this.itemSuggestionLimit);
+                const response = await fetch(`/api/items?${params}`);
                 if (!response.ok) {
                     throw new Error('項目データの取得に失敗しました');
                 }
                 const items = await response.json();
                 this.itemNames = items;
                 const accountInfo = account ? `(資金項目: ${account})` : '(全体)';
-                this.logMessage('info', `項目データを読み込みました: ${items.length}件 ${accountInfo}`, 'items');
+                this.logMessage('debug', `項目候補を読み込みました: ${items.length}件 ${accountInfo}`, 'items');
             } catch (error) {
                 this.logMessage('error', '項目データの読み込みエラー: ' + error.toString(), 'items');
                 this.itemNames = [];
@@ -765,6 +963,30 @@ createApp({
             if (this.expenseItemChartInstance) this.expenseItemChartInstance.destroy(); 
             this.logMessage('debug', '項目別収支グラフモーダルを閉じました', 'ui');
         },
+        // 期間内の収支合計と項目別内訳を取得（クレジットカード項目の扱いはサーバー側で適用）
+        async fetchPeriodSummary(displayUnit, currentDate) {
+            const emptySummary = { income: 0, expense: 0, income_items: [], expense_items: [] };
+            if (this.selectedFundItems.length === 0) {
+                // 何も選択されていない場合は空のデータ
+                return emptySummary;
+            }
+            const params = new URLSearchParams();
+            this.selectedFundItems.forEach(item => params.append('fund_items', item));
+            params.append('unit', displayUnit);
+            if (displayUnit !== 'all') {
+                params.append('period', this.getCurrentPeriodString(currentDate, displayUnit));
+            }
+            try {
+                const response = await fetch(`/api/summary?${params}`);
+                if (!response.ok) {
+                    throw new Error('期間集計の取得に失敗しました');
+                }
+                return await response.json();
+            } catch (e) {
+                this.logMessage('error', '期間集計取得エラー: ' + e.toString(), 'summary');
+                return emptySummary;
+            }
+        },
         async renderRatioChart() {
             // 既存チャートを破棄
             if (this.ratioChartInstance) {
@@ -785,63 +1007,10 @@ createApp({
                 canvas.style.height = size + 'px';
             }
             const ctx = canvas.getContext('2d');
-            // 全取引を再取得
-            let allTxs = [];
-            try {
-                const res = await fetch('/api/transactions');
-                allTxs = await res.json();
-            } catch (e) {
-                this.logMessage('error', '取引データ取得エラー: ' + e.toString(), 'transactions');
-            }
-            // 選択中の資金項目でフィルタ（統一された選択を使用）
-            let filteredTxs;
-            if (this.selectedFundItems.length === 0) {
-                // 何も選択されていない場合は空のデータ
-                filteredTxs = [];
-            } else if (this.selectedFundItems.length < this.actualFundItems.length) {
-                // 部分選択の場合のみフィルタリング
-                filteredTxs = allTxs.filter(t => this.selectedFundItems.includes(t.fundItem || t.account));
-            } else {
-                // 全選択の場合は全て表示
-                filteredTxs = allTxs;
-            }
-            
-            // クレジットカード項目の処理
-            if (filteredTxs.length > 0) {
-                // 選択された資金項目が全てクレジットカード項目かチェック
-                const allSelectedAreCredit = this.selectedFundItems.length > 0 && 
-                    this.selectedFundItems.every(item => this.selectedCreditCardItems.includes(item));
-                
-                // 通常項目とクレジットカード項目が混在している場合、クレジットカード項目を除外
-                if (!allSelectedAreCredit) {
-                    filteredTxs = filteredTxs.filter(t => !this.selectedCreditCardItems.includes(t.fundItem || t.account));
-                }
-            }
-            
-            // 期間選択に基づいてデータをさらにフィルタ
-            if (this.ratioDisplayUnit !== 'all') {
-                const selectedDate = this.ratioCurrentDate;
-                const selectedYear = selectedDate.getFullYear();
-                const selectedMonth = selectedDate.getMonth();
-                const selectedDay = selectedDate.getDate();
-                
-                filteredTxs = filteredTxs.filter(t => {
-                    const txDate = new Date(t.date);
-                    if (this.ratioDisplayUnit === 'year') {
-                        return txDate.getFullYear() === selectedYear;
-                    } else if (this.ratioDisplayUnit === 'month') {
-                        return txDate.getFullYear() === selectedYear && txDate.getMonth() === selectedMonth;
-                    } else if (this.ratioDisplayUnit === 'day') {
-                        return txDate.getFullYear() === selectedYear && 
-                               txDate.getMonth() === selectedMonth && 
-                               txDate.getDate() === selectedDay;
-                    }
-                    return true;
-                });
-            }
-            
-            const totalIncome = filteredTxs.filter(t => t.type === 'income').reduce((sum, t) => sum + t.amount, 0);
-            const totalExpense = filteredTxs.filter(t => t.type === 'expense').reduce((sum, t) => sum + t.amount, 0);
+            // 選択中の資金項目・期間の収支合計をサーバーの月次集計から取得（統一された選択を使用）
+            const summary = await this.fetchPeriodSummary(this.ratioDisplayUnit, this.ratioCurrentDate);
+            const totalIncome = summary.income;
+            const totalExpense = summary.expense;
             const data = {
                 labels: ['収入','支出'],
                 datasets: [{ data:[totalIncome,totalExpense], backgroundColor:['#4caf50','#f44336'] }]
@@ -898,71 +1067,12 @@ createApp({
                     canvas.style.height = sizePerChart + 'px';
                 });
             }
-            // fetch fresh transactions
-            let allTxs = [];
-            try {
-                const res = await fetch('/api/transactions'); allTxs = await res.json();
-            } catch (e) { this.logMessage('error', '取引データ取得エラー: ' + e.toString(), 'transactions'); }
-            // filter by selected fund item（統一された選択を使用）
-            let filtered;
-            if (this.selectedFundItems.length === 0) {
-                // 何も選択されていない場合は空のデータ
-                filtered = [];
-            } else if (this.selectedFundItems.length < this.actualFundItems.length) {
-                // 部分選択の場合のみフィルタリング
-                filtered = allTxs.filter(t => this.selectedFundItems.includes(t.fundItem || t.account));
-            } else {
-                // 全選択の場合は全て表示
-                filtered = allTxs;
-            }
-            
-            // クレジットカード項目の処理
-            if (filtered.length > 0) {
-                // 選択された資金項目が全てクレジットカード項目かチェック
-                const allSelectedAreCredit = this.selectedFundItems.length > 0 && 
-                    this.selectedFundItems.every(item => this.selectedCreditCardItems.includes(item));
-                
-                // 通常項目とクレジットカード項目が混在している場合、クレジットカード項目を除外
-                if (!allSelectedAreCredit) {
-                    filtered = filtered.filter(t => !this.selectedCreditCardItems.includes(t.fundItem || t.account));
-                }
-            }
-            
-            // 期間選択に基づいてデータをさらにフィルタ
-            if (this.itemizedDisplayUnit !== 'all') {
-                const selectedDate = this.itemizedCurrentDate;
-                const selectedYear = selectedDate.getFullYear();
-                const selectedMonth = selectedDate.getMonth();
-                const selectedDay = selectedDate.getDate();
-                
-                filtered = filtered.filter(t => {
-                    const txDate = new Date(t.date);
-                    if (this.itemizedDisplayUnit === 'year') {
-                        return txDate.getFullYear() === selectedYear;
-                    } else if (this.itemizedDisplayUnit === 'month') {
-                        return txDate.getFullYear() === selectedYear && txDate.getMonth() === selectedMonth;
-                    } else if (this.itemizedDisplayUnit === 'day') {
-                        return txDate.getFullYear() === selectedYear && 
-                               txDate.getMonth() === selectedMonth && 
-                               txDate.getDate() === selectedDay;
-                    }
-                    return true;
-                });
-            }
-            // aggregate by item
-            const incomeItems = {}, expenseItems = {};
-            filtered.forEach(t => {
-                const key = t.item || '未指定';
-                if (t.type==='income') incomeItems[key] = (incomeItems[key]||0) + t.amount;
-                else expenseItems[key] = (expenseItems[key]||0) + t.amount;
-            });
-            // sort entries by descending value
-            const inEntries = Object.entries(incomeItems).sort((a,b) => b[1] - a[1]);
-            const exEntries = Object.entries(expenseItems).sort((a,b) => b[1] - a[1]);
-            const inLabels = inEntries.map(([key]) => key);
-            const inData = inEntries.map(([_, val]) => val);
-            const exLabels = exEntries.map(([key]) => key);
-            const exData = exEntries.map(([_, val]) => val);
+            // 選択中の資金項目・期間の項目別内訳をサーバーの月次集計から取得（金額の降順）
+            const summary = await this.fetchPeriodSummary(this.itemizedDisplayUnit, this.itemizedCurrentDate);
+            const inLabels = summary.income_items.map(entry => entry.item || '未指定');
+            const inData = summary.income_items.map(entry => entry.amount);
+            const exLabels = summary.expense_items.map(entry => entry.item || '未指定');
+            const exData = summary.expense_items.map(entry => entry.amount);
             // 収支比率グラフと同じChart.js設定を使用
             const chartOptions = { 
                 responsive: true,
@@ -1177,12 +1287,19 @@ createApp({
                 input.setSelectionRange(newPos, newPos);
             }, 0);
         },
+        // 項目名の入力に合わせて候補を更新（デバウンス付き）
+        onItemInput() {
+            clearTimeout(this.itemSuggestTimeout);
+            this.itemSuggestTimeout = setTimeout(() => {
+                this.loadItemNames(this.newTransaction.fundItem, this.newTransaction.item);
+            }, 100);
+        },
         // 新しい資金項目かどうかを判定
         isNewFundItem(fundItemName) {
             return fundItemName && !this.fundItemNames.includes(fundItemName);
         },
         isNewItem(itemName) {
-            // 現在選択されている資金項目内での重複チェック
+            // 現在選択されている資金項目内での重複チェック（完全一致する既存項目は候補の先頭に含まれる）
             return itemName && !this.itemNames.includes(itemName);
         },
         async addTransaction() {
@@ -1202,7 +1319,9 @@ createApp({
                     return;
                 }
 
-                // 新しい資金項目または項目の場合は確認
+                // 新しい資金項目または項目の場合は確認（入力中の候補更新を待たずに最新の状態で判定）
+                clearTimeout(this.itemSuggestTimeout);
+                await this.loadItemNames(this.newTransaction.fundItem, this.newTransaction.item);
                 let confirmMessage = '';
                 if (this.isNewFundItem(this.newTransaction.fundItem)) {
                     confirmMessage = `「${this.newTransaction.fundItem}」は新しい資金項目です。作成しますか？`;
@@ -1365,7 +1484,11 @@ createApp({
                 const data = await response.json();
                 
                 if (response.ok && data.success) {
-                    // ログアウト成功 - ログイン画面にリダイレクト
+                    // ログアウト成功 - 変更通知を止め、ローカルの取引データを破棄してログイン画面にリダイレクト
+                    if (this.ledgerEventSource) {
+                        this.ledgerEventSource.close();
+                    }
+                    await this.saveLedgerCache(() => ledgerCache.clear());
                     window.location.href = '/login';
                 } else {
                     alert('ログアウトに失敗しました');
@@ -1378,6 +1501,7 @@ createApp({
         async renderBalanceChart() {
             // 残高推移グラフの描画処理（クレジットカード項目フィルタリング対応）
             // 新しいAPI /api/balance_history_filtered を使用して、混在選択時の線途切れ問題を解決
+            // aggregate=total で合計残高の推移（変化した日のみ）をサーバー側で計算して受け取る
             // 非同期処理でデータを取得し、適切なエラーハンドリングを実装
             
             // 既存のグラフがあれば破棄
@@ -1449,6 +1573,7 @@ createApp({
                 this.selectedFundItems.forEach(item => {
                     params.append('fund_items', item);
                 });
+                params.append('aggregate', 'total');
                 
                 const response = await fetch(`/api/balance_history_filtered?${params}`, {
                     method: 'GET',
@@ -1462,7 +1587,7 @@ createApp({
                 }
                 
                 const balanceData = await response.json();
-                this.logMessage('debug', `残高履歴グラフ用データを取得: ${balanceData.accounts?.length || 0}口座, ${balanceData.dates?.length || 0}日分`, 'balance_chart');
+                this.logMessage('debug', `残高履歴グラフ用データを取得: ${balanceData.accounts?.length || 0}口座, ${balanceData.dates?.length || 0}件の変化点`, 'balance_chart');
                 
                 // データが空の場合は空のグラフを表示
                 if (!balanceData.dates || balanceData.dates.length === 0) {
@@ -1508,22 +1633,11 @@ createApp({
                     return;
                 }
 
-                // フィルタリングされた各口座の残高を日付別に合計
-                // 新しいAPIによりクレジットカード項目が適切にフィルタリング済み
-                const dailyTotalBalances = {};
-                balanceData.dates.forEach((date, index) => {
-                    let totalBalance = 0;
-                    balanceData.accounts.forEach(account => {
-                        if (balanceData.balances[account] && balanceData.balances[account][index] !== undefined) {
-                            totalBalance += balanceData.balances[account][index] || 0;
-                        }
-                    });
-                    dailyTotalBalances[date] = totalBalance;
-                });
-
+                // 合計残高はサーバー側でクレジットカード項目をフィルタリングした口座から計算済み
                 // データを表示単位（日/月/年）で集計
                 const grouped = {};
-                Object.entries(dailyTotalBalances).forEach(([dateStr, balance]) => {
+                balanceData.dates.forEach((dateStr, index) => {
+                    const balance = balanceData.total[index];
                     const d = new Date(dateStr);
                     let key;
                     if (this.graphDisplayUnit === 'month') {
@@ -1843,6 +1957,8 @@ createApp({
             // 資金項目データ読み込み完了後に取引データとクレジットカード設定を読み込む
             this.loadTransactions();
             this.loadCreditCardSettings();
+            // 他のタブや端末での変更を受け取る
+            this.connectLedgerEvents();
             this.logMessage('info', 'アプリケーションの初期化が完了しました', 'app');
         });
         // 初期状態では項目名は空（資金項目選択時に取得）
@@ -1851,6 +1967,9 @@ createApp({
         // イベントリスナーをクリーンアップ
         document.removeEventListener('click', this.handleClickOutside);
         window.removeEventListener('resize', this.handleWindowResize);
+        if (this.ledgerEventSource) {
+            this.ledgerEventSource.close();
+        }
     },
     created() {
         // Vue app created
@@ -0,0 +1,401 @@
+"""
+Server Money - マルチテナント（ユーザーごとのデータベース）
+
+このファイルは、TENANT_MODEが有効な場合に、ログインしたユーザーごとに別のSQLiteファイル
+（シャード）を使用する仕組みを提供します。
+
+- ユーザーとパスワードハッシュはTENANT_USERS_FILE（JSON）で管理します（flask add-tenant-user）
+- シャードは TENANT_DATA_DIR/<ユーザー名>/money_tracker.db に作成され、クレジットカード設定や
+  CSVバックアップも同じディレクトリに保存されます
+- 開いたシャードのエンジンは最大TENANT_ENGINE_CACHE_SIZE個まで保持し（LRU）、
+  TENANT_IDLE_SECONDS使われなかったシャードは接続を閉じて破棄します
+- シャードはプロセス内で最初にアクセスされたときに、スキーマバージョンを確認して
+  未適用のマイグレーションを適用します（起動時に全シャードを移行する必要はありません）
+- スナップショットや入力補完のインデックスなどデータバージョンに紐づくキャッシュは、
+  TenantScopedによってシャードごとに別のインスタンスを使用します
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from sqlalchemy import create_engine
+from database import (
+    use_tenant_shard, get_tenant_shard, read_only_url,
+    configure_write_engine, configure_read_engine
+)
+from server_timing import timing_phase
+
+try:
+    import fcntl
+except ImportError:  # Windows（マルチプロセスモードは使用できないため、プロセス間のロックは不要）
+    fcntl = None
+
+# ユーザー名（シャードのディレクトリ名にもなるため、パスとして安全な文字のみ）
+TENANT_NAME_PATTERN = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_.-]{0,63}$')
+
+# シャードのデータベースファイル名
+SHARD_DB_FILENAME = 'money_tracker.db'
+
+def is_valid_tenant_name(name):
+    """ユーザー名がテナント名として使用できるか判定
+
+    Args:
+        name (str): ユーザー名
+
+    Returns:
+        bool: 使用できる場合True
+    """
+    return isinstance(name, str) and bool(TENANT_NAME_PATTERN.match(name)) and '..' not in name
+
+class TenantShard:
+    """1ユーザー分のデータベース（エンジンとテナントごとのキャッシュ）"""
+
+    def __init__(self, name, directory, engine, read_engine=None):
+        self.name = name
+        self.directory = directory
+        self.engine = engine
+        self.read_engine = read_engine
+        self.last_used = time.monotonic()
+        self._scoped = {}
+        self._lock = threading.Lock()
+
+    def scoped(self, key, factory):
+        """このシャード用のインスタンスを取得する（初回は作成）
+
+        Args:
+            key: インスタンスを識別するキー
+            factory: インスタンスを作成する引数なしの関数
+
+        Returns:
+            このシャード用のインスタンス
+        """
+        with self._lock:
+            instance = self._scoped.get(key)
+            if instance is None:
+                instance = self._scoped[key] = factory()
+            return instance
+
+    def dispose(self):
+        """プールされている接続を閉じる（使用中の接続は返却時に閉じられる）"""
+        self.engine.dispose()
+        if self.read_engine is not None:
+            self.read_engine.dispose()
+
+    def __repr__(self):
+        return f'<TenantShard {self.name}>'
+
+class TenantScoped:
+    """現在のテナントのインスタンスに属性アクセスを振り分けるプロキシ
+
+    単一テナントモード（シャードを使用していないコンテキスト）では、既定のインスタンスを使用します。
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._default = factory()
+
+    def resolve(self):
+        """現在のテナントのインスタンスを取得
+
+        Returns:
+            現在のシャード用のインスタンス（シャードを使用していない場合は既定のインスタンス）
+        """
+        shard = get_tenant_shard()
+        if shard is None:
+            return self._default
+        return shard.scoped(self, self._factory)
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+def tenant_path(filename, default_dir):
+    """テナントごとに分けるファイルのパスを取得
+
+    Args:
+        filename (str): ファイル名（またはディレクトリ名）
+        default_dir (str): 単一テナントモードで使用するディレクトリ
+
+    Returns:
+        str: シャードを使用している場合はシャードのディレクトリ、それ以外はdefault_dir内のパス
+    """
+    shard = get_tenant_shard()
+    return os.path.join(shard.directory if shard is not None else default_dir, filename)
+
+class TenantUserStore:
+    """ユーザー名とパスワードハッシュをJSONファイルで管理するストア
+
+    ファイルの更新時刻が変わった場合のみ読み直すため、リクエストごとの確認は
+    stat1回で済みます。書き込みは一時ファイルへの書き出しとos.replaceで行います。
+    """
+
+    def __init__(self):
+        self.path = None
+        self._users = {}
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """ユーザーファイルのパスを設定する
+
+        Args:
+            app: Flaskアプリケーションインスタンス
+        """
+        self.path = app.config['TENANT_USERS_FILE'] or os.path.join(app.instance_path, 'tenant_users.json')
+        self._users = {}
+        self._mtime = None
+
+    def _load(self):
+        """ファイルが更新されていれば読み直す（ロック取得済みで呼び出すこと）"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            self._users, self._mtime = {}, None
+            return
+        if mtime == self._mtime:
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            users = json.load(f)
+        self._users = users.get('users', {})
+        self._mtime = mtime
+
+    def get_password_hash(self, username):
+        """ユーザーのパスワードハッシュを取得
+
+        Args:
+            username (str): ユーザー名
+
+        Returns:
+            str: bcryptハッシュ（ユーザーが存在しない場合None）
+        """
+        with self._lock:
+            self._load()
+            return self._users.get(username)
+
+    def exists(self, username):
+        """ユーザーが登録されているか判定"""
+        return self.get_password_hash(username) is not None
+
+    def usernames(self):
+        """登録されているユーザー名の一覧"""
+        with self._lock:
+            self._load()
+            return sorted(self._users)
+
+    def set_password_hash(self, username, password_hash):
+        """ユーザーを追加、またはパスワードハッシュを更新する
+
+        Args:
+            username (str): ユーザー名
+            password_hash (str): bcryptハッシュ
+
+        Raises:
+            ValueError: ユーザー名がテナント名として使用できない場合
+        """
+        if not is_valid_tenant_name(username):
+            raise ValueError(f'ユーザー名に使用できない文字が含まれています: {username}')
+        with self._lock:
+            self._load()
+            users = dict(self._users)
+            users[username] = password_hash
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            temp_path = f'{self.path}.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({'users': users}, f, ensure_ascii=False, indent=2)
+            os.replace(temp_path, self.path)
+            self._users = users
+            self._mtime = os.stat(self.path).st_mtime_ns
+
+class TenantRegistry:
+    """開いているシャードのLRU"""
+
+    def __init__(self):
+        self._app = None
+        self._shards = OrderedDict()  # テナント名 -> TenantShard（最近使われた順に末尾）
+        self._opening = {}            # テナント名 -> 準備中のシャードを待つためのロック
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def init_app(self, app):
+        """アプリケーションを登録する
+
+        Args:
+            app: Flaskアプリケーションインスタンス
+        """
+        self._app = app
+        self.data_dir = app.config['TENANT_DATA_DIR'] or os.path.join(app.instance_path, 'tenants')
+
+    def acquire(self, name):
+        """テナントのシャードを取得する（開いていなければ開き、必要ならマイグレーションを適用）
+
+        Args:
+            name (str): テナント名（ユーザー名）
+
+        Returns:
+            TenantShard: シャード
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                # fork後のワーカープロセスでは、親プロセスが開いた接続を引き継がない
+                self._shards.clear()
+                self._opening.clear()
+                self._pid = os.getpid()
+            shard = self._touch(name)
+            if shard is not None:
+                evicted = self._evict()
+            else:
+                opening = self._opening.setdefault(name, threading.Lock())
+
+        if shard is None:
+            # 同じテナントを同時に開くリクエストは、最初の1つの準備が終わるのを待つ
+            with opening:
+                with self._lock:
+                    shard = self._touch(name)
+                if shard is None:
+                    shard = self._open(name)
+                    with self._lock:
+                        self._shards[name] = shard
+                        self._opening.pop(name, None)
+                with self._lock:
+                    evicted = self._evict()
+
+        for old in evicted:
+            old.dispose()
+            self._app.logger.info(f"テナントのデータベースを閉じました: {old.name}")
+        return shard
+
+    def _touch(self, name):
+        """開いているシャードを最近使われたものとして取得する（ロック取得済みで呼び出すこと）"""
+        shard = self._shards.get(name)
+        if shard is not None:
+            self._shards.move_to_end(name)
+            shard.last_used = time.monotonic()
+        return shard
+
+    def _evict(self):
+        """上限を超えた分と、一定時間使われていないシャードを取り除く（ロック取得済みで呼び出すこと）
+
+        Returns:
+            list: 取り除いたTenantShard
+        """
+        config = self._app.config
+        idle_before = time.monotonic() - config['TENANT_IDLE_SECONDS']
+        evicted = []
+        while self._shards:
+            name, shard = next(iter(self._shards.items()))
+            if len(self._shards) <= config['TENANT_ENGINE_CACHE_SIZE'] and shard.last_used >= idle_before:
+                break
+            del self._shards[name]
+            evicted.append(shard)
+        return evicted
+
+    def open_count(self):
+        """開いているシャードの数"""
+        with self._lock:
+            return len(self._shards)
+
+    def _open(self, name):
+        """シャードのエンジンを作成し、スキーマを最新にする"""
+        app = self._app
+        config = app.config
+        directory = os.path.join(self.data_dir, name)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.abspath(os.path.join(directory, SHARD_DB_FILENAME))
+
+        # シャードはLRUの上限まで同時に開くため、リクエストに必要な分だけ接続を増やす
+        engine = create_engine(f'sqlite:///{path}', pool_size=1, max_overflow=config['SERVER_THREADS'])
+        configure_write_engine(engine)
+        shard = TenantShard(name, directory, engine)
+        try:
+            self._prepare(shard)
+        except Exception:
+            engine.dispose()
+            raise
+
+        if config['READ_ENGINE_ENABLED']:
+            shard.read_engine = create_engine(
+                read_only_url(path), pool_size=1, max_overflow=config['SERVER_THREADS']
+            )
+            configure_read_engine(shard.read_engine)
+        app.logger.info(f"テナントのデータベースを開きました: {name}")
+        return shard
+
+    def _prepare(self, shard):
+        """シャードのスキーマが古い場合はテーブルを作成してマイグレーションを適用する"""
+        from models import db
+        from migrations import run_migrations, get_schema_version, SCHEMA_VERSION
+        from changes import compact_change_journal
+
+        app = self._app
+        with app.app_context():
+            use_tenant_shard(shard)
+            if get_schema_version() != SCHEMA_VERSION:
+                with self._migration_lock(shard):
+                    # 他のワーカープロセスが先に移行した場合は何もしない
+                    db.session.rollback()
+                    if get_schema_version() != SCHEMA_VERSION:
+                        app.logger.info(f"テナントのデータベースを準備します: {shard.name}")
+                        db.metadata.create_all(bind=shard.engine)
+                        run_migrations(app)
+            removed = compact_change_journal(app.config['CHANGE_JOURNAL_MAX_TOMBSTONES'])
+            db.session.commit()
+            if removed:
+                app.logger.info(f"変更履歴の削除の記録を整理しました: {shard.name} {removed}件")
+
+    @contextmanager
+    def _migration_lock(self, shard):
+        """シャードのマイグレーションを複数のワーカープロセスで同時に行わないためのロック"""
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(shard.directory, '.migrate.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+tenant_users = TenantUserStore()
+tenant_registry = TenantRegistry()
+
+def activate_tenant():
+    """ログイン中のユーザーのシャードをこのリクエストで使用する（before_requestに登録）"""
+    # 初回アクセス時のマイグレーションを含め、処理時間はauthフェーズに含める
+    with timing_phase('auth'):
+        return _activate_tenant()
+
+def _activate_tenant():
+    from flask import session, jsonify, request, redirect, url_for
+
+    if request.endpoint == 'static' or not session.get('logged_in'):
+        return None
+    username = session.get('username')
+    if not is_valid_tenant_name(username) or not tenant_users.exists(username):
+        # 削除されたユーザーのセッションは無効にする
+        session.clear()
+        if request.is_json or request.path.startswith('/api/'):
+            return jsonify({'error': '認証が必要です', 'login_required': True}), 401
+        return redirect(url_for('auth.login_page'))
+    use_tenant_shard(tenant_registry.acquire(username))
+    return None
+
+def init_tenants(app):
+    """マルチテナントモードを初期化する（TENANT_MODEが無効な場合は何もしない）
+
+    Args:
+        app: Flaskアプリケーションインスタンス
+    """
+    if not app.config['TENANT_MODE']:
+        return
+    tenant_users.init_app(app)
+    tenant_registry.init_app(app)
+    app.before_request(activate_tenant)
+    app.logger.info(
+        f"マルチテナントモード: {tenant_registry.data_dir} "
+        f"(最大{app.config['TENANT_ENGINE_CACHE_SIZE']}シャード, アイドル{app.config['TENANT_IDLE_SECONDS']}秒で破棄)"
+    )
@@ -0,0 +1,242 @@
+"""
+Server Money - 取引検索クエリ言語
+
+このファイルは、`item:食費 type:expense amount>=1000 date:2025-01..2025-03 sort:-date`
+のような検索文字列を解析し、SQLAlchemyの条件と並び順に変換する機能を提供します。
+
+書式:
+    item:値 / account:値     項目名・口座名の完全一致（*を含む場合はワイルドカード、,区切りでいずれか）
+    type:income / expense    取引種別
+    amount>=1000 など        金額の比較（: = > >= < <=、amount:100..500 で範囲）
+    balance>=0 など          残高の比較（amountと同じ書式）
+    date:2025-01..2025-03    日付の範囲（YYYY / YYYY-MM / YYYY-MM-DD、両端を含む、片側省略可）
+    date>=2025-01-15 など    日付の比較
+    id:1,2,3                 取引ID
+    sort:-date,amount        並び順（-で降順、date / amount / balance / id / item / account / type）
+    その他の語               項目名の部分一致
+    先頭に-を付けた条件は否定（例: -item:家賃）
+    空白を含む値は "..." で囲む
+"""
+
+import re
+import shlex
+from datetime import datetime, timedelta
+from sqlalchemy import and_, or_, not_
+from models import Transaction
+
+class QuerySyntaxError(ValueError):
+    """検索クエリの書式エラー"""
+
+# 並び替えに使用できるキー（Transactionの属性名）
+SORT_KEYS = ('date', 'amount', 'balance', 'id', 'item', 'account', 'type')
+
+# 並び順の指定がない場合は新しい順
+DEFAULT_SORT = ['-date']
+
+_TERM_PATTERN = re.compile(r'^(?P<field>[a-z_]+)(?P<op>>=|<=|:|=|>|<)(?P<value>.*)$')
+
+_COMPARISONS = {
+    ':': lambda column, value: column == value,
+    '=': lambda column, value: column == value,
+    '>': lambda column, value: column > value,
+    '>=': lambda column, value: column >= value,
+    '<': lambda column, value: column < value,
+    '<=': lambda column, value: column <= value,
+}
+
+def _parse_period(value):
+    """YYYY / YYYY-MM / YYYY-MM-DD を期間の開始日時と終了日時（終了は含まない）に変換"""
+    for fmt, length in (('%Y-%m-%d', 10), ('%Y-%m', 7), ('%Y', 4)):
+        if len(value) != length:
+            continue
+        try:
+            start = datetime.strptime(value, fmt)
+        except ValueError:
+            break
+        if fmt == '%Y-%m-%d':
+            return start, start + timedelta(days=1)
+        if fmt == '%Y-%m':
+            return start, (start + timedelta(days=32)).replace(day=1)
+        return start, start.replace(year=start.year + 1)
+    raise QuerySyntaxError(f'日付の形式が正しくありません: {value}')
+
+def _parse_int(field, value):
+    try:
+        return int(value)
+    except ValueError:
+        raise QuerySyntaxError(f'{field}は整数で指定してください: {value}')
+
+def _name_condition(column, value):
+    """項目名・口座名の条件（,区切りはいずれか、*はワイルドカード）"""
+    names = [name for name in value.split(',') if name]
+    if not names:
+        raise QuerySyntaxError('値が指定されていません')
+    conditions = []
+    exact = [name for name in names if '*' not in name]
+    if exact:
+        conditions.append(column.in_(exact))
+    for pattern in names:
+        if '*' in pattern:
+            escaped = pattern.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            conditions.append(column.like(escaped.replace('*', '%'), escape='\\'))
+    return conditions[0] if len(conditions) == 1 else or_(*conditions)
+
+def _number_condition(field, column, op, value):
+    if op == ':' and '..' in value:
+        low, high = value.split('..', 1)
+        conditions = []
+        if low:
+            conditions.append(column >= _parse_int(field, low))
+        if high:
+            conditions.append(column <= _parse_int(field, high))
+        if not conditions:
+            raise QuerySyntaxError(f'{field}の範囲が指定されていません')
+        return and_(*conditions)
+    return _COMPARISONS[op](column, _parse_int(field, value))
+
+def _date_bounds(op, value):
+    """日付の条件を期間の開始日時（含む）と終了日時（含まない）に変換（片側はNoneの場合がある）"""
+    if op == ':' and '..' in value:
+        low, high = value.split('..', 1)
+        if not low and not high:
+            raise QuerySyntaxError('dateの範囲が指定されていません')
+        return (_parse_period(low)[0] if low else None,
+                _parse_period(high)[1] if high else None)
+
+    start, end = _parse_period(value)
+    if op in (':', '='):
+        return start, end
+    if op == '>':
+        return end, None
+    if op == '>=':
+        return start, None
+    if op == '<':
+        return None, start
+    return None, end
+
+def _date_condition(column, op, value):
+    start, end = _date_bounds(op, value)
+    conditions = []
+    if start is not None:
+        conditions.append(column >= start)
+    if end is not None:
+        conditions.append(column < end)
+    return and_(*conditions)
+
+def _sort_clauses(keys, entity):
+    clauses = []
+    for key in keys:
+        descending = key.startswith('-')
+        name = key.lstrip('-+')
+        if name not in SORT_KEYS:
+            raise QuerySyntaxError(f'並び替えに使用できないキーです: {name}')
+        column = getattr(entity, name)
+        clauses.append(column.desc() if descending else column.asc())
+    return clauses
+
+def _parse_terms(text):
+    """検索文字列を (否定, フィールド, 演算子, 値) の組に分解する（フィールド指定のない語はフィールドがNone）"""
+    try:
+        tokens = shlex.split(text or '')
+    except ValueError:
+        raise QuerySyntaxError('引用符が閉じられていません')
+
+    for token in tokens:
+        negate = False
+        body = token
+        if token.startswith('-') and len(token) > 1 and _TERM_PATTERN.match(token[1:]):
+            negate = True
+            body = token[1:]
+
+        match = _TERM_PATTERN.match(body)
+        if match is None:
+            yield negate, None, None, body
+            continue
+
+        field, op, value = match.group('field'), match.group('op'), match.group('value')
+        if not value:
+            raise QuerySyntaxError(f'{field}の値が指定されていません')
+        yield negate, field, op, value
+
+def get_query_date_range(text):
+    """検索文字列の日付の条件から、一致する取引が含まれうる期間を求める
+
+    否定していない日付の条件（全て満たす必要がある）の共通部分を返します。
+    読み取るテーブル（取引テーブル・アーカイブテーブル）の選択に使用します。
+
+    Args:
+        text (str): 検索文字列
+
+    Returns:
+        tuple: (start, end) 開始日時（含む）と終了日時（含まない）。制限がない側はNone
+
+    Raises:
+        QuerySyntaxError: 書式が正しくない場合
+    """
+    start = end = None
+    for negate, field, op, value in _parse_terms(text):
+        if negate or field != 'date':
+            continue
+        low, high = _date_bounds(op, value)
+        if low is not None and (start is None or low > start):
+            start = low
+        if high is not None and (end is None or high < end):
+            end = high
+    return start, end
+
+def parse_transaction_query(text, entity=Transaction):
+    """検索文字列を解析してSQLAlchemyの条件と並び順に変換
+
+    Args:
+        text (str): 検索文字列
+        entity: 条件を組み立てるエンティティ（Transaction、またはarchive.ledger_sourceの戻り値）
+
+    Returns:
+        tuple: (conditions, order_by) 条件のリストと並び順のリスト（ページングが安定するよう最後にidを含む）
+
+    Raises:
+        QuerySyntaxError: 書式が正しくない場合
+    """
+    conditions = []
+    sort_keys = []
+    for negate, field, op, value in _parse_terms(text):
+        if field is None:
+            # フィールド指定のない語は項目名の部分一致
+            escaped = value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            conditions.append(entity.item.like(f'%{escaped}%', escape='\\'))
+            continue
+
+        if field == 'sort':
+            if op != ':' or negate:
+                raise QuerySyntaxError('sortは sort:-date のように指定してください')
+            sort_keys.extend(key for key in value.split(',') if key)
+            continue
+
+        if field in ('item', 'account'):
+            if op not in (':', '='):
+                raise QuerySyntaxError(f'{field}には : で値を指定してください')
+            column = entity.item if field == 'item' else entity.account
+            condition = _name_condition(column, value)
+        elif field == 'type':
+            if op not in (':', '=') or value not in ('income', 'expense'):
+                raise QuerySyntaxError('typeは type:income または type:expense で指定してください')
+            condition = entity.type == value
+        elif field in ('amount', 'balance'):
+            column = entity.amount if field == 'amount' else entity.balance
+            condition = _number_condition(field, column, op, value)
+        elif field == 'date':
+            condition = _date_condition(entity.date, op, value)
+        elif field == 'id':
+            if op not in (':', '='):
+                raise QuerySyntaxError('idは id:1,2,3 のように指定してください')
+            condition = entity.id.in_([_parse_int(field, tx_id) for tx_id in value.split(',') if tx_id])
+        else:
+            raise QuerySyntaxError(f'不明な検索項目です: {field}')
+
+        conditions.append(not_(condition) if negate else condition)
+
+    order_by = _sort_clauses(sort_keys or DEFAULT_SORT, entity)
+    if not any(key.lstrip('-+') == 'id' for key in sort_keys):
+        # 同じ値の行の並びを固定し、ページをまたいだ重複や欠落を防ぐ
+        order_by.append(entity.id.desc() if (sort_keys or DEFAULT_SORT)[0].startswith('-') else entity.id.asc())
+    return conditions, order_by
@@ -9,10 +9,94 @@ import csv
 import io
 import os
 import glob
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
 from sqlalchemy import text, inspect
 from models import db
 
+class VersionedCache:
+    """データバージョンに紐づくプロセス内キャッシュ
+    
+    値はデータバージョンと一緒に保存され、取得時のバージョンと異なる値は無効として扱います。
+    エントリ数はmaxsizeを上限とし、超えた場合は最も長く使われていないものから削除します。
+    """
+    
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()  # key -> (version, value)
+        self._lock = threading.Lock()
+    
+    def get(self, key, version):
+        """キャッシュから値を取得
+        
+        Args:
+            key: キャッシュキー
+            version (int): 現在のデータバージョン
+            
+        Returns:
+            キャッシュされた値。存在しないか古い場合はNone
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+    
+    def set(self, key, version, value):
+        """キャッシュに値を保存
+        
+        Args:
+            key: キャッシュキー
+            version (int): 値を計算した時点のデータバージョン
+            value: 保存する値
+        """
+        with self._lock:
+            self._entries[key] = (version, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+def load_credit_card_items():
+    """クレジットカード項目の設定を読み込む
+    
+    Returns:
+        list: クレジットカード項目として設定された口座名のリスト
+    """
+    import json
+    from flask import current_app
+    
+    from tenants import tenant_path
+    
+    settings_file = tenant_path('credit_card_settings.json', current_app.instance_path)
+    if not os.path.exists(settings_file):
+        return []
+    with open(settings_file, 'r', encoding='utf-8') as f:
+        settings = json.load(f)
+    return settings.get('credit_card_items', [])
+
+def resolve_analysis_accounts(selected_fund_items, credit_card_items):
+    """分析対象とする口座をクレジットカード項目の扱いを考慮して決定
+    
+    選択された資金項目が全てクレジットカード項目の場合はそのまま、
+    通常項目と混在している場合はクレジットカード項目を除外します。
+    
+    Args:
+        selected_fund_items (list): 選択された資金項目
+        credit_card_items (list): クレジットカード項目
+        
+    Returns:
+        list: 分析対象の口座名のリスト
+    """
+    non_credit_selected = [item for item in selected_fund_items if item not in credit_card_items]
+    if not non_credit_selected:
+        # 全てクレジットカード項目（または未選択）の場合
+        return list(selected_fund_items)
+    return non_credit_selected
+
 def cleanup_old_backups(backup_dir, max_files=3):
     """バックアップディレクトリ内の古いCSVファイルを削除し、最新のmax_files件のみを保持する
     
@@ -41,12 +125,71 @@ def cleanup_old_backups(backup_dir, max_files=3):
         except OSError as e:
             current_app.logger.error(f"バックアップファイルの削除に失敗しました: {file_path}, エラー: {e}")
 
+class StartupTimer:
+    """起動処理のフェーズごとの所要時間を計測する"""
+    
+    def __init__(self, started_at=None):
+        self.started_at = started_at if started_at is not None else time.perf_counter()
+        self.phases = []  # (フェーズ名, 秒)
+    
+    @contextmanager
+    def phase(self, name):
+        """with文で囲んだ処理の所要時間をフェーズとして記録する
+        
+        Args:
+            name (str): フェーズ名
+        """
+        phase_started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - phase_started))
+    
+    def report(self):
+        """計測結果を1行の文字列にする
+        
+        Returns:
+            str: 'フェーズ名 12.3ms, ... (合計 45.6ms)' 形式の文字列
+        """
+        total = time.perf_counter() - self.started_at
+        phases = ', '.join(f'{name} {seconds * 1000:.1f}ms' for name, seconds in self.phases)
+        return f'{phases} (合計 {total * 1000:.1f}ms)'
+
+# スキーマが最新であることを確認済みのデータベースURI（プロセス内キャッシュ）
+_schema_ready = set()
+
+def _mark_schema_ready(app):
+    _schema_ready.add(app.config['SQLALCHEMY_DATABASE_URI'])
+
+def is_schema_ready(app):
+    """このプロセスでスキーマが最新であることを確認済みか判定
+    
+    Args:
+        app: Flaskアプリケーションインスタンス
+    
+    Returns:
+        bool: 確認済みの場合True
+    """
+    return app.config['SQLALCHEMY_DATABASE_URI'] in _schema_ready
+
 def init_db(app):
     """データベースを初期化する(SQLAlchemy 2.0対応)
     
+    スキーマバージョン（PRAGMA user_version）が最新の場合は、テーブル構成の確認と
+    マイグレーションを省略します。それ以外の場合は不足しているテーブルを作成した後、
+    未適用のマイグレーションを適用します。
+    
     Args:
         app: Flaskアプリケーションインスタンス
     """
+    from migrations import run_migrations, get_schema_version, SCHEMA_VERSION
+    
+    with app.app_context():
+        if get_schema_version() == SCHEMA_VERSION:
+            _mark_schema_ready(app)
+            app.logger.info(f"スキーマは最新です (v{SCHEMA_VERSION})。テーブルの確認を省略します")
+            return
+    
     try:
         with app.app_context():
             # テーブルの存在確認(SQLAlchemy 2.0対応)
@@ -55,10 +198,10 @@ def init_db(app):
 
             if 'transaction' not in tables:
                 app.logger.info("テーブル 'transaction' が存在しないので作成します。")
-                db.create_all()
-                app.logger.info("データベースとテーブルが正常に作成されました。")
             else:
                 app.logger.info("テーブル 'transaction' は既に存在します。")
+            # 既存テーブルはそのままに、不足しているテーブルのみ作成される
+            db.create_all()
     except Exception as e:
         app.logger.error(f"データベース初期化エラー: {e}")
         try:
@@ -68,21 +211,35 @@ def init_db(app):
         except Exception as fallback_error:
             app.logger.error(f"フォールバック失敗: {fallback_error}")
             raise
+    
+    with app.app_context():
+        run_migrations(app)
+    _mark_schema_ready(app)
 
 def ensure_table_exists():
-    """テーブルが存在しない場合に作成する(SQLAlchemy 2.0対応)"""
+    """テーブルが存在しない場合に作成する(SQLAlchemy 2.0対応)
+    
+    このプロセスでスキーマを確認済みの場合は何もしません。
+    """
     from flask import current_app
+    from database import get_tenant_shard
+    
+    # テナントのシャードは開くときにスキーマを最新にしている
+    if is_schema_ready(current_app) or get_tenant_shard() is not None:
+        return
     
     try:
         # テーブルの存在確認（簡単なクエリを実行）
         with db.engine.connect() as conn:
-            conn.execute(text("SELECT 1 FROM transaction LIMIT 1"))
+            conn.execute(text('SELECT 1 FROM "transaction" LIMIT 1'))
     except Exception:
         # テーブルが存在しない場合は作成
         current_app.logger.info("テーブルが存在しないため、作成します...")
         with current_app.app_context():
             db.create_all()
         current_app.logger.info("テーブルを作成しました")
+        return
+    _mark_schema_ready(current_app)
 
 def generate_unique_filename(directory, base_name, extension):
     """ユニークなファイル名を生成
@@ -279,72 +436,132 @@ def validate_csv_row(row, row_number):
 def import_csv_transactions(transactions_data, overwrite_mode='append'):
     """CSVから解析したトランザクションデータをデータベースにインポート
     
+    削除・追加・残高の再計算は書き込みキューで1つのDBトランザクションとして行います。
+    
     Args:
         transactions_data (list): 解析済みのトランザクションデータ
         overwrite_mode (str): インポートモード ('append' または 'replace')
         
     Returns:
         tuple: (success, imported_count, error_message)
+    
+    Raises:
+        ArchivedPeriodError: appendモードでアーカイブ済みの期間の取引が含まれている場合
+        WriteQueueBusy: 書き込みキューが満杯、または待ち時間の上限を超えた場合
     """
-    from models import Transaction
+    from archive import ArchivedPeriodError
+    from write_queue import transaction_writer, WriteQueueBusy
     from flask import current_app
     
     try:
-        # replaceモードの場合、既存データを全削除
-        if overwrite_mode == 'replace':
-            current_app.logger.info("replaceモードでCSVインポート - 既存データを削除中")
-            Transaction.query.delete()
-            db.session.commit()
-        
-        imported_count = 0
-        
-        for transaction_data in transactions_data:
-            # 新しいトランザクションを作成（balanceは一時的に0で作成）
-            transaction = Transaction(
-                account=transaction_data['account'],
-                date=transaction_data['date'],
-                item=transaction_data['item'],
-                type=transaction_data['type'],
-                amount=transaction_data['amount'],
-                balance=0  # 後で再計算する
-            )
-            
-            db.session.add(transaction)
-            imported_count += 1
-        
-        # データベースにコミット
-        db.session.commit()
+        imported_count = transaction_writer.submit(
+            lambda: _write_csv_transactions(transactions_data, overwrite_mode)
+        )
         current_app.logger.info(f"CSVインポート完了: {imported_count}件のトランザクションを追加")
-        
-        # 全ての口座の残高を再計算
-        accounts = db.session.query(Transaction.account.distinct()).all()
-        for account_tuple in accounts:
-            account = account_tuple[0]
-            _recalculate_balance_for_account_util(account)
-        
-        current_app.logger.info("全口座の残高再計算完了")
-        
         return True, imported_count, None
         
+    except (ArchivedPeriodError, WriteQueueBusy):
+        raise
     except Exception as e:
-        db.session.rollback()
         current_app.logger.error(f"CSVインポートでエラーが発生しました: {str(e)}", exc_info=True)
         return False, 0, f'インポート中にエラーが発生しました: {str(e)}'
 
-def _recalculate_balance_for_account_util(account):
-    """指定口座の残高を再計算するユーティリティ関数
+def _write_csv_transactions(transactions_data, overwrite_mode):
+    """CSVの取引を追加し、口座ごとに追加した最も古い日時から残高を再計算する（書き込みキューで実行）
+    
+    Returns:
+        function: コミット後に追加した件数を返す関数
+    
+    Raises:
+        ArchivedPeriodError: appendモードでアーカイブ済みの期間の取引が含まれている場合
+    """
+    from models import Transaction, MonthlySummary
+    from rollup import summary_row
+    from ledger import apply_ledger_changes
+    from accounts import reset_accounts
+    from archive import clear_archive, ensure_writable
+    from changes import require_full_resync
+    from write_queue import rebalance_after_write
+    from flask import current_app
     
+    if overwrite_mode == 'replace':
+        # replaceモードの場合、既存データを全削除（アーカイブも削除されるため、期間の制限はない）
+        current_app.logger.info("replaceモードでCSVインポート - 既存データを削除中")
+        Transaction.query.delete()
+        if clear_archive():
+            # アーカイブ済みの取引の削除は変更履歴に残らないため、クライアントに全件を取得し直させる
+            require_full_resync()
+        MonthlySummary.query.delete()
+        reset_accounts()
+        apply_ledger_changes()
+    else:
+        # 追加する場合は、アーカイブ済みの期間の取引を含められない
+        ensure_writable(*(t['date'] for t in transactions_data))
+    
+    earliest_dates = {}
+    for transaction_data in transactions_data:
+        # 新しいトランザクションを作成（balanceは一時的に0で作成）
+        transaction = Transaction(
+            account=transaction_data['account'],
+            date=transaction_data['date'],
+            item=transaction_data['item'],
+            type=transaction_data['type'],
+            amount=transaction_data['amount'],
+            balance=0  # 後で再計算する
+        )
+        db.session.add(transaction)
+        account = transaction_data['account']
+        if account not in earliest_dates or transaction_data['date'] < earliest_dates[account]:
+            earliest_dates[account] = transaction_data['date']
+    
+    # 月次集計などの派生データに差分を反映
+    apply_ledger_changes(added=[summary_row(t) for t in transactions_data])
+    
+    # インポートした口座の残高を、追加した最も古い日時以降だけ再計算
+    for account, from_date in sorted(earliest_dates.items()):
+        rebalance_after_write(account, from_date)
+    
+    imported_count = len(transactions_data)
+    return lambda: imported_count
+
+def rebalance_account(account, from_date=None):
+    """指定口座の残高を指定日時以降だけ再計算する（コミットは呼び出し元で行う）
+
+    from_dateより前の最後の取引の残高（ない場合は期首残高）を起点に、from_date以降の取引を
+    (date, id)順に積み上げ、残高が変わった行だけを更新します。
+
     Args:
         account (str): 口座名
+        from_date (datetime): 再計算を開始する日時（Noneの場合は全取引）
+
+    Returns:
+        int: 残高を更新した取引数
     """
+    from sqlalchemy import update
     from models import Transaction
-    
-    txs = Transaction.query.filter_by(account=account).order_by(Transaction.date, Transaction.id).all()
-    running_balance = 0
-    for tx in txs:
-        if tx.type == 'income':
-            running_balance += tx.amount
-        else:
-            running_balance -= tx.amount
-        tx.balance = running_balance
-    db.session.commit()
\ No newline at end of file
+    from archive import get_opening_balance
+
+    running_balance = None
+    query = db.session.query(
+        Transaction.id, Transaction.type, Transaction.amount, Transaction.balance
+    ).filter(Transaction.account == account)
+
+    if from_date is not None:
+        previous = db.session.query(Transaction.balance).filter(
+            Transaction.account == account, Transaction.date < from_date
+        ).order_by(Transaction.date.desc(), Transaction.id.desc()).first()
+        if previous:
+            running_balance = previous[0]
+        query = query.filter(Transaction.date >= from_date)
+    if running_balance is None:
+        running_balance = get_opening_balance(account)
+
+    updates = []
+    for tx_id, tx_type, amount, balance in query.order_by(Transaction.date, Transaction.id):
+        running_balance += amount if tx_type == 'income' else -amount
+        if balance != running_balance:
+            updates.append({'id': tx_id, 'balance': running_balance})
+
+    if updates:
+        db.session.execute(update(Transaction), updates)
+    return len(updates)
\ No newline at end of file
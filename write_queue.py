@@ -0,0 +1,256 @@
+"""
+Server Money - 取引の書き込みキュー（単一ライター・グループコミット）
+
+このファイルは、取引の追加・編集・削除（一括更新・一括削除・CSVインポート・残高の修復を含む）をキューに入れ、
+プロセスごとに1つの書き込みスレッドが順番に適用する仕組みを提供します。
+
+書き込みスレッドは、キューに溜まっている要求（最大WRITE_BATCH_MAX件、最初の要求から
+WRITE_BATCH_WINDOW_MSまで待機）をまとめて1つのDBトランザクション（BEGIN IMMEDIATE）で適用し、
+1回のコミットで確定します。要求ごとにセーブポイントを作るため、1件の失敗は他の要求に影響せず、
+各要求には個別の結果が返されます。マルチテナントモードでは、要求を受け付けたユーザーのシャードごとに
+DBトランザクションを分けて適用します。残高の再計算（rebalance_after_write）はバッチ内で口座ごとにまとめ、
+最も古い日時から1回だけ行います。
+BEGIN IMMEDIATEで書き込みロックを先に取得するため、残高の読み取りから更新までの間に
+他のプロセスの書き込みが割り込むこともありません。
+"""
+
+import os
+import queue
+import threading
+import time
+from sqlalchemy import text
+from models import db
+from database import use_tenant_shard, get_tenant_shard
+from ledger import get_pending_change_mark, discard_pending_changes
+from utils import rebalance_account
+from server_timing import timing_phase
+
+# バッチ内で再計算を待っている口座と開始日時をセッションに保持するキー
+_REBALANCE_KEY = 'write_queue_rebalance'
+
+class WriteQueueBusy(RuntimeError):
+    """書き込みキューが満杯、または待ち時間の上限を超えた"""
+
+def rebalance_after_write(account, from_date):
+    """口座の残高を指定日時以降で再計算する（書き込みキューのバッチ内ではコミット直前にまとめて行う）
+
+    Args:
+        account (str): 口座名
+        from_date (datetime): 再計算を開始する日時
+    """
+    pending = db.session.info.get(_REBALANCE_KEY)
+    if pending is None:
+        rebalance_account(account, from_date)
+    elif account not in pending or from_date < pending[account]:
+        pending[account] = from_date
+
+def apply_pending_rebalances():
+    """バッチ内で待っている残高の再計算を今すぐ行う（保存された残高を読み取る書き込みの前に呼び出す）
+
+    要求が失敗した場合は、セーブポイントのロールバックとともに待っていた再計算も元に戻る。
+    """
+    pending = db.session.info.get(_REBALANCE_KEY)
+    if pending:
+        for account, from_date in pending.items():
+            rebalance_account(account, from_date)
+        pending.clear()
+
+class _WriteRequest:
+    """書き込みキューに入れる1件の要求"""
+
+    __slots__ = ('operation', 'shard', 'result', 'error', 'state', 'done', '_lock')
+
+    def __init__(self, operation, shard=None):
+        self.operation = operation
+        self.shard = shard
+        self.result = None
+        self.error = None
+        self.state = 'queued'
+        self.done = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        """適用を開始する（取り消し済みの場合はFalse）"""
+        with self._lock:
+            if self.state != 'queued':
+                return False
+            self.state = 'running'
+            return True
+
+    def cancel(self):
+        """まだ適用されていない要求を取り消す（適用中・適用済みの場合はFalse）"""
+        with self._lock:
+            if self.state != 'queued':
+                return False
+            self.state = 'cancelled'
+            return True
+
+    def finish(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self.state = 'done'
+        self.done.set()
+
+class TransactionWriter:
+    """取引の書き込みを1つのスレッドで順番に適用し、まとめてコミットする"""
+
+    def __init__(self):
+        self._app = None
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """アプリケーションを登録する（スレッドは最初の書き込み時に起動）
+
+        Args:
+            app: Flaskアプリケーションインスタンス
+        """
+        self._app = app
+
+    def _ensure_started(self):
+        """書き込みスレッドを起動する（fork後のワーカープロセスでは作り直す）"""
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._queue = queue.Queue(maxsize=self._app.config['WRITE_QUEUE_SIZE'])
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='transaction-writer', daemon=True)
+            self._thread.start()
+
+    def submit(self, operation):
+        """書き込みを適用し、結果を返す
+
+        operationは書き込みスレッドのセッションで実行され、コミット後に呼び出す関数を返します。
+        その関数の戻り値がsubmitの戻り値になります（コミット後の値でレスポンスを組み立てるため）。
+        operationが送出した例外は、その要求の呼び出し元でそのまま送出されます。
+
+        Args:
+            operation: 書き込みを行う引数なしの関数（コミットは行わないこと）
+
+        Returns:
+            コミット後に呼び出した関数の戻り値
+
+        Raises:
+            WriteQueueBusy: キューが満杯、または待ち時間の上限を超えた場合
+        """
+        request = _WriteRequest(operation, get_tenant_shard())
+        # 書き込みの待ち時間と適用は、リクエストの処理時間のdbフェーズに含める
+        with timing_phase('db'):
+            if not self._app.config['WRITE_QUEUE_ENABLED']:
+                # キューを使わない場合は、呼び出し元のスレッドで1件だけのバッチとして適用する
+                request.start()
+                self._apply_batch([request], request.shard)
+            else:
+                self._ensure_started()
+                try:
+                    self._queue.put_nowait(request)
+                except queue.Full:
+                    raise WriteQueueBusy('書き込み待ちが上限に達しています')
+                if not request.done.wait(self._app.config['WRITE_TIMEOUT']) and request.cancel():
+                    raise WriteQueueBusy('書き込みの待ち時間が上限を超えました')
+                # 適用が始まっていた場合は完了を待つ（バッチの処理時間で待ち時間は限られる）
+                request.done.wait()
+
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _collect_batch(self):
+        """最初の要求を待ち、待機時間内に届いた要求をまとめて取り出す"""
+        config = self._app.config
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + config['WRITE_BATCH_WINDOW_MS'] / 1000
+        while len(batch) < config['WRITE_BATCH_MAX']:
+            try:
+                # 既にキューにある要求は待たずに取り出し、空の場合だけ残り時間まで待つ
+                batch.append(self._queue.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return [request for request in batch if request.start()]
+
+    def _run(self):
+        """書き込みスレッドのメインループ"""
+        while True:
+            # シャード（単一テナントの場合はNone）ごとに、受け付けた順で適用する
+            groups = {}
+            for request in self._collect_batch():
+                groups.setdefault(request.shard, []).append(request)
+            for shard, batch in groups.items():
+                try:
+                    self._apply_batch(batch, shard)
+                except Exception as e:
+                    # 想定外のエラーでもスレッドを止めず、待っている要求に返す
+                    for request in batch:
+                        if not request.done.is_set():
+                            request.finish(error=e)
+
+    def _apply_batch(self, batch, shard=None):
+        """要求をまとめて1つのDBトランザクションで適用し、1回でコミットする
+
+        Args:
+            batch (list): 適用を開始した_WriteRequestのリスト
+            shard: 書き込み先のテナントのシャード（単一テナントの場合はNone）
+        """
+        app = self._app
+        with app.app_context():
+            if shard is not None:
+                use_tenant_shard(shard)
+            applied = []
+            try:
+                # 書き込みロックを先に取得し、他のプロセスの書き込みと読み取り・更新が交錯しないようにする
+                db.session.execute(text('BEGIN IMMEDIATE'))
+            except Exception as e:
+                db.session.rollback()
+                app.logger.error(f"書き込みトランザクションを開始できませんでした: {e}", exc_info=True)
+                for request in batch:
+                    request.finish(error=e)
+                return
+
+            rebalances = db.session.info[_REBALANCE_KEY] = {}
+            for request in batch:
+                mark = get_pending_change_mark()
+                requested = dict(rebalances)
+                savepoint = db.session.begin_nested()
+                try:
+                    respond = request.operation()
+                    savepoint.commit()
+                    applied.append((request, respond))
+                except Exception as e:
+                    savepoint.rollback()
+                    discard_pending_changes(mark)
+                    rebalances.clear()
+                    rebalances.update(requested)
+                    request.finish(error=e)
+
+            try:
+                del db.session.info[_REBALANCE_KEY]
+                for account, from_date in rebalances.items():
+                    rebalance_account(account, from_date)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                app.logger.error(f"取引の書き込みのコミットに失敗しました: {e}", exc_info=True)
+                for request, _respond in applied:
+                    request.finish(error=e)
+                return
+
+            if len(batch) > 1:
+                app.logger.debug(f"取引の書き込みをまとめてコミットしました: {len(applied)}/{len(batch)}件")
+
+            for request, respond in applied:
+                try:
+                    request.finish(result=respond())
+                except Exception as e:
+                    request.finish(error=e)
+
+transaction_writer = TransactionWriter()